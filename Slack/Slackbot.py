@@ -1,5 +1,5 @@
 import os
-import openai
+import sys
 import json
 import hmac
 import hashlib
@@ -8,25 +8,31 @@ import re
 import requests
 import logging
 import threading
+import multiprocessing
 import datetime
-from functools import lru_cache
-from io import BytesIO
 
-from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 from slack_bolt.adapter.flask import SlackRequestHandler
 from slack_bolt import App
 from dotenv import find_dotenv, load_dotenv
-from flask import Flask, request, jsonify, abort
-
-from langchain.chains import ConversationalRetrievalChain
-from langchain_openai import ChatOpenAI
-from langchain_community.document_loaders import DirectoryLoader
-from langchain.indexes import VectorstoreIndexCreator
-from langchain_openai import OpenAIEmbeddings
-
-# For PDF processing
-from PyPDF2 import PdfReader
+from flask import Flask, Response, request, jsonify, abort
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Shared modules live in the repository root, next to localai.py
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+# LangChain's OpenAI and Chroma integrations, tiktoken and NumPy take seconds to import; they are
+# imported by warm_up() in the background so the HTTP server can start listening right away
+from singleflight import SingleFlight
+from work_queue import WorkQueue, RecentIds
+from slack_stream import SlackStreamer, ChannelRateLimiter
+from interaction_store import InteractionStore
+from corpus_registry import DEFAULT_CORPUS, CorpusRegistry, directory_size, parse_mapping
+from metrics import MetricsRegistry, StageTimer, TimedEmbeddings
+from http_clients import build_http_session, build_slack_client
+from llm_scheduler import BULK, DEFAULT_COMPLETION_TOKENS, INTERACTIVE, LLMScheduler, ScheduledLLM, SchedulerTimeout
+from sessions import SessionStore, answer_prompt, summarize_turns
 
 # --------------------------
 # Setup Logging
@@ -42,13 +48,53 @@ load_dotenv()  # Load environment variables from .env file
 SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN")
 SLACK_SIGNING_SECRET = os.getenv("SLACK_SIGNING_SECRET")
 SLACK_BOT_USER_ID = os.getenv("SLACK_BOT_USER_ID")  # This is set after fetching
+# Override to point the bot at a local Slack API stub (see benchmarks/)
+SLACK_API_URL = os.getenv("SLACK_API_URL", "https://slack.com/api/")
 
 # Admin user IDs for role-based access (replace with your admin IDs)
 ADMIN_USER_IDS = os.getenv("ADMIN_USER_IDS", "").split(",")
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
-openai.api_key = OPENAI_API_KEY
+
+# --------------------------
+# Metrics
+# Counters and per-stage latency histograms, served on /metrics and summarized in /status.
+# --------------------------
+metrics = MetricsRegistry(prefix="localai_")
+queries_total = metrics.counter("queries_total", "Questions answered or attempted")
+llm_queries_total = metrics.counter("llm_queries_total", "Questions that reached the LLM (not cached or coalesced)")
+prompt_tokens_total = metrics.counter("prompt_tokens_total", "Prompt tokens sent to the LLM")
+files_processed_total = metrics.counter("files_processed_total", "Uploaded files analyzed")
+errors_total = metrics.counter("errors_total", "Errors while handling requests")
+stage_timers = {
+    "slack_ack": metrics.histogram("slack_ack_seconds", "Time to handle and ack a Slack HTTP request"),
+    "query": metrics.histogram("query_seconds", "End-to-end time to answer a question"),
+    "retrieval": metrics.histogram("retrieval_seconds", "Hybrid retrieval time per question"),
+    "embedding": metrics.histogram("embedding_seconds", "Embedding model call latency (cache misses only)"),
+    "llm_first_token": metrics.histogram("llm_first_token_seconds", "Time from LLM call to first streamed token"),
+    "llm_total": metrics.histogram("llm_seconds", "Total LLM call time"),
+    "slack_post": metrics.histogram("slack_post_seconds", "Slack message post/update latency"),
+    "file_download": metrics.histogram("file_download_seconds", "Uploaded file download time"),
+    "file_parse": metrics.histogram("file_parse_seconds", "Uploaded file text extraction time"),
+}
+
+# --------------------------
+# LLM Scheduling
+# Every LLM call takes a slot: at most LLM_MAX_CONCURRENCY at once and LLM_USER_CONCURRENCY per
+# user, within optional tokens-per-minute budgets (0 = unlimited). Mentions and questions go
+# before file analysis and summaries, and admins get LLM_ADMIN_SLOTS extra slots of their own.
+# --------------------------
+llm_scheduler = LLMScheduler(
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+    user_concurrency=int(os.getenv("LLM_USER_CONCURRENCY", "2")),
+    tokens_per_minute=int(os.getenv("LLM_TOKENS_PER_MINUTE", "0")),
+    user_tokens_per_minute=int(os.getenv("LLM_USER_TOKENS_PER_MINUTE", "0")),
+    admin_slots=int(os.getenv("LLM_ADMIN_SLOTS", "1")),
+    timeout=int(os.getenv("LLM_QUEUE_TIMEOUT", "300")) or None,
+    registry=metrics,
+)
+LLM_BUSY_MESSAGE = "I'm handling too many requests right now. Please try again in a few minutes."
 
 # --------------------------
 # History Folder Setup
@@ -58,32 +104,35 @@ HISTORY_FOLDER = os.getenv("HISTORY_FOLDER", "History")
 if not os.path.exists(HISTORY_FOLDER):
     os.makedirs(HISTORY_FOLDER)
 
-def get_today_history_file():
-    today_str = datetime.datetime.now().strftime("%Y%m%d")
-    return os.path.join(HISTORY_FOLDER, f"history_{today_str}.txt")
-
-def log_interaction(user_id, query, response):
-    now = datetime.datetime.now().isoformat()
-    log_file = get_today_history_file()
-    try:
-        with open(log_file, "a", encoding="utf-8") as f:
-            f.write(f"Timestamp: {now}\nUser: {user_id}\nQuery: {query}\nResponse: {response}\n{'-'*40}\n")
-    except Exception as e:
-        logger.error(f"Error logging interaction: {e}")
+# Interactions are queued here and written to SQLite in batches by a background thread
+interaction_store = InteractionStore(os.path.join(HISTORY_FOLDER, "interactions.sqlite"))
+
+def log_interaction(user_id, query, response, kind="query", channel=None, started=None, usage=None):
+    usage = usage or {}
+    interaction_store.record(
+        "slack", query, response, kind=kind, user_id=user_id, channel=channel,
+        latency_ms=int((time.monotonic() - started) * 1000) if started else None,
+        prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"),
+        cache_hit=usage.get("cache_hit", False),
+        error=usage.get("error", False),
+    )
 
-def summarize_history():
-    log_file = get_today_history_file()
-    if not os.path.exists(log_file):
-        return "No history found for today."
+def summarize_history(days=1):
+    today = datetime.date.today()
+    dates = [(today - datetime.timedelta(days=back)).strftime("%Y%m%d") for back in range(days - 1, -1, -1)]
     try:
-        with open(log_file, "r", encoding="utf-8") as f:
-            content = f.read()
-        summary_prompt = (
-            "Analyze the following conversation history and provide a summary of the key questions asked, "
-            "identify common themes, and highlight areas where additional training might be beneficial:\n\n" + content
-        )
-        summary = query_openai_model(summary_prompt, custom_pretext)
+        # Summaries read from the database, so anything still queued is written first
+        interaction_store.flush()
+        summary = history_summarizer.summarize_days([
+            (day, lambda offset, day=day: interaction_store.read_day_since(day, offset))
+            for day in dates
+        ])
+        if summary is None:
+            return "No history found for today." if days == 1 else f"No history found for the last {days} days."
         return summary
+    except SchedulerTimeout as e:
+        logger.warning(f"History summary not finished: {e}")
+        return LLM_BUSY_MESSAGE
     except Exception as e:
         logger.error(f"Error summarizing history: {e}")
         return "An error occurred while summarizing the history."
@@ -91,12 +140,25 @@ def summarize_history():
 # --------------------------
 # Initialize LangChain Components
 # --------------------------
-embeddings_model = OpenAIEmbeddings(api_key=OPENAI_API_KEY)
-# Path to your LocalAI directory (update if needed)
-LOCALAI_DIR = "C:\\Users\\Mattb\\Desktop\\BishopFX Trade Server\\src\\LocalAI"
-
-loader = DirectoryLoader(LOCALAI_DIR)
-index = VectorstoreIndexCreator(embedding=embeddings_model).from_loaders([loader])
+# Path to your LocalAI directory; defaults to this repository
+LOCALAI_DIR = os.getenv("LOCALAI_DIR", "").strip() or REPO_DIR
+# Persisted index location; only files changed since the last run are re-embedded
+INDEX_FOLDER = os.getenv("INDEX_FOLDER", "Index")
+# The bot's own data never becomes part of the corpus, even when it sits inside LOCALAI_DIR
+INDEX_EXCLUDE_DIRS = (INDEX_FOLDER, HISTORY_FOLDER)
+# Vector store: "chroma", or "flat" / "flat-int8" for a memory-mapped matrix searched with NumPy
+# (int8 quarters the size on disk and in memory). Changing it rebuilds the index from the embedding cache.
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+# Near-copies of indexed files and chunks (estimated Jaccard at or above this) are recorded
+# as pointers instead of embedded, so they don't crowd the retriever's k slots; 0 turns it off
+DEDUPE_THRESHOLD = float(os.getenv("DEDUPE_THRESHOLD", "0.9"))
+# Chunk embeddings are cached by model + text hash, so unchanged chunks are never re-embedded.
+# Created by warm_up(), like the other components that need LangChain.
+embeddings_model = None
+# Parallel ingestion: worker processes (default: CPU count), per-file timeout and size cap
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0")) or None
+INGEST_TIMEOUT = int(os.getenv("INGEST_TIMEOUT", "120"))
+INGEST_MAX_FILE_MB = int(os.getenv("INGEST_MAX_FILE_MB", "50"))
 
 # Adjusted custom pretext for the LocalAI assistant
 custom_pretext = (
@@ -109,60 +171,305 @@ custom_pretext = (
     "Avoid any formatting that is not supported by Slack.\n\n"
 )
 
-chain = ConversationalRetrievalChain.from_llm(
-    llm=ChatOpenAI(model="gpt-4o-2024-05-13"),
-    retriever=index.vectorstore.as_retriever(search_kwargs={"k": 20}),
+# Hybrid BM25 + vector retrieval: chunks per prompt, candidates per index, MMR diversification
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "10"))
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", "40"))
+RETRIEVAL_USE_MMR = os.getenv("RETRIEVAL_USE_MMR", "1") == "1"
+CHAT_MODEL = "gpt-4o-2024-05-13"
+# Tokens of retrieved context per prompt; 0 uses the model's default budget
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0"))
+
+def build_chain(store):
+    from langchain.chains import ConversationalRetrievalChain
+    from langchain_openai import ChatOpenAI
+    from context_packer import ContextPacker
+
+    # Answers stream token by token into Slack; the question-condensing step doesn't need to.
+    # A follow-up is condensed into a standalone question for retrieval only: the answer is written
+    # for the question as asked, with the pretext and the thread's history in the prompt.
+    return ConversationalRetrievalChain.from_llm(
+        llm=ChatOpenAI(model=CHAT_MODEL, streaming=True),
+        condense_question_llm=ChatOpenAI(model=CHAT_MODEL),
+        retriever=store.as_retriever(
+            k=RETRIEVAL_K, fetch_k=RETRIEVAL_FETCH_K, use_mmr=RETRIEVAL_USE_MMR,
+            packer=ContextPacker(CHAT_MODEL, budget=CONTEXT_TOKEN_BUDGET or None),
+        ),
+        combine_docs_chain_kwargs={"prompt": answer_prompt()},
+        rephrase_question=False,
+    )
+
+# --------------------------
+# Conversation Sessions
+# Follow-ups in a thread are answered with that thread's history. Past SESSION_COMPACT_TOKENS,
+# older turns are folded into a running summary (a bulk LLM call made after the answer is
+# posted), keeping the last SESSION_KEEP_TURNS verbatim. Idle threads are forgotten after SESSION_TTL.
+# --------------------------
+sessions = SessionStore(
+    summarize=lambda summary, turns: summarize_turns(session_llm, summary, turns),
+    max_sessions=int(os.getenv("SESSION_MAX", "1000")),
+    ttl_seconds=int(os.getenv("SESSION_TTL", "86400")),
+    compact_tokens=int(os.getenv("SESSION_COMPACT_TOKENS", "1500")),
+    keep_turns=int(os.getenv("SESSION_KEEP_TURNS", "2")),
+    model=CHAT_MODEL,
+)
+
+class ActiveIndex:
+    """
+    A corpus's index, chain and answer cache, which queries run against.
+    Re-indexing replaces it as a whole, never in place.
+    """
+    def __init__(self, name, store):
+        from answer_cache import AnswerCache
+
+        self.name = name
+        self.store = store
+        self.index = store.index
+        self.chain = build_chain(store)
+        self.version = store.version
+        # Answers are cached per corpus, next to its index, and only for the live version
+        self.answers = AnswerCache(
+            os.path.join(store.index_dir, "answers.sqlite"),
+            embedding=embeddings_model,
+            similarity_threshold=ANSWER_CACHE_SIMILARITY,
+            ttl_seconds=ANSWER_CACHE_TTL,
+            max_entries=ANSWER_CACHE_MAX_ENTRIES,
+        )
+        self.answers.invalidate(self.version)
+
+    def close(self):
+        self.store.close()
+        self.answers.close()
+
+def load_corpus(name, folder):
+    from index_store import PersistentIndex, index_dir_for
+
+    store = PersistentIndex(
+        folder, index_dir_for(folder, INDEX_FOLDER), embeddings_model,
+        workers=INGEST_WORKERS, parse_timeout=INGEST_TIMEOUT, max_file_bytes=INGEST_MAX_FILE_MB * 1024 * 1024,
+        backend=VECTOR_BACKEND, dedupe_threshold=DEDUPE_THRESHOLD,
+    )
+    store.refresh(exclude_dirs=INDEX_EXCLUDE_DIRS)
+    store.publish()
+    logger.info(f"Embedding cache: {embeddings_model.stats_summary()}")
+    return ActiveIndex(name, store)
+
+# --------------------------
+# Corpora
+# Channels can have their own document sets. CORPORA names folders ("sales=/srv/docs/sales,...")
+# and CHANNEL_CORPORA maps channel ids to those names; other channels use LOCALAI_DIR.
+# Each corpus's index is loaded on first use, and the least recently used ones are
+# unloaded once more than MAX_LOADED_CORPORA or CORPUS_MEMORY_MB (estimated from the
+# index size on disk) are loaded.
+# --------------------------
+CORPORA = parse_mapping(os.getenv("CORPORA", ""))
+CHANNEL_CORPORA = parse_mapping(os.getenv("CHANNEL_CORPORA", ""))
+MAX_LOADED_CORPORA = int(os.getenv("MAX_LOADED_CORPORA", "4"))
+CORPUS_MEMORY_MB = int(os.getenv("CORPUS_MEMORY_MB", "0"))  # 0: only the count limit applies
+corpora = CorpusRegistry(
+    load_corpus,
+    unload=lambda current: current.close(),
+    size_of=lambda current: directory_size(current.store.data_dir),
+    max_loaded=MAX_LOADED_CORPORA,
+    max_bytes=CORPUS_MEMORY_MB * 1024 * 1024 or None,
 )
+corpora.register(DEFAULT_CORPUS, LOCALAI_DIR)
+for corpus_name, corpus_folder in CORPORA.items():
+    corpora.register(corpus_name, corpus_folder)
+for channel_id, corpus_name in CHANNEL_CORPORA.items():
+    corpora.assign_channel(channel_id, corpus_name)
 
 # --------------------------
 # Initialize Slack & Flask Apps
+# One pooled client per upstream, shared by every handler and thread
 # --------------------------
-app = App(token=SLACK_BOT_TOKEN, signing_secret=SLACK_SIGNING_SECRET)
+HTTP_TIMEOUT = int(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+slack_client = build_slack_client(SLACK_BOT_TOKEN, base_url=SLACK_API_URL, timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES)
+http_session = build_http_session(retries=HTTP_RETRIES)
+app = App(client=slack_client, signing_secret=SLACK_SIGNING_SECRET)
 flask_app = Flask(__name__)
 handler = SlackRequestHandler(app)
 
 # --------------------------
-# Usage Analytics & Caching
+# Caching
 # --------------------------
-usage_stats = {"queries": 0, "files_processed": 0, "errors": 0}
 
-@lru_cache(maxsize=128)
-def cached_query(query_text):
-    result = chain({"question": custom_pretext + query_text, "chat_history": []})
-    return result['answer']
+# Answers are cached on disk per corpus and index version; rephrased questions match by embedding similarity
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))  # 0 disables similarity lookup
 
-def query_openai_model(input_text, custom_pretext, use_cache=False):
+# Concurrent identical questions share one retrieval + LLM call
+in_flight_queries = SingleFlight()
+
+class _TokenPublisher(BaseCallbackHandler):
+    """Relays streamed tokens to every caller waiting on the same in-flight query."""
+    def __init__(self, publish):
+        self.publish = publish
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.publish(token)
+
+def query_openai_model(input_text, custom_pretext, use_cache=False, on_token=None, usage=None, corpus=DEFAULT_CORPUS,
+                       user_id=None, chat_history=None):
+    """
+    Answer input_text from a corpus, as an interactive LLM call on behalf of user_id.
+    chat_history is the conversation so far (see sessions.py); follow-ups bypass the answer cache.
+    If given, usage is filled with cache_hit, prompt_tokens, completion_tokens and error for logging.
+    """
+    usage = usage if usage is not None else {}
+    started = time.perf_counter()
+    queries_total.inc()
     try:
-        usage_stats["queries"] += 1
-        if use_cache:
-            return cached_query(input_text)
-        else:
-            result = chain({"question": custom_pretext + input_text, "chat_history": []})
-            return result['answer']
+        from answer_cache import normalize_query
+        from context_packer import PromptTokenCounter, budget_for_model, count_tokens
+
+        # Hold the corpus for the whole query: a concurrent re-index or eviction can't swap or unload it mid-query
+        with corpora.use(corpus) as current:
+            # The same words mean something else mid-conversation, so only first questions are cached
+            use_cache = use_cache and not chat_history
+            if use_cache:
+                cached = current.answers.get(input_text, current.version, scope=custom_pretext)
+                if cached is not None:
+                    usage["cache_hit"] = True
+                    return cached
+
+            def run(publish):
+                prompt_tokens = PromptTokenCounter(CHAT_MODEL)
+                # Budgeted as a full context window plus the question until the actual usage is known
+                estimate = (
+                    (CONTEXT_TOKEN_BUDGET or budget_for_model(CHAT_MODEL))
+                    + count_tokens(custom_pretext + input_text, CHAT_MODEL) + DEFAULT_COMPLETION_TOKENS
+                )
+                with llm_scheduler.slot(user_id, INTERACTIVE, estimate, admin=is_user_admin(user_id)) as ticket:
+                    result = current.chain(
+                        {"question": custom_pretext + input_text, "chat_history": chat_history or []},
+                        callbacks=[
+                            _TokenPublisher(publish), prompt_tokens,
+                            StageTimer(stage_timers["retrieval"], stage_timers["llm_first_token"], stage_timers["llm_total"]),
+                        ],
+                    )
+                    completion_tokens = count_tokens(result["answer"], CHAT_MODEL)
+                    ticket.record(prompt_tokens.total + completion_tokens)
+                llm_queries_total.inc()
+                prompt_tokens_total.inc(prompt_tokens.total)
+                usage["prompt_tokens"] = prompt_tokens.total
+                usage["completion_tokens"] = completion_tokens
+                logger.info(f"Prompt tokens: {prompt_tokens.total} across {len(prompt_tokens.calls)} LLM call(s)")
+                answer = result['answer']
+                if use_cache:
+                    current.answers.put(input_text, current.version, answer, scope=custom_pretext)
+                return answer
+
+            history = "\0".join(message.content for message in chat_history or [])
+            key = hashlib.sha256(
+                f"{current.name}\0{current.version}\0{custom_pretext}\0{normalize_query(input_text)}\0{history}"
+                .encode("utf-8")
+            ).hexdigest()
+            return in_flight_queries.do(key, run, listener=on_token)
+    except SchedulerTimeout as e:
+        usage["error"] = True
+        logger.warning(f"Query not answered: {e}")
+        return LLM_BUSY_MESSAGE
     except Exception as e:
-        usage_stats["errors"] += 1
+        errors_total.inc()
+        usage["error"] = True
         logger.error(f"Error querying model: {e}")
         return "An error occurred while processing your query."
+    finally:
+        stage_timers["query"].observe(time.perf_counter() - started)
 
 # --------------------------
 # Re-indexing Functionality
 # --------------------------
-def reindex():
-    global loader, index, chain
+reindex_lock = threading.Lock()
+reindex_status = {
+    "state": "idle",
+    "corpus": None,
+    "requested_by": None,
+    "started_at": None,
+    "finished_at": None,
+    "message": "No re-index has run since startup.",
+}
+
+def reindex(corpus=DEFAULT_CORPUS):
+    """Refresh a copy of a corpus's live index off to the side, then swap it in as a whole."""
     try:
-        loader = DirectoryLoader(LOCALAI_DIR)
-        index = VectorstoreIndexCreator(embedding=embeddings_model).from_loaders([loader])
-        chain = ConversationalRetrievalChain.from_llm(
-            llm=ChatOpenAI(model="gpt-4o-2024-05-13"),
-            retriever=index.vectorstore.as_retriever(search_kwargs={"k": 20}),
+        with corpora.use(corpus) as current:
+            next_store = current.store.fork()
+            try:
+                stats = next_store.refresh(exclude_dirs=INDEX_EXCLUDE_DIRS)
+            except Exception:
+                next_store.discard()
+                raise
+            logger.info(f"Embedding cache: {embeddings_model.stats_summary()}")
+            version = current.version
+            if next_store.version != current.version:
+                next_active = ActiveIndex(corpus, next_store)
+                next_store.publish()
+                # Queries still running on the old index finish before it is closed
+                corpora.replace(corpus, next_active)
+                version = next_active.version
+                # Older generations go once no query holds them; one still in use is removed by a later re-index
+                next_store.prune()
+            else:
+                next_store.discard()
+        logger.info(f"Index {corpus} re-built successfully.")
+        name = "" if corpus == DEFAULT_CORPUS else f" *{corpus}*"
+        return True, (
+            f"Index{name} has been re-built (version {version}): {stats['added']} added, "
+            f"{stats['changed']} changed, {stats['removed']} removed, {stats['unchanged']} unchanged."
         )
-        logger.info("Index re-built successfully.")
-        return True, "Index has been re-built."
     except Exception as e:
-        usage_stats["errors"] += 1
+        errors_total.inc()
         logger.error(f"Error during re-indexing: {e}")
         return False, f"Error during re-indexing: {e}"
 
+def _run_reindex_job(corpus, notify):
+    success, message = reindex(corpus)
+    with reindex_lock:
+        reindex_status.update(
+            state="succeeded" if success else "failed",
+            finished_at=datetime.datetime.now().isoformat(timespec="seconds"),
+            message=message,
+        )
+    if notify:
+        try:
+            notify(message)
+        except Exception as e:
+            logger.error(f"Error posting re-index result: {e}")
+
+def start_reindex(user_id, notify=None, corpus=DEFAULT_CORPUS):
+    """Start a background re-index of a corpus unless one is already running. Returns (started, message)."""
+    with reindex_lock:
+        if reindex_status["state"] == "running":
+            return False, f"A re-index is already running (started {reindex_status['started_at']} by <@{reindex_status['requested_by']}>)."
+        reindex_status.update(
+            state="running",
+            corpus=corpus,
+            requested_by=user_id,
+            started_at=datetime.datetime.now().isoformat(timespec="seconds"),
+            finished_at=None,
+            message="Re-index in progress.",
+        )
+    threading.Thread(target=_run_reindex_job, args=(corpus, notify), daemon=True).start()
+    return True, "Re-index started in the background. Queries keep using the current index until it finishes. Mention me with `reindex status` to check on it."
+
+def get_reindex_status(corpus=DEFAULT_CORPUS):
+    with reindex_lock:
+        status = dict(reindex_status)
+    # A status check shouldn't load (and refresh) a cold corpus just to report its version
+    version = corpora.describe_loaded(corpus, lambda current: current.version)
+    lines = [f"*Re-index status:* {status['state']}", f"Live index version ({corpus}): {'not loaded' if version is None else version}"]
+    if status["corpus"]:
+        lines.append(f"Last re-index: {status['corpus']}")
+    if status["started_at"]:
+        lines.append(f"Started: {status['started_at']} by <@{status['requested_by']}>")
+    if status["finished_at"]:
+        lines.append(f"Finished: {status['finished_at']}")
+    lines.append(status["message"])
+    return "\n".join(lines)
+
 # --------------------------
 # Formatting for Slack Output
 # --------------------------
@@ -173,29 +480,97 @@ def format_for_slack(text):
 
 # --------------------------
 # File Processing (Text & PDF Support)
+# Uploads are streamed to disk and analyzed map-reduce style: one LLM call per
+# chunk, run concurrently, then a call that merges the partial analyses.
 # --------------------------
+FILE_MAX_MB = int(os.getenv("FILE_MAX_MB", "100"))
+FILE_CHUNK_TOKENS = int(os.getenv("FILE_CHUNK_TOKENS", "3000"))
+FILE_MAP_CONCURRENCY = int(os.getenv("FILE_MAP_CONCURRENCY", "4"))
+# Created by warm_up(). Daily summaries only cover log entries added since the last /summarize.
+analysis_llm = None
+history_summarizer = None
+session_llm = None
+
 def process_file(file_url, mimetype):
+    from file_analysis import FileTooLarge, download_to_tempfile, extract_text
+
+    path = None
     try:
         headers = {"Authorization": f"Bearer {SLACK_BOT_TOKEN}"}
-        response = requests.get(file_url, headers=headers)
-        if response.status_code != 200:
-            logger.error("Failed to download file.")
-            return None, "Failed to download the file."
-        if "pdf" in mimetype:
-            pdf_bytes = BytesIO(response.content)
-            reader = PdfReader(pdf_bytes)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() or ""
-            return text, None
-        elif "text" in mimetype:
-            return response.text, None
-        else:
+        with stage_timers["file_download"].time():
+            path = download_to_tempfile(
+                file_url, headers=headers, max_bytes=FILE_MAX_MB * 1024 * 1024, session=http_session
+            )
+        with stage_timers["file_parse"].time():
+            text = extract_text(path, mimetype, workers=INGEST_WORKERS)
+        if text is None:
             return None, "File type not supported for analysis."
+        return text, None
+    except FileTooLarge as e:
+        return None, str(e)
+    except requests.RequestException as e:
+        logger.error(f"Failed to download file: {e}")
+        return None, "Failed to download the file."
     except Exception as e:
         logger.error(f"Error processing file: {e}")
-        usage_stats["errors"] += 1
+        errors_total.inc()
         return None, f"Error processing file: {e}"
+    finally:
+        if path:
+            os.remove(path)
+
+def analyze_file_text(text, on_progress=None, user_id=None):
+    from file_analysis import MapReduceAnalyzer
+
+    # Every map and reduce call is a bulk call on the uploader's behalf, so it waits behind questions
+    analyzer = MapReduceAnalyzer(
+        analysis_llm.for_user(user_id, admin=is_user_admin(user_id)), model=CHAT_MODEL, chunk_tokens=FILE_CHUNK_TOKENS,
+        max_concurrency=FILE_MAP_CONCURRENCY, instructions=custom_pretext, on_progress=on_progress,
+    )
+    try:
+        return analyzer.analyze(text)
+    except SchedulerTimeout as e:
+        logger.warning(f"File analysis not finished: {e}")
+        return LLM_BUSY_MESSAGE
+    except Exception as e:
+        errors_total.inc()
+        logger.error(f"Error analyzing file: {e}")
+        return "An error occurred while analyzing the file."
+
+class FileProgress:
+    """Edits a status message in the channel as the analysis of an uploaded file advances."""
+    STAGES = {"analyze": "Analyzing", "map": "Analyzing sections", "reduce": "Combining section analyses"}
+
+    def __init__(self, client, channel, name):
+        self.client = client
+        self.channel = channel
+        self.name = name
+        self.ts = None
+
+    def post(self, text):
+        try:
+            with stage_timers["slack_post"].time():
+                self.ts = self.client.chat_postMessage(channel=self.channel, text=text)["ts"]
+        except SlackApiError as e:
+            logger.error(f"Error posting file progress: {e}")
+
+    def update(self, text, wait=False):
+        if self.ts is None:
+            return
+        # Intermediate progress edits are best effort and skipped while the channel is rate limited
+        if not wait and not slack_limiter.try_acquire(self.channel):
+            return
+        if wait:
+            slack_limiter.acquire(self.channel)
+        try:
+            with stage_timers["slack_post"].time():
+                self.client.chat_update(channel=self.channel, ts=self.ts, text=text)
+        except SlackApiError as e:
+            logger.warning(f"Error updating file progress: {e}")
+
+    def __call__(self, stage, done, total):
+        label = self.STAGES.get(stage, stage)
+        self.update(f"{label} of *{self.name}*: {done}/{total}" if total > 1 else f"{label} *{self.name}*...")
 
 # --------------------------
 # Role-Based Access Check
@@ -212,54 +587,122 @@ def get_bot_user_id():
     if _bot_user_id:
         return _bot_user_id
     try:
-        slack_client = WebClient(token=SLACK_BOT_TOKEN)
         response = slack_client.auth_test()
         _bot_user_id = response["user_id"]
         return _bot_user_id
-    except SlackApiError as e:
+    except (SlackApiError, requests.RequestException) as e:
         logger.error(f"Error fetching bot user id: {e}")
         return None
 
+# --------------------------
+# Event Queue
+# Events are acked immediately and answered by a bounded worker pool.
+# --------------------------
+SLACK_WORKERS = int(os.getenv("SLACK_WORKERS", "8"))
+SLACK_QUEUE_SIZE = int(os.getenv("SLACK_QUEUE_SIZE", "50"))
+event_queue = WorkQueue(SLACK_WORKERS, SLACK_QUEUE_SIZE, name="slack-worker")
+seen_events = RecentIds(ttl_seconds=600)
+
+# Streamed answers are edited into a placeholder message at most this often
+SLACK_STREAM_INTERVAL_MS = int(os.getenv("SLACK_STREAM_INTERVAL_MS", "1000"))
+# Slack allows roughly one message write per second per channel
+slack_limiter = ChannelRateLimiter(min_interval=1.0)
+
+def _run_when_ready(say, job, *args):
+    if not wait_until_ready(SLACK_WARMUP_WAIT):
+        say("Sorry, I couldn't finish loading my index. Please try again later.")
+        return
+    job(*args)
+
+def enqueue_event(body, say, job, *args):
+    """Queue job for a Slack event, dropping duplicate deliveries and pushing back when the queue is full.
+
+    Events that arrive while the bot is warming up are queued too; their workers wait for the index.
+    """
+    event_id = body.get("event_id")
+    if event_id and not seen_events.add(event_id):
+        logger.info(f"Dropping duplicate event {event_id}")
+        return
+    if not event_queue.submit(_run_when_ready, say, job, *args):
+        logger.warning(f"Event queue full, rejecting event {event_id}")
+        # The id is claimed before submitting so concurrent retries can't both run; Slack's retry must not be dropped
+        if event_id:
+            seen_events.discard(event_id)
+        say("I'm busy right now, please retry shortly.")
+        return
+    if not is_ready():
+        say("I'm warming up after a restart. I'll answer as soon as my index has loaded.")
+
 # --------------------------
 # Slack Event: app_mention
 # --------------------------
 @app.event("app_mention")
-def handle_mentions(body, say):
+def handle_mentions(body, say, client):
+    enqueue_event(body, say, process_mention, body, say, client)
+
+def process_mention(body, say, client):
+    started = time.monotonic()
     try:
         event = body.get("event", {})
         text = event.get("text", "")
         user_id = event.get("user", "unknown")
         bot_mention = f"<@{get_bot_user_id()}>"
         text = text.replace(bot_mention, "").strip()
+        corpus = corpora.name_for_channel(event.get("channel"))
+
+        # Check for re-index commands (admin-only); they apply to this channel's corpus
+        if text.lower() in ["reindex status", "re-index status", "index status"]:
+            if not is_user_admin(user_id):
+                say("You do not have permission to perform this action.")
+                return
+            say(get_reindex_status(corpus))
+            return
 
-        # Check for re-index command (admin-only)
         if text.lower() in ["reindex", "re-index", "update index"]:
             if not is_user_admin(user_id):
                 say("You do not have permission to perform this action.")
                 return
-            success, message = reindex()
+            _, message = start_reindex(user_id, notify=say, corpus=corpus)
             say(message)
-            log_interaction(user_id, text, message)
+            log_interaction(user_id, text, message, kind="reindex", channel=event.get("channel"), started=started)
             return
 
-        # Process as a normal query
-        response_text = query_openai_model(text, custom_pretext)
-        formatted_response = format_for_slack(response_text)
-        say(formatted_response)
-        log_interaction(user_id, text, response_text)
+        # Process as a normal query, streaming the answer into a placeholder message. Mentions in a
+        # thread continue its conversation; a top-level mention starts one.
+        session_key = f"{event.get('channel')}:{event.get('thread_ts') or event.get('ts')}"
+        streamer = SlackStreamer(
+            client, event.get("channel"), thread_ts=event.get("thread_ts"), formatter=format_for_slack,
+            limiter=slack_limiter, interval=SLACK_STREAM_INTERVAL_MS / 1000, timer=stage_timers["slack_post"],
+        )
+        streamer.start()
+        usage = {}
+        response_text = query_openai_model(
+            text, custom_pretext, use_cache=True, on_token=streamer.on_llm_new_token, usage=usage, corpus=corpus,
+            user_id=user_id, chat_history=sessions.history(session_key),
+        )
+        streamer.finish(response_text)
+        log_interaction(user_id, text, response_text, channel=event.get("channel"), started=started, usage=usage)
+        if not usage.get("error"):
+            sessions.add_turn(session_key, text, response_text)
+            if streamer.message_ts and not event.get("thread_ts"):
+                # Replies in the thread under the answer continue the same conversation
+                sessions.alias(f"{event.get('channel')}:{streamer.message_ts}", session_key)
     except Exception as e:
         logger.error(f"Error handling app mention: {e}")
-        usage_stats["errors"] += 1
+        errors_total.inc()
         say("An error occurred processing your request.")
 
 # --------------------------
 # Slack Event: file_shared
 # --------------------------
 @app.event("file_shared")
-def handle_file_shared(event, say):
+def handle_file_shared(body, event, say):
+    enqueue_event(body, say, process_file_shared, event, say)
+
+def process_file_shared(event, say):
+    started = time.monotonic()
     try:
         file_id = event.get("file_id")
-        slack_client = WebClient(token=SLACK_BOT_TOKEN)
         file_info_response = slack_client.files_info(file=file_id)
         file_info = file_info_response.get("file", {})
         file_url = file_info.get("url_private_download")
@@ -268,23 +711,34 @@ def handle_file_shared(event, say):
         if not file_url:
             say("Could not retrieve the file URL.")
             return
+        progress = FileProgress(slack_client, event.get("channel_id"), file_info.get("name", "file"))
+        progress.post(f"Downloading *{progress.name}*...")
         file_content, error = process_file(file_url, mimetype)
         if error:
-            say(error)
+            if progress.ts:
+                progress.update(error, wait=True)
+            else:
+                say(error)
             return
-        usage_stats["files_processed"] += 1
-        analysis_prompt = "Please analyze the following file content:\n" + file_content
-        analysis_result = query_openai_model(analysis_prompt, custom_pretext)
+        files_processed_total.inc()
+        analysis_result = analyze_file_text(file_content, on_progress=progress, user_id=user_id)
         formatted_response = format_for_slack(analysis_result)
-        say(formatted_response)
-        log_interaction(user_id, f"File analysis: {file_url}", analysis_result)
+        progress.update(f"Analysis of *{progress.name}* is ready (see thread).", wait=True)
+        if progress.ts:
+            say(text=formatted_response, thread_ts=progress.ts)
+        else:
+            say(formatted_response)
+        log_interaction(
+            user_id, f"File analysis: {file_url}", analysis_result, kind="file",
+            channel=event.get("channel_id"), started=started,
+        )
     except SlackApiError as e:
         logger.error(f"Slack API error: {e}")
-        usage_stats["errors"] += 1
+        errors_total.inc()
         say("Error retrieving file info.")
     except Exception as ex:
         logger.error(f"Error processing file shared event: {ex}")
-        usage_stats["errors"] += 1
+        errors_total.inc()
         say(f"An error occurred while processing the file: {ex}")
 
 # --------------------------
@@ -322,17 +776,23 @@ def handle_analyze_command(ack, body, client):
 @app.view("analyze_modal")
 def handle_modal_submission(ack, body, client, view):
     ack()
+    started = time.monotonic()
     user_id = body.get("user", {}).get("id", "unknown")
     input_value = view["state"]["values"]["input_block"]["input_value"]["value"]
+    if not is_ready():
+        client.chat_postEphemeral(
+            channel=body["view"].get("private_metadata", user_id), user=user_id, text=WARMING_UP_MESSAGE
+        )
+        return
     if re.match(r'https?://', input_value):
         file_content, error = process_file(input_value, "text")
         if error:
             response_text = error
         else:
-            analysis_prompt = "Please analyze the following file content:\n" + file_content
-            response_text = query_openai_model(analysis_prompt, custom_pretext)
+            response_text = analyze_file_text(file_content, user_id=user_id)
     else:
-        response_text = query_openai_model(input_value, custom_pretext)
+        corpus = corpora.name_for_channel(body["view"].get("private_metadata"))
+        response_text = query_openai_model(input_value, custom_pretext, corpus=corpus, user_id=user_id)
     formatted_response = format_for_slack(response_text)
     try:
         client.chat_postEphemeral(
@@ -340,13 +800,19 @@ def handle_modal_submission(ack, body, client, view):
             user=user_id,
             text=formatted_response
         )
-        log_interaction(user_id, input_value, response_text)
+        log_interaction(user_id, input_value, response_text, kind="modal", started=started)
     except SlackApiError as e:
         logger.error(f"Error posting ephemeral message: {e}")
 
 # --------------------------
 # Slash Command: /status (Usage Analytics)
 # --------------------------
+def describe_corpus(current):
+    return (
+        f"index version {current.version}, answer cache {current.answers.stats_summary()}, "
+        f"dedupe {current.store.dedupe_summary()}"
+    )
+
 @app.command("/status")
 def handle_status_command(ack, body, client):
     ack()
@@ -354,11 +820,29 @@ def handle_status_command(ack, body, client):
     if not is_user_admin(user_id):
         client.chat_postEphemeral(channel=body.get("channel_id"), user=user_id, text="You do not have permission to view status.")
         return
+    if not is_ready():
+        client.chat_postEphemeral(channel=body.get("channel_id"), user=user_id, text=f"*Startup:* {startup_summary()}")
+        return
+    queue_stats = event_queue.stats()
+    flight_stats = in_flight_queries.stats()
+    average_prompt = prompt_tokens_total.value // max(llm_queries_total.value, 1)
     status_message = (
         f"*Usage Statistics:*\n"
-        f"Queries processed: {usage_stats['queries']}\n"
-        f"Files processed: {usage_stats['files_processed']}\n"
-        f"Errors encountered: {usage_stats['errors']}"
+        f"Queries processed: {queries_total.value}\n"
+        f"Files processed: {files_processed_total.value}\n"
+        f"Errors encountered: {errors_total.value}\n"
+        f"Startup: {startup_summary()}\n"
+        f"Re-index: {reindex_status['state']}\n"
+        f"Embedding cache: {embeddings_model.stats_summary()}\n"
+        f"Event queue: {queue_stats['depth']}/{queue_stats['max_size']} queued, "
+        f"{queue_stats['busy']}/{queue_stats['workers']} workers busy, {queue_stats['rejected']} rejected as busy\n"
+        f"Coalesced queries: {flight_stats['collapsed']} of {flight_stats['calls']} shared an in-flight answer "
+        f"({flight_stats['upstream']} upstream calls)\n"
+        f"Prompt tokens: {prompt_tokens_total.value} total, {average_prompt} per uncached query\n"
+        f"LLM scheduler: {llm_scheduler.stats_summary()}\n"
+        f"Conversations: {sessions.stats_summary()}\n"
+        f"*Corpora:*\n{corpora.stats_summary(describe=describe_corpus)}\n"
+        f"*Latency (p50/p95/p99):*\n{metrics.latency_summary() or 'No requests yet.'}"
     )
     client.chat_postEphemeral(channel=body.get("channel_id"), user=user_id, text=status_message)
 
@@ -372,9 +856,88 @@ def handle_summarize_command(ack, body, client):
     if not is_user_admin(user_id):
         client.chat_postEphemeral(channel=body.get("channel_id"), user=user_id, text="You do not have permission to view summary.")
         return
-    summary = summarize_history()
+    if not is_ready():
+        client.chat_postEphemeral(channel=body.get("channel_id"), user=user_id, text=WARMING_UP_MESSAGE)
+        return
+    # "/summarize" covers today, "/summarize week" the last 7 days, "/summarize 3" the last 3
+    period = body.get("text", "").strip().lower()
+    days = 7 if period == "week" else int(period) if period.isdigit() and int(period) > 0 else 1
+    summary = summarize_history(days)
     client.chat_postEphemeral(channel=body.get("channel_id"), user=user_id, text=format_for_slack(summary))
 
+# --------------------------
+# Startup & Readiness
+# Flask starts listening immediately; the index, models and caches load in a background
+# thread. /healthz reports the process is up, /readyz whether it can answer questions.
+# --------------------------
+# Seconds a queued event waits for warm-up before giving up
+SLACK_WARMUP_WAIT = int(os.getenv("SLACK_WARMUP_WAIT", "900"))
+WARMING_UP_MESSAGE = "I'm warming up after a restart and my index isn't loaded yet. Please try again in a minute."
+startup_status = {
+    "state": "starting",
+    "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+    "ready_at": None,
+    "seconds": None,
+    "message": "Loading the index.",
+}
+startup_done = threading.Event()
+
+def is_ready():
+    return startup_status["state"] == "ready"
+
+def wait_until_ready(timeout=None):
+    """Block until warm-up finishes or timeout passes. Returns whether the bot is ready."""
+    startup_done.wait(timeout)
+    return is_ready()
+
+def startup_summary():
+    status = dict(startup_status)
+    if status["state"] == "ready":
+        return f"ready since {status['ready_at']} (warm-up took {status['seconds']}s)"
+    return f"{status['state']} since {status['started_at']}: {status['message']}"
+
+def warm_up():
+    """Import LangChain, build the models and caches, and load the index. Run once, in the background."""
+    global embeddings_model, analysis_llm, history_summarizer, session_llm, SLACK_BOT_USER_ID
+    started = time.perf_counter()
+    try:
+        from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+        from embedding_cache import CachedEmbeddings
+        from history_summary import HistorySummarizer
+
+        embeddings_model = CachedEmbeddings(
+            TimedEmbeddings(OpenAIEmbeddings(api_key=OPENAI_API_KEY), stage_timers["embedding"]),
+            os.path.join(INDEX_FOLDER, "embeddings.sqlite"),
+        )
+        analysis_llm = ScheduledLLM(ChatOpenAI(model=CHAT_MODEL), llm_scheduler, priority=BULK)
+        # Summaries are bulk work like file analysis: they wait behind questions
+        summary_llm = analysis_llm.for_user("summaries")
+        session_llm = analysis_llm.for_user("sessions")
+        history_summarizer = HistorySummarizer(
+            os.path.join(HISTORY_FOLDER, "interaction_summaries.sqlite"),
+            summarize=lambda prompt: summary_llm.invoke(custom_pretext + prompt).content,
+            model=CHAT_MODEL,
+        )
+        startup_status["message"] = f"Loading the index from {LOCALAI_DIR}."
+        # Other corpora load when their channels first ask something
+        with corpora.use(DEFAULT_CORPUS) as current:
+            version = current.version
+        SLACK_BOT_USER_ID = get_bot_user_id()
+        print(f"Bot User ID: {SLACK_BOT_USER_ID}")
+        startup_status.update(
+            state="ready",
+            ready_at=datetime.datetime.now().isoformat(timespec="seconds"),
+            seconds=round(time.perf_counter() - started, 1),
+            message=f"Index version {version} loaded.",
+        )
+        logger.info(f"Warm-up finished in {startup_status['seconds']}s")
+    except Exception as e:
+        errors_total.inc()
+        logger.exception("Warm-up failed")
+        startup_status.update(state="failed", message=f"Warm-up failed: {e}")
+    finally:
+        startup_done.set()
+
 # --------------------------
 # Automated Alerts (Background Thread)
 # --------------------------
@@ -383,7 +946,6 @@ def automated_alerts():
         time.sleep(3600)  # Every hour; adjust as needed
         try:
             alert_message = "Automated Alert: Check out the latest high-impact news updates."
-            slack_client = WebClient(token=SLACK_BOT_TOKEN)
             # Replace "#alerts" with your designated channel name
             slack_client.chat_postMessage(channel="#alerts", text=alert_message)
         except Exception as e:
@@ -397,10 +959,30 @@ alert_thread.start()
 # --------------------------
 @flask_app.route("/slack/events", methods=["POST"])
 def slack_events():
-    return handler.handle(request)
-
-SLACK_BOT_USER_ID = get_bot_user_id()
-print(f"Bot User ID: {SLACK_BOT_USER_ID}")
+    # A retry means Slack missed our ack; if the original delivery is already queued, stop the retries here
+    if request.headers.get("X-Slack-Retry-Num"):
+        event_id = (request.get_json(silent=True) or {}).get("event_id")
+        if event_id and event_id in seen_events:
+            logger.info(f"Ignoring Slack retry {request.headers['X-Slack-Retry-Num']} of event {event_id}")
+            return "", 200, {"X-Slack-No-Retry": "1"}
+    with stage_timers["slack_ack"].time():
+        return handler.handle(request)
+
+@flask_app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@flask_app.route("/healthz", methods=["GET"])
+def healthz():
+    return jsonify(status="ok", startup=startup_status["state"])
+
+@flask_app.route("/readyz", methods=["GET"])
+def readyz():
+    return jsonify(ready=is_ready(), **startup_status), 200 if is_ready() else 503
+
+# Ingestion worker processes re-import this script on Windows; only the main process warms up
+if multiprocessing.parent_process() is None:
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
 
 if __name__ == "__main__":
     flask_app.run(port=3000)
@@ -0,0 +1,114 @@
+# history_summary.py
+#
+# Incremental summaries of the bot's interaction history. Each day's summary
+# remembers the last interaction it has read, so a repeat /summarize only
+# summarizes the entries added since and merges them into the summary it already
+# has. Per-segment and merge results are cached by content hash, and multi-day
+# summaries are built from the cached daily summaries rather than the raw logs.
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from file_analysis import split_by_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEGMENT_TOKENS = 3000
+
+SEGMENT_PROMPT = (
+    "Analyze the following conversation history and provide a summary of the key questions asked, "
+    "identify common themes, and highlight areas where additional training might be beneficial:\n\n"
+)
+MERGE_PROMPT = (
+    "The following are summaries of consecutive parts of a conversation history. Combine them into one summary "
+    "of the key questions asked, common themes, and areas where additional training might be beneficial:\n\n"
+)
+
+
+class HistorySummarizer:
+    """Rolling daily summaries plus hierarchical multi-day summaries, cached in SQLite."""
+
+    def __init__(self, cache_path, summarize, segment_tokens=DEFAULT_SEGMENT_TOKENS, model=""):
+        self.summarize = summarize  # Callable: prompt -> summary text
+        self.segment_tokens = segment_tokens
+        self.model = model
+        # One /summarize at a time; concurrent runs would summarize the same tail twice
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS days (
+                day TEXT PRIMARY KEY,
+                offset INTEGER NOT NULL,  -- Position read_since returned last, e.g. a row id
+                summary TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS partials (
+                key TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+    def _cached(self, prompt, text):
+        """Summarize prompt + text, reusing the stored result for identical input."""
+        key = hashlib.sha256((prompt + text).encode("utf-8")).hexdigest()
+        row = self._conn.execute("SELECT summary FROM partials WHERE key = ?", (key,)).fetchone()
+        if row:
+            return row[0]
+        summary = self.summarize(prompt + text)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO partials (key, summary, created_at) VALUES (?, ?, ?)", (key, summary, time.time())
+        )
+        self._conn.commit()
+        return summary
+
+    def _merge(self, summaries):
+        """Merge summaries into one, in rounds if they don't fit in a single prompt."""
+        summaries = [summary for summary in summaries if summary]
+        while len(summaries) > 1:
+            groups = split_by_tokens("\n\n---\n\n".join(summaries), self.segment_tokens, self.model)
+            merged = [self._cached(MERGE_PROMPT, group) for group in groups]
+            if len(merged) >= len(summaries):
+                # A group that won't shrink further is merged in one last call
+                return self._cached(MERGE_PROMPT, "\n\n---\n\n".join(summaries))
+            summaries = merged
+        return summaries[0] if summaries else None
+
+    def _day_summary(self, day, read_since):
+        row = self._conn.execute("SELECT offset, summary FROM days WHERE day = ?", (day,)).fetchone()
+        offset, summary = row if row else (0, None)
+        text, new_offset = read_since(offset)
+        if not text.strip():
+            return summary
+
+        segments = split_by_tokens(text, self.segment_tokens, self.model)
+        logger.info(f"Summarizing {len(segments)} new segment(s) of the {day} history")
+        partials = [self._cached(SEGMENT_PROMPT, segment) for segment in segments]
+        summary = self._merge([summary] + partials)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO days (day, offset, summary, updated_at) VALUES (?, ?, ?, ?)",
+            (day, new_offset, summary, time.time()),
+        )
+        self._conn.commit()
+        return summary
+
+    def summarize_days(self, days):
+        """
+        Summarize several days of history. days is a list of (day, read_since) pairs, oldest first,
+        where read_since(offset) returns the day's text after offset and the offset it read up to.
+        Returns None when there is no history at all.
+        """
+        with self._lock:
+            daily = [(day, self._day_summary(day, read_since)) for day, read_since in days]
+            daily = [(day, summary) for day, summary in daily if summary]
+            if len(daily) <= 1:
+                return daily[0][1] if daily else None
+            return self._merge([f"{day}:\n{summary}" for day, summary in daily])
@@ -0,0 +1,175 @@
+# slack_stream.py
+#
+# Streams an LLM answer into Slack. A placeholder message is posted right away
+# and then edited with chat_update as tokens arrive. Updates are batched on an
+# interval and spaced per channel so we stay inside Slack's rate limits, and
+# answers longer than a single message are continued in follow-up messages.
+
+import time
+import logging
+import threading
+
+from slack_sdk.errors import SlackApiError
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+# Slack renders up to ~4000 characters per message comfortably; leave room for formatting
+SLACK_MESSAGE_LIMIT = 3900
+DEFAULT_UPDATE_INTERVAL = 1.0  # Seconds between edits of a streaming message
+MAX_ATTEMPTS = 3  # Attempts for writes that must land (placeholder, final text)
+PLACEHOLDER_TEXT = "_Thinking..._"
+
+
+class ChannelRateLimiter:
+    """Spaces out writes to each channel and honors Retry-After when Slack pushes back."""
+
+    def __init__(self, min_interval=1.0):
+        self.min_interval = min_interval
+        self._next_allowed = {}
+        self._lock = threading.Lock()
+
+    def try_acquire(self, channel):
+        """Take a write slot for channel if one is available now."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_allowed.get(channel, 0.0):
+                return False
+            self._next_allowed[channel] = now + self.min_interval
+            return True
+
+    def acquire(self, channel):
+        """Block until a write slot for channel is available."""
+        while not self.try_acquire(channel):
+            with self._lock:
+                wait = self._next_allowed.get(channel, 0.0) - time.monotonic()
+            time.sleep(max(wait, 0.05))
+
+    def back_off(self, channel, seconds):
+        with self._lock:
+            self._next_allowed[channel] = max(self._next_allowed.get(channel, 0.0), time.monotonic() + seconds)
+
+
+def split_message(text, limit=SLACK_MESSAGE_LIMIT):
+    """Split text into a head that fits in one message and the remainder, preferring paragraph or line breaks."""
+    if len(text) <= limit:
+        return text, ""
+    cut = -1
+    for separator in ("\n\n", "\n", " "):
+        cut = text.rfind(separator, 0, limit)
+        if cut > limit // 2:
+            break
+    if cut <= 0:
+        cut = limit
+    return text[:cut], text[cut:].lstrip("\n")
+
+
+class SlackStreamer(BaseCallbackHandler):
+    """LangChain callback that streams tokens into one or more Slack messages."""
+
+    def __init__(self, client, channel, thread_ts=None, formatter=None, limiter=None,
+                 interval=DEFAULT_UPDATE_INTERVAL, limit=SLACK_MESSAGE_LIMIT, placeholder=PLACEHOLDER_TEXT, timer=None):
+        self.client = client
+        self.channel = channel
+        self.thread_ts = thread_ts
+        self.formatter = formatter or (lambda text: text)
+        self.limiter = limiter or ChannelRateLimiter()
+        self.interval = interval
+        self.limit = limit
+        self.placeholder = placeholder
+        self.timer = timer  # Optional latency histogram for Slack writes
+        self.message_ts = None  # The message currently being edited
+        self._tail = ""  # Raw text of the current message; earlier messages are final
+        self._consumed = 0  # Raw characters already frozen into earlier messages
+        self._streamed = ""  # Raw text of every token so far
+        self._shown = ""  # Formatted text last sent for the current message
+        self._last_update = 0.0
+        self._lock = threading.Lock()
+
+    # --------------------------
+    # Slack calls
+    # --------------------------
+    def _call(self, method, **kwargs):
+        started = time.perf_counter()
+        try:
+            return getattr(self.client, method)(channel=self.channel, **kwargs)
+        except SlackApiError as e:
+            if e.response.status_code == 429:
+                retry_after = int(e.response.headers.get("Retry-After", "1"))
+                logger.warning(f"Slack rate limited {method} in {self.channel}; backing off {retry_after}s")
+                self.limiter.back_off(self.channel, retry_after)
+                return None
+            raise
+        finally:
+            if self.timer is not None:
+                self.timer.observe(time.perf_counter() - started)
+
+    def _try_client_slot(self, api_method):
+        # A pacing client (http_clients.PooledWebClient) would otherwise sleep inside the call
+        try_acquire = getattr(self.client, "try_acquire", None)
+        return try_acquire is None or try_acquire(api_method)
+
+    def _post(self, text):
+        for _ in range(MAX_ATTEMPTS):
+            self.limiter.acquire(self.channel)
+            response = self._call("chat_postMessage", text=text, thread_ts=self.thread_ts)
+            if response is not None:
+                self.message_ts = response["ts"]
+                self._shown = text
+                self._last_update = time.monotonic()
+                return True
+        return False
+
+    def _update(self, text, wait):
+        """Edit the current message. Without wait, skip the edit if the channel has no write slot free."""
+        if text == self._shown:
+            return True
+        if self.message_ts is None:
+            return self._post(text)
+        for _ in range(MAX_ATTEMPTS if wait else 1):
+            if wait:
+                self.limiter.acquire(self.channel)
+            elif not self.limiter.try_acquire(self.channel) or not self._try_client_slot("chat.update"):
+                return False
+            if self._call("chat_update", ts=self.message_ts, text=text) is not None:
+                self._shown = text
+                self._last_update = time.monotonic()
+                return True
+        return False
+
+    # --------------------------
+    # Streaming
+    # --------------------------
+    def start(self):
+        """Post the placeholder message that the answer will stream into."""
+        with self._lock:
+            self._post(self.placeholder)
+
+    def _flush(self, final):
+        # Earlier messages are frozen; only the current tail is re-formatted on each flush
+        while len(self._tail) > self.limit:
+            head, rest = split_message(self._tail, self.limit)
+            self._consumed += len(self._tail) - len(rest)
+            self._tail = rest
+            self._update(self.formatter(head), wait=True)
+            self._post(self.formatter(self._tail[:self.limit]) or self.placeholder)
+        if self._tail:
+            self._update(self.formatter(self._tail), wait=final)
+
+    def on_llm_new_token(self, token, **kwargs):
+        with self._lock:
+            self._tail += token
+            self._streamed += token
+            if self.message_ts and time.monotonic() - self._last_update >= self.interval:
+                self._flush(final=False)
+
+    def finish(self, text):
+        """Make the messages show exactly text, which is the complete answer."""
+        with self._lock:
+            if text.startswith(self._streamed[:self._consumed]):
+                # Whatever was frozen into earlier messages is a prefix of the final answer
+                self._tail = text[self._consumed:]
+            else:
+                # Not a continuation of the stream (e.g. an error after a partial answer): show it in full
+                self._tail = text
+            self._flush(final=True)
@@ -0,0 +1,202 @@
+# answer_cache.py
+#
+# A persistent cache of final answers. Entries are keyed on the normalized
+# question plus the index version they were answered against, so a re-index
+# invalidates them automatically. When an embedding model is supplied, a miss
+# on the exact key falls back to the most similar cached question above a
+# configurable cosine-similarity threshold, which catches rephrased questions.
+
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_SIMILARITY = 0.95
+
+
+def normalize_query(text):
+    """Lowercase, drop punctuation and collapse whitespace so trivial rewordings share a key."""
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return " ".join(text.split())
+
+
+class AnswerCache:
+    """SQLite-backed answer cache with TTL, LRU-style eviction and optional semantic lookup."""
+
+    def __init__(self, path, embedding=None, similarity_threshold=DEFAULT_SIMILARITY,
+                 ttl_seconds=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.embedding = embedding if similarity_threshold else None
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # ((version, scope), keys, normalized embedding matrix), rebuilt after writes
+        self._matrix = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, version INTEGER NOT NULL, scope TEXT NOT NULL, question TEXT NOT NULL, "
+            "answer TEXT NOT NULL, embedding BLOB, created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+        self._conn.commit()
+
+    def _key(self, normalized, version, scope):
+        return hashlib.sha256(f"{version}\0{scope}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _scope_key(self, scope):
+        return hashlib.sha256(scope.encode("utf-8")).hexdigest()[:16]
+
+    # --------------------------
+    # Lookup
+    # --------------------------
+    def get(self, question, version, scope=""):
+        """Return a cached answer for question at this index version, or None."""
+        normalized = normalize_query(question)
+        scope = self._scope_key(scope)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, answer FROM answers WHERE key = ? AND created >= ?",
+                (self._key(normalized, version, scope), now - self.ttl_seconds),
+            ).fetchone()
+            if row:
+                self._touch(row[0], now)
+                self.hits += 1
+                return row[1]
+
+        if self.embedding is not None:
+            answer = self._semantic_get(normalized, version, scope, now)
+            if answer is not None:
+                return answer
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _semantic_get(self, normalized, version, scope, now):
+        try:
+            query = np.asarray(self.embedding.embed_query(normalized), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"Answer cache could not embed the question: {e}")
+            return None
+        query /= np.linalg.norm(query) or 1.0
+
+        with self._lock:
+            keys, matrix = self._load_matrix(version, scope, now - self.ttl_seconds)
+            if not keys:
+                return None
+            scores = matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return None
+            row = self._conn.execute(
+                "SELECT answer FROM answers WHERE key = ? AND created >= ?", (keys[best], now - self.ttl_seconds)
+            ).fetchone()
+            if row is None:
+                return None
+            self._touch(keys[best], now)
+            self.hits += 1
+            self.semantic_hits += 1
+            return row[0]
+
+    def _load_matrix(self, version, scope, min_created):
+        if self._matrix is None or self._matrix[0] != (version, scope):
+            rows = self._conn.execute(
+                "SELECT key, embedding FROM answers "
+                "WHERE version = ? AND scope = ? AND embedding IS NOT NULL AND created >= ?",
+                (version, scope, min_created),
+            ).fetchall()
+            keys = [key for key, _ in rows]
+            matrix = (
+                np.vstack([np.frombuffer(blob, dtype=np.float32) for _, blob in rows])
+                if rows else np.zeros((0, 0), dtype=np.float32)
+            )
+            self._matrix = ((version, scope), keys, matrix)
+        return self._matrix[1], self._matrix[2]
+
+    def _touch(self, key, now):
+        self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+        self._conn.commit()
+
+    # --------------------------
+    # Store & invalidation
+    # --------------------------
+    def put(self, question, version, answer, scope=""):
+        normalized = normalize_query(question)
+        scope = self._scope_key(scope)
+        blob = None
+        if self.embedding is not None:
+            try:
+                vector = np.asarray(self.embedding.embed_query(normalized), dtype=np.float32)
+                vector /= np.linalg.norm(vector) or 1.0
+                blob = vector.tobytes()
+            except Exception as e:
+                logger.warning(f"Answer cache could not embed the question: {e}")
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, version, scope, question, answer, embedding, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self._key(normalized, version, scope), version, scope, normalized, answer, blob, now, now),
+            )
+            # Expire old answers, then evict the least recently used entries beyond the size bound
+            self._conn.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl_seconds,))
+            self._conn.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+            self._matrix = None
+
+    def invalidate(self, current_version):
+        """Drop every entry answered against an index version other than current_version."""
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM answers WHERE version != ?", (current_version,)).rowcount
+            self._conn.commit()
+            self._matrix = None
+        if deleted:
+            logger.info(f"Answer cache: dropped {deleted} answers from older index versions.")
+        return deleted
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+            self._matrix = None
+
+    # --------------------------
+    # Stats
+    # --------------------------
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": size,
+            }
+
+    def stats_summary(self):
+        stats = self.stats()
+        return (
+            f"{stats['hits']} hits ({stats['semantic_hits']} by similarity), {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%} hit rate), {stats['size']} entries"
+        )
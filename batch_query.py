@@ -0,0 +1,239 @@
+# batch_query.py
+#
+# Headless batch querying. Reads questions from a JSONL or CSV file, answers
+# them concurrently with the same index and chain the desktop app builds, and
+# streams one JSON line per answer (sources, token counts, latency) as each one
+# completes. Failed questions are retried with backoff and recorded with their
+# error instead of stopping the run. Retrieval for duplicate questions runs once.
+#
+#   python batch_query.py questions.jsonl --folder /path/to/docs --out answers.jsonl --concurrency 8
+
+import os
+import csv
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, List
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from constants import DEFAULT_HISTORY_FOLDER, DEFAULT_INDEX_FOLDER, DEFAULT_MODEL
+from context_packer import PromptTokenCounter, count_tokens
+from metrics import Histogram
+from qa_chain import build_chain, open_index, with_system_message
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 2.0  # Seconds; doubles on every retry
+MEMOIZED_QUERIES = 1024  # Distinct queries whose retrieval results are kept
+
+
+# --------------------------
+# Retrieval memoization
+# --------------------------
+def _normalize_question(text):
+    return " ".join(text.lower().split())
+
+
+class MemoizedRetriever(BaseRetriever):
+    """
+    Run the wrapped retriever once per distinct query; repeats (even concurrent ones) share
+    the result. The most recent max_entries results are kept.
+    """
+
+    retriever: Any
+    max_entries: int = MEMOIZED_QUERIES
+    results: Any = None
+    flight: Any = None
+    lock: Any = None
+    reused: int = 0
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.results = OrderedDict()
+        self.flight = SingleFlight()
+        self.lock = threading.Lock()
+
+    def _get_relevant_documents(self, query, *, run_manager=None) -> List[Document]:
+        key = _normalize_question(query)
+        with self.lock:
+            documents = self.results.get(key)
+            if documents is not None:
+                self.results.move_to_end(key)
+                self.reused += 1
+                return list(documents)
+
+        def retrieve(publish):
+            found = self.retriever.invoke(query)
+            with self.lock:
+                self.results[key] = found
+                while len(self.results) > self.max_entries:
+                    self.results.popitem(last=False)
+            return found
+
+        return list(self.flight.do(key, retrieve))
+
+
+# --------------------------
+# Input and output
+# --------------------------
+def read_questions(path):
+    """
+    Questions from a .jsonl file ({"question": ..., "id": ...} per line) or a .csv
+    file with a "question" column (or the first column). Returns dicts with id and question.
+    """
+    questions = []
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.reader(f))
+            header = [name.strip().lower() for name in rows[0]] if rows else []
+            if "question" in header:
+                column = header.index("question")
+                id_column = header.index("id") if "id" in header else None
+                rows = rows[1:]
+            else:
+                column, id_column = 0, None
+            for number, row in enumerate(rows, start=1):
+                if len(row) > column and row[column].strip():
+                    qid = row[id_column] if id_column is not None and len(row) > id_column else number
+                    questions.append({"id": qid, "question": row[column].strip()})
+        else:
+            for number, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                item = json.loads(line)
+                if isinstance(item, str):
+                    item = {"question": item}
+                if str(item.get("question", "")).strip():
+                    questions.append({"id": item.get("id", number), "question": item["question"].strip()})
+    return questions
+
+
+def _sources(result):
+    sources = []
+    for doc in result.get("source_documents") or []:
+        source = {key: doc.metadata[key] for key in ("source", "page", "chunk_id") if key in doc.metadata}
+        if source not in sources:
+            sources.append(source)
+    return sources
+
+
+# --------------------------
+# Running
+# --------------------------
+def answer_question(chain, item, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+    """Answer one question, retrying failures with jittered exponential backoff. Returns its output record."""
+    record = {"id": item["id"], "question": item["question"]}
+    started = time.perf_counter()
+    for attempt in range(1, retries + 2):
+        counter = PromptTokenCounter(DEFAULT_MODEL)
+        try:
+            # Asked with the same instructions as in the desktop window
+            result = chain({"question": with_system_message(item["question"]), "chat_history": []}, callbacks=[counter])
+        except Exception as e:
+            if attempt > retries:
+                record.update(error=str(e), attempts=attempt)
+                break
+            delay = backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            logger.warning(f"Question {item['id']} failed ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+        else:
+            record.update(
+                answer=result["answer"],
+                sources=_sources(result),
+                prompt_tokens=counter.total,
+                completion_tokens=count_tokens(result["answer"], DEFAULT_MODEL),
+                attempts=attempt,
+            )
+            break
+    record["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return record
+
+
+def run_batch(chain, questions, out, concurrency=DEFAULT_CONCURRENCY, retries=DEFAULT_RETRIES,
+              backoff=DEFAULT_BACKOFF, on_result=None):
+    """
+    Answer questions with up to concurrency in flight, writing each record to out
+    (a text file) as a JSON line as soon as it completes. Returns summary stats.
+    """
+    latencies = Histogram("batch_query_seconds", "Per-question latency")
+    write_lock = threading.Lock()
+    failed = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = [executor.submit(answer_question, chain, item, retries, backoff) for item in questions]
+        for future in as_completed(futures):
+            record = future.result()
+            latencies.observe(record["latency_ms"] / 1000)
+            failed += "error" in record
+            with write_lock:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+            if on_result:
+                on_result(record)
+
+    elapsed = time.perf_counter() - started
+    percentiles = latencies.percentiles() or {50: 0, 95: 0, 99: 0}
+    return {
+        "questions": len(questions),
+        "failed": failed,
+        "seconds": round(elapsed, 2),
+        "per_second": round(len(questions) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentiles[50] * 1000),
+        "p95_ms": round(percentiles[95] * 1000),
+        "p99_ms": round(percentiles[99] * 1000),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Answer a file of questions against a folder's index.")
+    parser.add_argument("questions", help="A .jsonl ({\"question\": ...} per line) or .csv file of questions")
+    parser.add_argument("--folder", default=os.getcwd(), help="Document folder to query (default: current directory)")
+    parser.add_argument("--out", help="JSONL file for the answers (default: stdout)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Questions answered at once")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES, help="Retries per failed question")
+    parser.add_argument("--backoff", type=float, default=DEFAULT_BACKOFF, help="First retry delay in seconds")
+    parser.add_argument("--no-refresh", action="store_true", help="Query the index as is, without re-indexing changes")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s", stream=sys.stderr)
+
+    questions = read_questions(args.questions)
+    logger.info(f"Read {len(questions)} questions from {args.questions}")
+    store = open_index(args.folder)
+    try:
+        if not args.no_refresh:
+            stats = store.refresh(exclude_dirs=(DEFAULT_INDEX_FOLDER, DEFAULT_HISTORY_FOLDER))
+            store.publish()
+            logger.info(f"Index ready: {stats['chunks']} chunks embedded, {stats['failed']} files failed")
+        chain = build_chain(
+            store, return_source_documents=True, wrap_retriever=lambda retriever: MemoizedRetriever(retriever=retriever)
+        )
+        out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+        try:
+            summary = run_batch(chain, questions, out, args.concurrency, args.retries, args.backoff)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        summary["retrieval_reused"] = chain.retriever.reused + chain.retriever.flight.stats()["collapsed"]
+        logger.info(f"Batch finished: {json.dumps(summary)}")
+    finally:
+        store.close()
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+# corpus.py
+#
+# Synthetic document corpus for benchmarks. Files are generated from a seeded
+# vocabulary, so the same arguments always produce the same corpus, with a
+# configurable number of files, size and mix of file types.
+
+import os
+import random
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIX = {"txt": 5, "md": 2, "csv": 1, "pdf": 2}
+WORDS = (
+    "pricing contract renewal discount rebuttal pitch onboarding integration invoice warranty support "
+    "customer account tier premium enterprise quota shipment supplier compliance audit deadline proposal "
+    "objection competitor feature roadmap latency uptime license seat refund escalation"
+).split()
+
+
+def parse_mix(text):
+    """Parse a type mix like "txt=5,pdf=2" into {"txt": 5, "pdf": 2}."""
+    mix = {}
+    for part in text.split(","):
+        if part.strip():
+            name, _, weight = part.partition("=")
+            mix[name.strip().lower()] = int(weight or 1)
+    return mix
+
+
+def _paragraphs(rng, words):
+    paragraphs, remaining = [], words
+    while remaining > 0:
+        length = min(remaining, rng.randint(40, 120))
+        sentence = " ".join(rng.choice(WORDS) for _ in range(length))
+        # Product codes give keyword search something exact to find
+        paragraphs.append(f"SKU-{rng.randint(1000, 9999)}: {sentence}.")
+        remaining -= length
+    return paragraphs
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path, paragraphs, lines_per_page=40, width=90):
+    """Write a minimal text PDF (one Helvetica content stream per page) without extra dependencies."""
+    lines = []
+    for paragraph in paragraphs:
+        words, line = paragraph.split(), ""
+        for word in words:
+            if len(line) + len(word) + 1 > width:
+                lines.append(line)
+                line = ""
+            line = f"{line} {word}".strip()
+        lines.extend([line, ""])
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[""]]
+
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in pages:
+        stream = "BT /F1 10 Tf 50 750 Td 12 TL " + " ".join(f"({_pdf_escape(line)}) '" for line in page) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+            f"/Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    data, offsets = b"%PDF-1.4\n", []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1", errors="replace")
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    data += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _write_docx(path, paragraphs):
+    import docx
+
+    document = docx.Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    document.save(path)
+
+
+def generate_corpus(folder, files=200, words_per_file=800, mix=None, seed=42):
+    """Create files documents under folder. Returns the paths written."""
+    rng = random.Random(seed)
+    mix = dict(mix or DEFAULT_MIX)
+    if "docx" in mix:
+        try:
+            import docx  # noqa: F401
+        except ImportError:
+            logger.warning("python-docx is not installed; leaving .docx out of the corpus")
+            del mix["docx"]
+    kinds = [kind for kind, weight in mix.items() for _ in range(weight)]
+    os.makedirs(folder, exist_ok=True)
+
+    paths = []
+    for number in range(files):
+        kind = kinds[number % len(kinds)]
+        # Spread files over sub-folders, like a real shared drive
+        directory = os.path.join(folder, f"dept-{number % 7}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"doc-{number:05d}.{kind}")
+        paragraphs = _paragraphs(rng, rng.randint(words_per_file // 2, words_per_file * 3 // 2))
+        if kind == "pdf":
+            write_pdf(path, paragraphs)
+        elif kind == "docx":
+            _write_docx(path, paragraphs)
+        elif kind == "csv":
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("sku,description\n")
+                f.writelines(f'{p.split(":")[0]},"{p.split(": ", 1)[1]}"\n' for p in paragraphs)
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(("# " if kind == "md" else "") + "\n\n".join(paragraphs))
+        paths.append(path)
+    return paths
+
+
+def touch_files(paths, fraction, seed=7):
+    """Append a paragraph to a fraction of the files, simulating edits between re-indexes."""
+    rng = random.Random(seed)
+    changed = [path for path in paths if rng.random() < fraction and not path.endswith((".pdf", ".docx"))]
+    for path in changed:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("\n\n" + _paragraphs(rng, 60)[0])
+    return changed
@@ -0,0 +1,135 @@
+# fakes.py
+#
+# Local stand-ins for the paid upstreams, so benchmarks run offline and repeat
+# exactly: hashed bag-of-words embeddings, a chat model that streams a canned
+# answer with configurable latency, and an HTTP stub of the Slack Web API.
+
+import re
+import json
+import time
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic embeddings: each word is hashed into one of dimensions buckets."""
+
+    def __init__(self, dimensions=256, latency=0.0):
+        self.dimensions = dimensions
+        self.latency = latency  # Seconds per call, standing in for the network round trip
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _embed(self, text):
+        vector = [0.0] * self.dimensions
+        for word in re.findall(r"\w+", text.lower()):
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % self.dimensions] += 1.0
+        norm = sum(value * value for value in vector) ** 0.5 or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class FakeChatModel(BaseChatModel):
+    """Streams a fixed-length answer after first_token_latency, one token every token_latency seconds."""
+
+    first_token_latency: float = 0.3
+    token_latency: float = 0.01
+    answer_tokens: int = 80
+    streaming: bool = False
+    model: str = "fake-chat"
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _tokens(self, messages):
+        # The answer depends on the prompt so cached and coalesced answers can be told apart
+        seed = hashlib.sha256("".join(str(m.content) for m in messages).encode("utf-8")).hexdigest()
+        return [f"{seed[i % len(seed)]}{i} " for i in range(self.answer_tokens)]
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.first_token_latency)
+        for number, token in enumerate(self._tokens(messages)):
+            if number:
+                time.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.streaming:
+            text = "".join(chunk.message.content for chunk in self._stream(messages, stop, run_manager))
+        else:
+            time.sleep(self.first_token_latency + self.token_latency * (self.answer_tokens - 1))
+            text = "".join(self._tokens(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+
+class SlackStub:
+    """A local Slack Web API that answers every method with ok, after an optional delay."""
+
+    BOT_USER_ID = "UBENCHBOT"
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._ts = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, query):
+                method = self.path.split("?", 1)[0].rstrip("/").rsplit("/", 1)[-1]
+                payload = stub.respond(method, query)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._reply(self.path.split("?", 1)[1] if "?" in self.path else "")
+
+            def do_POST(self):
+                self._reply(self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8"))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/api/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def respond(self, method, query):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self._ts += 1
+            ts = f"{int(time.time())}.{self._ts:06d}"
+        if method == "auth.test":
+            return {"ok": True, "user_id": self.BOT_USER_ID, "user": "bench-bot", "team_id": "TBENCH", "bot_id": "BBENCH"}
+        if method == "files.info":
+            file_id = (parse_qs(query).get("file") or ["F0"])[0]
+            return {"ok": True, "file": {"id": file_id, "name": f"{file_id}.txt", "mimetype": "text/plain",
+                                         "user": "UBENCH", "url_private_download": f"{self.url}files/{file_id}"}}
+        return {"ok": True, "channel": "CBENCH", "ts": ts, "message": {"ts": ts}}
+
+    def close(self):
+        self.server.shutdown()
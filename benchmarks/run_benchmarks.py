@@ -0,0 +1,330 @@
+# run_benchmarks.py
+#
+# Offline benchmarks for index builds, question answering and Slack event
+# throughput. The real code paths run end to end: PersistentIndex builds (what
+# initialize_loader does), the Slack bot's reindex(), query_openai_model() and
+# its /slack/events route. OpenAI and Slack are replaced by the local fakes in
+# fakes.py, so results are repeatable and cost nothing.
+#
+#   python benchmarks/run_benchmarks.py --files 500 --concurrency 16 --save benchmarks/baselines/main.json
+#   python benchmarks/run_benchmarks.py --compare benchmarks/baselines/main.json
+#
+# Results are printed and can be saved as a JSON baseline; --compare flags
+# metrics that got worse than the baseline by more than --tolerance.
+
+import os
+import sys
+import hmac
+import json
+import time
+import random
+import logging
+import shutil
+import hashlib
+import argparse
+import platform
+import tempfile
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path[:0] = [REPO_DIR, os.path.join(REPO_DIR, "Slack")]
+
+from corpus import WORDS, generate_corpus, parse_mix, touch_files  # noqa: E402
+from fakes import FakeChatModel, FakeEmbeddings, SlackStub  # noqa: E402
+
+SIGNING_SECRET = "benchmark-signing-secret"
+# Events are spread over channels; the bot spaces its writes per channel like Slack's rate limits do
+EVENT_CHANNELS = 50
+
+
+def percentile(samples, point):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * point / 100))] if samples else None
+
+
+def latency_stats(samples, elapsed):
+    return {
+        "count": len(samples),
+        "per_sec": round(len(samples) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(samples, 50) * 1000, 1) if samples else None,
+        "p99_ms": round(percentile(samples, 99) * 1000, 1) if samples else None,
+    }
+
+
+def make_questions(count, seed=11):
+    rng = random.Random(seed)
+    return [
+        f"What does our documentation say about {rng.choice(WORDS)} and {rng.choice(WORDS)} for SKU-{rng.randint(1000, 9999)}? #{number}"
+        for number in range(count)
+    ]
+
+
+def install_fakes(args):
+    """Swap the OpenAI classes for local fakes before the apps import them."""
+    import langchain_openai
+
+    embeddings = FakeEmbeddings(latency=args.embed_latency)
+    langchain_openai.OpenAIEmbeddings = lambda **kwargs: embeddings
+    langchain_openai.ChatOpenAI = lambda streaming=False, **kwargs: FakeChatModel(
+        first_token_latency=args.llm_latency, token_latency=args.token_latency,
+        answer_tokens=args.answer_tokens, streaming=streaming,
+    )
+    return embeddings
+
+
+# --------------------------
+# Benchmarks
+# --------------------------
+def bench_index(args, corpus_dir, index_root, embeddings):
+    """Cold build, then a warm restart with nothing changed, the way the desktop app loads a folder."""
+    from embedding_cache import CachedEmbeddings
+    from index_store import PersistentIndex, index_dir_for
+
+    results = {}
+    for phase in ("cold", "warm"):
+        cached = CachedEmbeddings(embeddings, os.path.join(index_root, "embeddings.sqlite"))
+        started = time.perf_counter()
+        store = PersistentIndex(corpus_dir, index_dir_for(corpus_dir, index_root), cached, workers=args.workers,
+                                backend=args.backend)
+        stats = store.refresh()
+        store.publish()
+        elapsed = time.perf_counter() - started
+        results[phase] = {
+            "seconds": round(elapsed, 3),
+            "docs_per_sec": round(args.files / elapsed, 2),
+            "chunks": stats["chunks"],
+            "failed": stats["failed"],
+        }
+        print(f"Index {phase}: {elapsed:.2f}s, {args.files / elapsed:.1f} docs/s, {stats['chunks']} chunks")
+    return results
+
+
+def bench_reindex(bot, paths, fraction):
+    changed = touch_files(paths, fraction)
+    started = time.perf_counter()
+    success, message = bot.reindex()
+    elapsed = time.perf_counter() - started
+    print(f"Re-index ({len(changed)} changed files): {elapsed:.2f}s - {message}")
+    return {"seconds": round(elapsed, 3), "changed_files": len(changed), "succeeded": success}
+
+
+def bench_queries(bot, questions, concurrency):
+    latencies = []
+
+    def ask(question):
+        started = time.perf_counter()
+        bot.query_openai_model(question, bot.custom_pretext)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(ask, questions))
+    result = latency_stats(latencies, time.perf_counter() - started)
+    print(f"Queries: {result['count']} at concurrency {concurrency}, p50 {result['p50_ms']}ms, p99 {result['p99_ms']}ms, {result['per_sec']}/s")
+    return result
+
+
+def _signed_event(number, question):
+    body = json.dumps({
+        "token": "bench", "team_id": "TBENCH", "api_app_id": "ABENCH", "type": "event_callback",
+        "event_id": f"EvBENCH{number:06d}", "event_time": int(time.time()),
+        "event": {
+            "type": "app_mention", "user": f"U{number % 25:04d}", "channel": f"CBENCH{number % EVENT_CHANNELS:03d}",
+            "text": f"<@{SlackStub.BOT_USER_ID}> {question}", "ts": f"{int(time.time())}.{number:06d}",
+        },
+    })
+    timestamp = str(int(time.time()))
+    signature = "v0=" + hmac.new(
+        SIGNING_SECRET.encode(), f"v0:{timestamp}:{body}".encode(), hashlib.sha256
+    ).hexdigest()
+    headers = {
+        "Content-Type": "application/json",
+        "X-Slack-Request-Timestamp": timestamp,
+        "X-Slack-Signature": signature,
+    }
+    return body, headers
+
+
+def bench_events(bot, questions, concurrency, timeout):
+    """Post signed app_mention events to /slack/events and wait for the worker pool to answer them."""
+    client = bot.flask_app.test_client()
+    before = bot.event_queue.stats()
+    ack_latencies = []
+
+    def post(item):
+        number, question = item
+        body, headers = _signed_event(number, question)
+        started = time.perf_counter()
+        response = client.post("/slack/events", data=body, headers=headers)
+        ack_latencies.append(time.perf_counter() - started)
+        return response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        statuses = list(executor.map(post, enumerate(questions)))
+    acked = time.perf_counter() - started
+
+    def finished():
+        stats = bot.event_queue.stats()
+        return stats["completed"] + stats["failed"] - before["completed"] - before["failed"]
+
+    accepted = bot.event_queue.stats()["submitted"] - before["submitted"]
+    deadline = time.monotonic() + timeout
+    while finished() < accepted and time.monotonic() < deadline:
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "events": len(questions),
+        "accepted": accepted,
+        "rejected": bot.event_queue.stats()["rejected"] - before["rejected"],
+        "non_200": sum(1 for status in statuses if status != 200),
+        "completed": finished(),
+        "events_per_sec": round(finished() / elapsed, 2),
+        "ack": latency_stats(ack_latencies, acked),
+    }
+    print(
+        f"Events: {result['completed']}/{result['events']} answered in {elapsed:.2f}s "
+        f"({result['events_per_sec']}/s), ack p50 {result['ack']['p50_ms']}ms p99 {result['ack']['p99_ms']}ms, "
+        f"{result['rejected']} rejected as busy"
+    )
+    return result
+
+
+# --------------------------
+# Baselines
+# --------------------------
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    """Print metrics that moved beyond tolerance. Returns the number of regressions."""
+    current, previous = flatten(results["results"]), flatten(baseline["results"])
+    regressions = 0
+    for key in sorted(current.keys() & previous.keys()):
+        if not previous[key] or not (key.endswith(("_ms", "seconds", "per_sec"))):
+            continue
+        change = (current[key] - previous[key]) / previous[key]
+        # Throughput should go up; times should go down
+        worse = -change if key.endswith("per_sec") else change
+        if worse > tolerance:
+            regressions += 1
+            print(f"REGRESSION {key}: {previous[key]} -> {current[key]} ({change:+.0%})")
+        elif worse < -tolerance:
+            print(f"improved   {key}: {previous[key]} -> {current[key]} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline LocalAI benchmarks with fake OpenAI and Slack upstreams.")
+    parser.add_argument("--files", type=int, default=200, help="Documents in the synthetic corpus")
+    parser.add_argument("--words", type=int, default=800, help="Average words per document")
+    parser.add_argument("--mix", default="txt=5,md=2,csv=1,pdf=2", help="File type mix, e.g. txt=5,pdf=2,docx=1")
+    parser.add_argument("--workers", type=int, default=None, help="Ingestion worker processes")
+    parser.add_argument("--backend", default="chroma", help="Vector store backend: chroma, flat or flat-int8")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--events", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--reindex-fraction", type=float, default=0.1, help="Share of files edited before re-indexing")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Fake LLM time to first token (s)")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Fake LLM time per streamed token (s)")
+    parser.add_argument("--answer-tokens", type=int, default=80)
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Fake embedding call latency (s)")
+    parser.add_argument("--slack-latency", type=float, default=0.02, help="Slack API stub latency (s)")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait for queued events")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative change counted as a regression")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary corpus and index")
+    parser.add_argument("--verbose", action="store_true", help="Show the bot's INFO logs")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="localai-bench-")
+    corpus_dir = os.path.join(work_dir, "corpus")
+    index_root = os.path.join(work_dir, "Index")
+    stub = SlackStub(latency=args.slack_latency)
+    try:
+        started = time.perf_counter()
+        paths = generate_corpus(corpus_dir, args.files, args.words, parse_mix(args.mix))
+        print(f"Generated {len(paths)} files in {time.perf_counter() - started:.1f}s under {corpus_dir}")
+
+        embeddings = install_fakes(args)
+        results = {"index": bench_index(args, corpus_dir, index_root, embeddings)}
+
+        os.environ.update({
+            "LOCALAI_DIR": corpus_dir,
+            "INDEX_FOLDER": index_root,
+            "HISTORY_FOLDER": os.path.join(work_dir, "History"),
+            "SLACK_API_URL": stub.url,
+            "SLACK_BOT_TOKEN": "xoxb-benchmark",
+            "SLACK_SIGNING_SECRET": SIGNING_SECRET,
+            "OPENAI_API_KEY": "sk-benchmark",
+            "VECTOR_BACKEND": args.backend,
+        })
+        if args.workers:
+            os.environ["INGEST_WORKERS"] = str(args.workers)
+        started = time.perf_counter()
+        import Slackbot as bot
+        imported = time.perf_counter() - started
+        if not args.verbose:
+            logging.getLogger().setLevel(logging.WARNING)
+        if not bot.wait_until_ready(args.timeout):
+            raise RuntimeError(f"Bot did not become ready: {bot.startup_summary()}")
+        results["startup"] = {
+            "import_seconds": round(imported, 3),
+            "ready_seconds": round(time.perf_counter() - started, 3),
+        }
+        print(
+            f"Startup: serving after {results['startup']['import_seconds']}s, "
+            f"ready after {results['startup']['ready_seconds']}s"
+        )
+
+        questions = make_questions(args.queries + args.events)
+        results["reindex"] = bench_reindex(bot, paths, args.reindex_fraction)
+        results["query"] = bench_queries(bot, questions[:args.queries], args.concurrency)
+        results["events"] = bench_events(bot, questions[args.queries:], args.concurrency, args.timeout)
+        results["slack_api_calls"] = dict(stub.calls)
+
+        report = {
+            "meta": {
+                "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "args": {key: value for key, value in vars(args).items() if key not in ("save", "compare", "keep", "verbose")},
+            },
+            "results": results,
+        }
+        if args.save:
+            os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+            with open(args.save, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print(f"Saved results to {args.save}")
+        if args.compare:
+            with open(args.compare, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+            if baseline["meta"]["args"] != report["meta"]["args"]:
+                print("Warning: the baseline was recorded with different arguments")
+            regressions = compare(report, baseline, args.tolerance)
+            print(f"{regressions} regression(s) beyond {args.tolerance:.0%}")
+            return 1 if regressions else 0
+        return 0
+    finally:
+        stub.close()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    # The bot's background threads never finish on their own; exit without waiting on them
+    code = main()
+    sys.stdout.flush()
+    os._exit(code)
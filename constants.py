@@ -16,6 +16,32 @@ DEFAULT_TEMPERATURE = 0.2
 # Default directory for history
 DEFAULT_HISTORY_FOLDER = "History"
 
+# Default directory for persisted vector indexes (one sub-folder per indexed folder)
+DEFAULT_INDEX_FOLDER = "Index"
+
+# Hybrid retrieval: chunks sent to the model, candidates fetched from each of the
+# vector and keyword indexes, and whether to diversify the final chunks with MMR
+RETRIEVAL_K = 8
+RETRIEVAL_FETCH_K = 30
+RETRIEVAL_USE_MMR = True
+
+# Tokens of retrieved context per prompt; None uses the model's default budget
+CONTEXT_TOKEN_BUDGET = None
+
+# Vector store for the index: "chroma", "flat" or "flat-int8" (memory-mapped NumPy matrix)
+VECTOR_BACKEND = "chroma"
+
+# Files and chunks at least this similar (estimated Jaccard) to indexed ones are skipped
+# as near-duplicates instead of embedded; 0 indexes every copy
+DEDUPE_THRESHOLD = 0.9
+
+# Folders whose indexes stay loaded when switching between folders; older ones are closed
+MAX_LOADED_CORPORA = 2
+
+# Conversation memory: past this many tokens of recent turns, older ones are folded into a running summary
+SESSION_COMPACT_TOKENS = 1500
+SESSION_KEEP_TURNS = 2
+
 # Default model for ConversationalRetrievalChain
 DEFAULT_MODEL = "gpt-4o-2024-05-13"   
 
@@ -0,0 +1,141 @@
+# context_packer.py
+#
+# Context assembly between retrieval and the prompt. Retrieved chunks arrive in
+# rank order; near-duplicates of a chunk already kept are dropped and the rest
+# are packed into a per-model token budget, so the prompt carries the most
+# relevant passages once instead of every passage verbatim. Token counts come
+# from tiktoken, and PromptTokenCounter reports what each request actually sent.
+
+import re
+import logging
+import threading
+from functools import lru_cache
+
+import tiktoken
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# Tokens of retrieved context allowed per prompt, by model name prefix (longest prefix wins)
+CONTEXT_BUDGETS = {
+    "gpt-4o": 6000,
+    "gpt-4-turbo": 6000,
+    "gpt-4": 3000,
+    "gpt-3.5-turbo": 2500,
+}
+DEFAULT_CONTEXT_BUDGET = 3000
+DEDUPE_THRESHOLD = 0.8  # Word-shingle Jaccard similarity above which a chunk counts as a near-duplicate
+SHINGLE_SIZE = 3
+MIN_PARTIAL_TOKENS = 100  # Don't bother truncating a chunk into less room than this
+
+
+class _ApproxEncoding:
+    """Roughly 4 characters per token, for when tiktoken can't fetch its encoding files."""
+
+    def encode(self, text, **kwargs):
+        return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # Encodings are downloaded on first use; offline machines fall back to an estimate
+        logger.warning(f"Could not load tiktoken encoding for {model!r}, estimating token counts: {e}")
+        return _ApproxEncoding()
+
+
+def count_tokens(text, model=""):
+    return len(_encoding(model).encode(text, disallowed_special=()))
+
+
+def budget_for_model(model):
+    """Context token budget for model, matched on the longest known name prefix."""
+    matches = [prefix for prefix in CONTEXT_BUDGETS if model.startswith(prefix)]
+    return CONTEXT_BUDGETS[max(matches, key=len)] if matches else DEFAULT_CONTEXT_BUDGET
+
+
+def _shingles(text):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def _similarity(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ContextPacker:
+    """Drop near-duplicate chunks and fit the rest, best first, into a token budget."""
+
+    def __init__(self, model="", budget=None, dedupe_threshold=DEDUPE_THRESHOLD):
+        self.model = model
+        self.budget = budget or budget_for_model(model)
+        self.dedupe_threshold = dedupe_threshold
+
+    def pack(self, documents):
+        """Return the documents to send, in rank order, with context_tokens set in their metadata."""
+        packed = []
+        kept_shingles = []
+        used = 0
+        for doc in documents:
+            # Whitespace runs from PDF extraction cost tokens and carry nothing
+            text = re.sub(r"[ \t]+", " ", re.sub(r"\n\s*\n+", "\n\n", doc.page_content)).strip()
+            if not text:
+                continue
+            shingles = _shingles(text)
+            if any(_similarity(shingles, kept) >= self.dedupe_threshold for kept in kept_shingles):
+                continue
+
+            tokens = _encoding(self.model).encode(text, disallowed_special=())
+            remaining = self.budget - used
+            if len(tokens) > remaining:
+                if remaining < MIN_PARTIAL_TOKENS:
+                    break
+                # The last chunk that doesn't fit is cut to the remaining room rather than dropped
+                tokens = tokens[:remaining]
+                text = _encoding(self.model).decode(tokens)
+            packed.append(Document(page_content=text, metadata=dict(doc.metadata, context_tokens=len(tokens))))
+            kept_shingles.append(shingles)
+            used += len(tokens)
+            if used >= self.budget:
+                break
+
+        logger.debug(f"Packed {len(packed)} of {len(documents)} chunks into {used}/{self.budget} tokens")
+        return packed
+
+
+class PromptTokenCounter(BaseCallbackHandler):
+    """Counts the prompt tokens of every LLM call made during one request."""
+
+    def __init__(self, model=""):
+        self.model = model
+        self.calls = []
+        self._lock = threading.Lock()
+
+    @property
+    def total(self):
+        with self._lock:
+            return sum(self.calls)
+
+    def _record(self, texts):
+        tokens = sum(count_tokens(text, self.model) for text in texts)
+        with self._lock:
+            self.calls.append(tokens)
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._record(prompts)
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._record(str(message.content) for batch in messages for message in batch)
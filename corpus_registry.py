@@ -0,0 +1,291 @@
+# corpus_registry.py
+#
+# Named corpora, each a folder with its own persisted index. Slack channels and
+# desktop folder selections map to a corpus; indexes are loaded on first use
+# and kept in an LRU bounded by count and approximate memory, so cold corpora
+# are unloaded. Each loaded value is pinned while a query uses it: a pinned
+# corpus is not evicted, and a value swapped out by a re-index is unloaded once
+# the last query using that value releases it.
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CORPUS = "default"
+DEFAULT_MAX_LOADED = 4
+
+
+def parse_mapping(text):
+    """Parse "a=x,b=y" into {"a": "x", "b": "y"}. Values may contain "=" and ":" (Windows paths)."""
+    mapping = {}
+    for part in text.split(","):
+        key, sep, value = part.partition("=")
+        if sep and key.strip() and value.strip():
+            mapping[key.strip()] = value.strip()
+    return mapping
+
+
+def directory_size(path):
+    """Total size of the files under path, in bytes."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class _Entry:
+    def __init__(self, name, folder):
+        self.name = name
+        self.folder = folder
+        self.value = None
+        self.size = 0
+        self.pins = {}  # id(value) -> queries using that value
+        self.retired = []  # Replaced values waiting for their last user to finish
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.load_seconds = None
+        self.last_used = None
+        # Held while loading, so concurrent first requests share one load
+        self.load_lock = threading.Lock()
+
+
+class CorpusRegistry:
+    """
+    Maps corpus names to folders and keeps the most recently used ones loaded.
+
+    load(name, folder) builds the in-memory value for a corpus, size_of(value)
+    estimates its resident size in bytes and unload(value) releases it.
+    """
+
+    def __init__(self, load, unload=None, size_of=None, max_loaded=DEFAULT_MAX_LOADED, max_bytes=None):
+        self._load = load
+        self._unload = unload
+        self._size_of = size_of
+        self.max_loaded = max_loaded
+        self.max_bytes = max_bytes
+        self._entries = {}
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    # --------------------------
+    # Mapping
+    # --------------------------
+    def register(self, name, folder):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                self._entries[name] = _Entry(name, os.path.abspath(folder))
+            elif entry.folder != os.path.abspath(folder):
+                raise ValueError(f"Corpus {name} is already registered for {entry.folder}")
+
+    def register_folder(self, folder):
+        """Register an ad-hoc corpus for a folder (e.g. a desktop selection). Returns its name."""
+        name = os.path.abspath(folder)
+        self.register(name, folder)
+        return name
+
+    def assign_channel(self, channel, name):
+        with self._lock:
+            if name not in self._entries:
+                raise KeyError(f"Unknown corpus {name}")
+            self._channels[channel] = name
+
+    def name_for_channel(self, channel, default=DEFAULT_CORPUS):
+        with self._lock:
+            return self._channels.get(channel, default)
+
+    def names(self):
+        with self._lock:
+            return list(self._entries)
+
+    # --------------------------
+    # Loading
+    # --------------------------
+    def _entry(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is None:
+            raise KeyError(f"Unknown corpus {name}")
+        return entry
+
+    @contextmanager
+    def use(self, name):
+        """Yield the loaded value of a corpus, loading it first if needed. It stays loaded until the block exits."""
+        entry = self._entry(name)
+        value = self._ensure_loaded(entry)
+        try:
+            yield value
+        finally:
+            self._unpin(entry, value)
+
+    def get(self, name):
+        """The loaded value of a corpus, for callers that don't run concurrently with eviction."""
+        with self.use(name) as value:
+            return value
+
+    def _ensure_loaded(self, entry):
+        # Returns the value pinned; the caller unpins it
+        with self._lock:
+            if entry.value is not None:
+                return self._hit(entry)
+        with entry.load_lock:
+            with self._lock:
+                if entry.value is not None:
+                    return self._hit(entry)
+            started = time.perf_counter()
+            value = self._load(entry.name, entry.folder)
+            size = self._size_of(value) if self._size_of else 0
+            with self._lock:
+                entry.value = value
+                entry.size = size
+                entry.loads += 1
+                entry.load_seconds = time.perf_counter() - started
+                entry.last_used = time.monotonic()
+                self._pin(entry, value)
+            logger.info(f"Loaded corpus {entry.name} in {entry.load_seconds:.1f}s ({size / 1e6:.0f} MB)")
+            self._evict(keep=entry)
+            return value
+
+    def _hit(self, entry):
+        # Called with the lock held
+        entry.hits += 1
+        entry.last_used = time.monotonic()
+        return self._pin(entry, entry.value)
+
+    def _pin(self, entry, value):
+        # Called with the lock held
+        entry.pins[id(value)] = entry.pins.get(id(value), 0) + 1
+        return value
+
+    def _pinned(self, entry, value):
+        return entry.pins.get(id(value), 0) > 0
+
+    def replace(self, name, value):
+        """Swap in a new value for a loaded corpus (e.g. after a re-index). The old one is released once idle."""
+        entry = self._entry(name)
+        size = self._size_of(value) if self._size_of else 0
+        with self._lock:
+            previous, entry.value, entry.size = entry.value, value, size
+            entry.last_used = time.monotonic()
+            retired = self._retire(entry, previous)
+        self._release(retired)
+        self._evict(keep=entry)
+
+    def _retire(self, entry, value):
+        # Called with the lock held. Returns values that can be released right away.
+        if value is None:
+            return []
+        if self._pinned(entry, value):
+            entry.retired.append(value)
+            return []
+        return [value]
+
+    def _unpin(self, entry, value):
+        released = []
+        with self._lock:
+            entry.pins[id(value)] -= 1
+            idle = entry.pins[id(value)] == 0
+            if idle:
+                del entry.pins[id(value)]
+                if any(retired is value for retired in entry.retired):
+                    entry.retired = [retired for retired in entry.retired if retired is not value]
+                    released.append(value)
+        self._release(released)
+        if idle and not released:
+            # Eviction skips corpora in use, so the bounds may only hold again now
+            self._evict()
+
+    def _release(self, values):
+        for value in values:
+            if self._unload:
+                try:
+                    self._unload(value)
+                except Exception as e:
+                    logger.warning(f"Error unloading a corpus: {e}")
+
+    def _evict(self, keep=None):
+        """Unload least recently used idle corpora until the count and memory bounds hold."""
+        released = []
+        with self._lock:
+            loaded = sorted(
+                (entry for entry in self._entries.values() if entry.value is not None and entry is not keep),
+                key=lambda entry: entry.last_used,
+            )
+            count = len(loaded) + (1 if keep is not None and keep.value is not None else 0)
+            total = sum(entry.size for entry in loaded) + (keep.size if keep is not None else 0)
+            for entry in loaded:
+                over_count = self.max_loaded and count > self.max_loaded
+                over_bytes = self.max_bytes and total > self.max_bytes
+                if not (over_count or over_bytes):
+                    break
+                if self._pinned(entry, entry.value):
+                    # In use; unloading it now would only make the next query load a second copy
+                    continue
+                logger.info(f"Unloading corpus {entry.name} ({entry.size / 1e6:.0f} MB, idle)")
+                released.append(entry.value)
+                count -= 1
+                total -= entry.size
+                entry.value, entry.size = None, 0
+                entry.evictions += 1
+        self._release(released)
+
+    # --------------------------
+    # Stats
+    # --------------------------
+    def stats(self):
+        with self._lock:
+            return [
+                {
+                    "name": entry.name,
+                    "folder": entry.folder,
+                    "loaded": entry.value is not None,
+                    "bytes": entry.size,
+                    "hits": entry.hits,
+                    "loads": entry.loads,
+                    "evictions": entry.evictions,
+                    "load_seconds": entry.load_seconds,
+                    "in_use": sum(entry.pins.values()),
+                }
+                for entry in self._entries.values()
+            ]
+
+    def stats_summary(self, describe=None):
+        """
+        One line per corpus: loaded state, approximate memory and hit/load counts.
+        describe(value), if given, adds details for loaded corpora without counting as a use.
+        """
+        lines = []
+        for stats in self.stats():
+            state = f"loaded, ~{stats['bytes'] / 1e6:.0f} MB" if stats["loaded"] else "not loaded"
+            line = (
+                f"{stats['name']}: {state}, {stats['hits']} hits, {stats['loads']} loads, "
+                f"{stats['evictions']} evictions"
+            )
+            details = self.describe_loaded(stats["name"], describe) if describe and stats["loaded"] else None
+            lines.append(f"{line}, {details}" if details else line)
+        return "\n".join(lines)
+
+    def describe_loaded(self, name, describe):
+        """describe(value) for a corpus that is already loaded, else None. Never loads the corpus or counts as a use."""
+        entry = self._entry(name)
+        with self._lock:
+            if entry.value is None:
+                return None
+            # Pin the value so it can't be unloaded while it is described
+            value = self._pin(entry, entry.value)
+        try:
+            return describe(value)
+        except Exception as e:
+            logger.warning(f"Could not describe corpus {name}: {e}")
+            return None
+        finally:
+            self._unpin(entry, value)
@@ -0,0 +1,208 @@
+# dedupe.py
+#
+# Near-duplicate detection for ingestion. Every file and chunk gets a MinHash
+# signature over its word 5-shingles; signatures are split into bands and
+# stored in LSH buckets, so finding candidates for a new text is a few indexed
+# lookups instead of a comparison with everything indexed. Candidates are then
+# confirmed by their estimated Jaccard similarity.
+#
+# Copies of the same deck saved under another name, or the same passage pasted
+# into many scripts, are indexed once; the copies are recorded as pointers to
+# the canonical file or chunk and are never embedded.
+
+import re
+import sqlite3
+import hashlib
+import threading
+
+import numpy as np
+
+SHINGLE_SIZE = 5
+NUM_PERM = 64
+BANDS = 16  # 4 rows per band: pairs above ~0.5 similarity almost always share a bucket
+DEFAULT_THRESHOLD = 0.9
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_BLOCK = 8192  # Shingles hashed per step; bounds the temporary (shingles x permutations) matrix
+
+
+def shingle_hashes(text):
+    """32-bit hashes of the word 5-shingles of text (the whole text if it is shorter)."""
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles),
+        dtype=np.uint64, count=len(shingles),
+    )
+
+
+class MinHasher:
+    """MinHash signatures from NUM_PERM seeded universal hash functions."""
+
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self._a = rng.randint(1, _MAX_HASH, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, _MAX_HASH, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        """A uint32 signature, or None for text without words."""
+        hashes = shingle_hashes(text)
+        if not len(hashes):
+            return None
+        signature = np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        for start in range(0, len(hashes), _BLOCK):
+            block = hashes[start:start + _BLOCK, None]
+            permuted = ((block * self._a + self._b) % _PRIME) & _MAX_HASH
+            signature = np.minimum(signature, permuted.min(axis=0))
+        return signature.astype(np.uint32)
+
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of the texts behind two signatures."""
+    return float(np.mean(a == b))
+
+
+def _band_buckets(signature, bands=BANDS):
+    rows = len(signature) // bands
+    return [
+        int.from_bytes(hashlib.blake2b(signature[band * rows:(band + 1) * rows].tobytes(), digest_size=8).digest(),
+                       "little", signed=True)
+        for band in range(bands)
+    ]
+
+
+class DedupeIndex:
+    """
+    Persisted MinHash/LSH index of files and chunks ("file" and "chunk" kinds).
+
+    Each entry has an owner, the file it came from, so a changed or removed file
+    can drop its fingerprints and the duplicates that point at it can be re-checked.
+    """
+
+    def __init__(self, path, threshold=DEFAULT_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.hasher = MinHasher()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS signatures ("
+            "kind TEXT NOT NULL, key TEXT NOT NULL, owner TEXT NOT NULL, signature BLOB NOT NULL, "
+            "PRIMARY KEY (kind, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS signatures_owner ON signatures (owner)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (kind TEXT NOT NULL, band INTEGER NOT NULL, bucket INTEGER NOT NULL, "
+            "key TEXT NOT NULL, owner TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS buckets_lookup ON buckets (kind, band, bucket)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS buckets_owner ON buckets (owner)")
+        # Pointers from each skipped copy to the entry that was indexed in its place
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS duplicates ("
+            "kind TEXT NOT NULL, key TEXT NOT NULL, owner TEXT NOT NULL, canonical TEXT NOT NULL, "
+            "canonical_owner TEXT NOT NULL, chars INTEGER NOT NULL, PRIMARY KEY (kind, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS duplicates_canonical ON duplicates (kind, canonical)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS duplicates_canonical_owner ON duplicates (canonical_owner)")
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def signature(self, text):
+        return self.hasher.signature(text)
+
+    def find(self, kind, signature, exclude_owner=None):
+        """The (key, owner) of the most similar indexed entry at or above the threshold, or None."""
+        if signature is None:
+            return None
+        buckets = _band_buckets(signature)
+        with self._lock:
+            candidates = set()
+            for band, bucket in enumerate(buckets):
+                candidates.update(self._conn.execute(
+                    "SELECT key, owner FROM buckets WHERE kind = ? AND band = ? AND bucket = ?", (kind, band, bucket)
+                ).fetchall())
+            best, best_score = None, self.threshold
+            for key, owner in candidates:
+                if owner == exclude_owner:
+                    continue
+                row = self._conn.execute(
+                    "SELECT signature FROM signatures WHERE kind = ? AND key = ?", (kind, key)
+                ).fetchone()
+                score = similarity(signature, np.frombuffer(row[0], dtype=np.uint32)) if row else 0.0
+                if score >= best_score:
+                    best, best_score = (key, owner), score
+        return best
+
+    def add(self, kind, key, owner, signature):
+        if signature is None:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO signatures (kind, key, owner, signature) VALUES (?, ?, ?, ?)",
+                (kind, key, owner, signature.tobytes()),
+            )
+            self._conn.executemany(
+                "INSERT INTO buckets (kind, band, bucket, key, owner) VALUES (?, ?, ?, ?, ?)",
+                [(kind, band, bucket, key, owner) for band, bucket in enumerate(_band_buckets(signature))],
+            )
+
+    def add_duplicate(self, kind, key, owner, canonical, canonical_owner, chars):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO duplicates (kind, key, owner, canonical, canonical_owner, chars) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, key, owner, canonical, canonical_owner, chars),
+            )
+
+    def commit(self):
+        """Persist fingerprints added since the last commit; done with every manifest save."""
+        with self._lock:
+            self._conn.commit()
+
+    def remove_owner(self, owner):
+        """Forget the fingerprints and duplicate pointers of a file."""
+        with self._lock:
+            for table in ("signatures", "buckets", "duplicates"):
+                self._conn.execute(f"DELETE FROM {table} WHERE owner = ?", (owner,))
+            self._conn.commit()
+
+    def dependents(self, owners):
+        """Files with content skipped as a copy of something in owners."""
+        found = set()
+        with self._lock:
+            for owner in owners:
+                found.update(row[0] for row in self._conn.execute(
+                    "SELECT DISTINCT owner FROM duplicates WHERE canonical_owner = ?", (owner,)
+                ))
+        return found - set(owners)
+
+    def duplicates_of(self, kind, canonical):
+        """Keys skipped as copies of canonical: the pointer list for a file or chunk."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT key FROM duplicates WHERE kind = ? AND canonical = ? ORDER BY key", (kind, canonical)
+            )]
+
+    def stats(self):
+        with self._lock:
+            counts = dict(((kind, (count, chars)) for kind, count, chars in self._conn.execute(
+                "SELECT kind, COUNT(*), COALESCE(SUM(chars), 0) FROM duplicates GROUP BY kind"
+            )))
+        files, file_chars = counts.get("file", (0, 0))
+        chunks, chunk_chars = counts.get("chunk", (0, 0))
+        return {"duplicate_files": files, "duplicate_chunks": chunks, "chars_saved": file_chars + chunk_chars}
+
+    def stats_summary(self):
+        stats = self.stats()
+        # ~4 characters per token for English text
+        return (
+            f"{stats['duplicate_files']} duplicate files and {stats['duplicate_chunks']} duplicate chunks skipped, "
+            f"{stats['chars_saved']:,} characters (~{stats['chars_saved'] // 4:,} tokens) not embedded"
+        )
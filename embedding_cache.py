@@ -0,0 +1,146 @@
+# embedding_cache.py
+#
+# A persistent embedding cache that sits in front of the embedding model.
+# Vectors are stored in SQLite keyed by model name plus the SHA-256 of the
+# chunk text, so re-indexing unchanged or repeated boilerplate chunks costs no
+# embedding calls. Misses are deduplicated and sent in large concurrent batches.
+
+import os
+import sqlite3
+import hashlib
+import logging
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 512
+DEFAULT_CONCURRENCY = 4
+# SQLite caps the number of bound parameters per statement
+LOOKUP_CHUNK = 500
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """Wrap an Embeddings model with an on-disk cache and batched, concurrent miss handling."""
+
+    def __init__(self, underlying, cache_path, model_name=None, batch_size=DEFAULT_BATCH_SIZE,
+                 max_concurrency=DEFAULT_CONCURRENCY):
+        self.underlying = underlying
+        self.model_name = model_name or getattr(underlying, "model", None) or type(underlying).__name__
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.hits = 0
+        self.misses = 0
+        self.deduped = 0
+        self._lock = threading.Lock()
+
+        cache_dir = os.path.dirname(os.path.abspath(cache_path))
+        os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, PRIMARY KEY (model, hash))"
+        )
+        self._conn.commit()
+
+    # --------------------------
+    # Storage
+    # --------------------------
+    def _lookup(self, hashes, model):
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), LOOKUP_CHUNK):
+                batch = hashes[start:start + LOOKUP_CHUNK]
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(batch))})",
+                    [model, *batch],
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+        return found
+
+    def _store(self, items, model):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(model, key, array("f", vector).tobytes()) for key, vector in items],
+            )
+            self._conn.commit()
+
+    # --------------------------
+    # Embeddings interface
+    # --------------------------
+    def embed_documents(self, texts):
+        hashes = [text_hash(text) for text in texts]
+        unique = dict(zip(hashes, texts))
+        vectors = self._lookup(list(unique), self.model_name)
+        missing = [key for key in unique if key not in vectors]
+
+        with self._lock:
+            self.hits += len(unique) - len(missing)
+            self.misses += len(missing)
+            self.deduped += len(texts) - len(unique)
+
+        if missing:
+            batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+
+            def embed_batch(keys):
+                embedded = self.underlying.embed_documents([unique[key] for key in keys])
+                items = list(zip(keys, embedded))
+                self._store(items, self.model_name)
+                return items
+
+            if len(batches) == 1:
+                results = [embed_batch(batches[0])]
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                    results = list(executor.map(embed_batch, batches))
+            for items in results:
+                vectors.update(items)
+
+        return [list(vectors[key]) for key in hashes]
+
+    def embed_query(self, text):
+        # Some models embed queries differently from documents, so they get their own key space
+        model = f"{self.model_name}:query"
+        key = text_hash(text)
+        cached = self._lookup([key], model)
+        if key in cached:
+            with self._lock:
+                self.hits += 1
+            return cached[key]
+        vector = self.underlying.embed_query(text)
+        self._store([(key, vector)], model)
+        with self._lock:
+            self.misses += 1
+        return vector
+
+    # --------------------------
+    # Stats
+    # --------------------------
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "deduped": self.deduped,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def stats_summary(self):
+        stats = self.stats()
+        return (
+            f"{stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), "
+            f"{stats['deduped']} duplicate chunks skipped"
+        )
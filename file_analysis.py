@@ -0,0 +1,166 @@
+# file_analysis.py
+#
+# Map-reduce analysis of large uploaded files. The upload is streamed to a
+# temporary file under a size cap, PDF pages are extracted across a process
+# pool, and the text is split into token-sized chunks. Each chunk is analyzed
+# by its own concurrent LLM call (map) and the partial analyses are merged into
+# one answer (reduce), in several rounds if they don't fit in a single prompt.
+
+import os
+import logging
+import tempfile
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from context_packer import count_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+DOWNLOAD_TIMEOUT = 60  # Seconds to connect and between received bytes
+PAGES_PER_TASK = 20
+DEFAULT_CHUNK_TOKENS = 3000
+DEFAULT_MAP_CONCURRENCY = 4
+MAX_REDUCE_ROUNDS = 3
+
+# Files that fit in one chunk are analyzed in a single call, as before
+SINGLE_PROMPT = "Please analyze the following file content:\n{text}"
+MAP_PROMPT = (
+    "You are analyzing part {part} of {parts} of a larger document. "
+    "Extract the key points, obligations, figures, dates and risks in this part. Be concise.\n\n{text}"
+)
+REDUCE_PROMPT = (
+    "Below are analyses of consecutive parts of one document. Combine them into a single analysis of the whole "
+    "document: summarize it, list the key points, and call out anything unusual or risky.\n\n{text}"
+)
+# Intermediate reduce rounds merge neighbouring analyses without yet writing the final answer
+GROUP_PROMPT = (
+    "Below are analyses of consecutive parts ({part} of {parts}) of one document. Merge them into one concise "
+    "analysis that keeps every key point, obligation, figure, date and risk.\n\n{text}"
+)
+
+
+class FileTooLarge(Exception):
+    pass
+
+
+def download_to_tempfile(url, headers=None, max_bytes=DEFAULT_MAX_BYTES, suffix="", session=None):
+    """Stream url into a temporary file and return its path. The caller deletes the file."""
+    with (session or requests).get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+        response.raise_for_status()
+        if int(response.headers.get("Content-Length") or 0) > max_bytes:
+            raise FileTooLarge(f"File is larger than the {max_bytes // (1024 * 1024)} MB limit.")
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        received = 0
+        try:
+            with os.fdopen(handle, "wb") as f:
+                for block in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                    received += len(block)
+                    # Content-Length can be missing or wrong, so the cap is enforced on the bytes themselves
+                    if received > max_bytes:
+                        raise FileTooLarge(f"File is larger than the {max_bytes // (1024 * 1024)} MB limit.")
+                    f.write(block)
+        except BaseException:
+            os.remove(path)
+            raise
+    return path
+
+
+def _extract_pages(task):
+    # Runs in a worker process; each worker opens the PDF itself rather than receiving parsed pages
+    from PyPDF2 import PdfReader
+
+    path, start, stop = task
+    reader = PdfReader(path)
+    return [reader.pages[number].extract_text() or "" for number in range(start, stop)]
+
+
+def extract_pdf_text(path, workers=None):
+    """Extract the text of every page, spreading page ranges across a process pool."""
+    from PyPDF2 import PdfReader
+
+    page_count = len(PdfReader(path).pages)
+    tasks = [(path, start, min(start + PAGES_PER_TASK, page_count)) for start in range(0, page_count, PAGES_PER_TASK)]
+    if len(tasks) <= 1:
+        pages = [page for task in tasks for page in _extract_pages(task)]
+    else:
+        with multiprocessing.Pool(min(workers or os.cpu_count() or 1, len(tasks))) as pool:
+            pages = [page for batch in pool.map(_extract_pages, tasks) for page in batch]
+    return "\n\n".join(page for page in pages if page.strip())
+
+
+def extract_text(path, mimetype, workers=None):
+    """Extract text from a downloaded file. Returns None for unsupported types."""
+    if "pdf" in mimetype:
+        return extract_pdf_text(path, workers)
+    if "text" in mimetype:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return f.read()
+    return None
+
+
+def split_by_tokens(text, chunk_tokens=DEFAULT_CHUNK_TOKENS, model=""):
+    """Split text into chunks of at most chunk_tokens tokens, preferring paragraph and line breaks."""
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_tokens,
+        chunk_overlap=chunk_tokens // 20,
+        length_function=lambda part: count_tokens(part, model),
+    )
+    return splitter.split_text(text)
+
+
+class MapReduceAnalyzer:
+    """Analyze each chunk concurrently, then merge the partial analyses into one."""
+
+    def __init__(self, llm, model="", chunk_tokens=DEFAULT_CHUNK_TOKENS, max_concurrency=DEFAULT_MAP_CONCURRENCY,
+                 instructions="", on_progress=None):
+        self.llm = llm
+        self.model = model
+        self.chunk_tokens = chunk_tokens
+        self.max_concurrency = max_concurrency
+        self.instructions = instructions
+        self.on_progress = on_progress or (lambda stage, done, total: None)
+
+    def _ask(self, prompt):
+        return self.llm.invoke(self.instructions + prompt).content
+
+    def _map(self, chunks, stage, template):
+        results = [None] * len(chunks)
+        done = 0
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = {
+                executor.submit(self._ask, template.format(part=number + 1, parts=len(chunks), text=chunk)): number
+                for number, chunk in enumerate(chunks)
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                done += 1
+                self.on_progress(stage, done, len(chunks))
+        return results
+
+    def analyze(self, text):
+        chunks = split_by_tokens(text, self.chunk_tokens, self.model)
+        if not chunks:
+            return ""
+        logger.info(f"Analyzing {len(chunks)} chunk(s) of up to {self.chunk_tokens} tokens")
+        if len(chunks) == 1:
+            self.on_progress("analyze", 0, 1)
+            answer = self._ask(SINGLE_PROMPT.format(text=chunks[0]))
+            self.on_progress("analyze", 1, 1)
+            return answer
+
+        partials = self._map(chunks, "map", MAP_PROMPT)
+        # Merge in rounds until the partial analyses fit into one reduce prompt
+        for _ in range(MAX_REDUCE_ROUNDS):
+            groups = split_by_tokens("\n\n---\n\n".join(partials), self.chunk_tokens, self.model)
+            if len(groups) == 1:
+                break
+            partials = self._map(groups, "reduce", GROUP_PROMPT)
+        self.on_progress("reduce", 0, 1)
+        answer = self._ask(REDUCE_PROMPT.format(text="\n\n---\n\n".join(partials)))
+        self.on_progress("reduce", 1, 1)
+        return answer
@@ -0,0 +1,365 @@
+# flat_vectorstore.py
+#
+# A brute-force vector store over a memory-mapped embedding matrix. Vectors are
+# normalized and appended to a flat file of float32 rows (or int8 rows with a
+# per-row scale), and chunk text and metadata live in a SQLite side table keyed
+# by row. Searches are blocked NumPy matrix products followed by argpartition,
+# so many queries can be scored in one pass.
+#
+# The matrix is opened read-only with np.memmap: startup only maps the file,
+# and processes that open the same index share the OS page cache instead of
+# each holding a copy. Deleted or replaced rows stay in the file until
+# compact() rewrites it once enough of them are dead. That renumbers rows, so
+# the swap is marked in the settings table and searches, in this process or
+# another, that scored rows across it are scored again.
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+logger = logging.getLogger(__name__)
+
+DB_NAME = "chunks.sqlite"
+FLOAT_NAME = "vectors.f32"
+INT8_NAME = "vectors.i8"
+SCALES_NAME = "scales.f32"
+# Rows scored per matrix product; bounds the temporary score matrix for large indexes
+DEFAULT_BLOCK_ROWS = 65536
+# compact_if_needed() rewrites the matrix once this share of its rows is dead
+COMPACT_DEAD_FRACTION = 0.3
+# Searches that raced a compaction are scored again this many times, backing off a little more each time
+SEARCH_ATTEMPTS = 5
+SEARCH_RETRY_SECONDS = 0.05
+
+
+def _normalize(vectors):
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True).clip(min=1e-12)
+
+
+def _quantize(matrix):
+    """Symmetric per-row int8 quantization. Returns (int8 rows, float32 scales)."""
+    scales = np.abs(matrix).max(axis=1).clip(min=1e-12) / 127.0
+    return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+class FlatVectorStore(VectorStore):
+    """Cosine-similarity vector store backed by a memory-mapped matrix and a SQLite side table."""
+
+    def __init__(self, path, embedding, quantize=False, block_rows=DEFAULT_BLOCK_ROWS):
+        self.path = path
+        self._embedding = embedding
+        self.block_rows = block_rows
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(path, DB_NAME), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "row INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL UNIQUE, text TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+        stored = self._setting("dtype")
+        self.dtype = stored or ("int8" if quantize else "float32")
+        if stored and stored != ("int8" if quantize else "float32"):
+            raise ValueError(f"Index at {path} holds {stored} vectors; rebuild it to change the format")
+        self._set_setting("dtype", self.dtype)
+        self.dim = int(self._setting("dim") or 0) or None
+        self._vectors_path = os.path.join(path, INT8_NAME if self.dtype == "int8" else FLOAT_NAME)
+        self._scales_path = os.path.join(path, SCALES_NAME)
+
+        # Mapped state, refreshed whenever another writer (or this one) bumps the epoch
+        self._epoch = None
+        self._layout = None  # Bumped by compact(); row numbers only mean the same chunk within one layout
+        self._matrix = None
+        self._scales = None
+        self._live = None
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def close(self):
+        with self._lock:
+            self._matrix = self._scales = self._live = None
+            self._conn.close()
+
+    # --------------------------
+    # Settings
+    # --------------------------
+    def _setting(self, key):
+        row = self._conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_setting(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _bump_epoch(self):
+        self._set_setting("epoch", int(self._setting("epoch") or 0) + 1)
+
+    # --------------------------
+    # Writing
+    # --------------------------
+    def _row_bytes(self):
+        return self.dim * (1 if self.dtype == "int8" else 4)
+
+    def _file_rows(self):
+        try:
+            return os.path.getsize(self._vectors_path) // self._row_bytes()
+        except OSError:
+            return 0
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = list(ids) if ids is not None else [os.urandom(16).hex() for _ in texts]
+        return self.add_vectors(self._embedding.embed_documents(texts), texts, metadatas, ids)
+
+    def add_vectors(self, vectors, texts, metadatas, ids):
+        """Append precomputed embeddings. Re-adding an id replaces its row."""
+        matrix = _normalize(vectors)
+        with self._lock:
+            if self.dim is None:
+                self.dim = matrix.shape[1]
+                self._set_setting("dim", self.dim)
+            elif matrix.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dimensional vectors, got {matrix.shape[1]}")
+            first_row = self._file_rows()
+            # Vectors go to disk before their rows are committed, so readers never see a row without a vector
+            if self.dtype == "int8":
+                rows, scales = _quantize(matrix)
+                with open(self._scales_path, "ab") as f:
+                    # Rows left by an interrupted write have no scale yet; pad so scales stay aligned
+                    f.truncate(first_row * 4)
+                    f.write(scales.tobytes())
+            else:
+                rows = matrix
+            with open(self._vectors_path, "ab") as f:
+                f.truncate(first_row * self._row_bytes())
+                f.write(rows.tobytes())
+            self._conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(chunk_id,) for chunk_id in ids])
+            self._conn.executemany(
+                "INSERT INTO chunks (row, chunk_id, text, metadata) VALUES (?, ?, ?, ?)",
+                [
+                    (first_row + offset, chunk_id, text, json.dumps(meta or {}))
+                    for offset, (chunk_id, text, meta) in enumerate(zip(ids, texts, metadatas))
+                ],
+            )
+            self._bump_epoch()
+            self._conn.commit()
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        if not ids:
+            return True
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(chunk_id,) for chunk_id in ids])
+            self._bump_epoch()
+            self._conn.commit()
+        return True
+
+    def compact(self):
+        """
+        Rewrite the matrix without dead rows. Searches that overlap the swap, here or in
+        another process with the index open, see the layout change and score again.
+        """
+        with self._lock:
+            if self.dim is None:
+                return 0
+            self._refresh_mapping()
+            live_rows = [row for (row,) in self._conn.execute("SELECT row FROM chunks ORDER BY row")]
+            dead = (0 if self._matrix is None else len(self._matrix)) - len(live_rows)
+            if dead <= 0:
+                return 0
+            tmp_path = self._vectors_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                for start in range(0, len(live_rows), self.block_rows):
+                    f.write(np.ascontiguousarray(self._matrix[live_rows[start:start + self.block_rows]]).tobytes())
+            if self.dtype == "int8":
+                with open(self._scales_path + ".tmp", "wb") as f:
+                    f.write(np.ascontiguousarray(self._scales[live_rows]).tobytes())
+            # Drop the maps before the files underneath them are replaced
+            self._matrix = self._scales = None
+            self._epoch = None
+            # Committed before the swap: other processes may map the new file while the rows still
+            # have their old numbers, and must not trust anything they score until it is cleared
+            self._set_setting("swapping", 1)
+            self._conn.commit()
+            try:
+                os.replace(tmp_path, self._vectors_path)
+                if self.dtype == "int8":
+                    os.replace(self._scales_path + ".tmp", self._scales_path)
+                self._conn.executemany(
+                    "UPDATE chunks SET row = ? WHERE row = ?",
+                    [(new_row, old_row) for new_row, old_row in enumerate(live_rows)],
+                )
+            finally:
+                # Even a failed swap gets a new layout, so a search that scored during it starts over
+                self._set_setting("swapping", 0)
+                self._set_setting("layout", int(self._setting("layout") or 0) + 1)
+                self._bump_epoch()
+                self._conn.commit()
+        logger.info(f"Compacted flat index at {self.path}: dropped {dead} dead rows")
+        return dead
+
+    def compact_if_needed(self, dead_fraction=COMPACT_DEAD_FRACTION):
+        """compact() once more than dead_fraction of the rows are dead. Returns the number of rows dropped."""
+        with self._lock:
+            total = self._file_rows() if self.dim else 0
+            live = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        if total and (total - live) / total > dead_fraction:
+            try:
+                return self.compact()
+            except OSError as e:
+                # Windows won't replace a file another process still has mapped
+                logger.warning(f"Could not compact flat index at {self.path}: {e}")
+        return 0
+
+    # --------------------------
+    # Searching
+    # --------------------------
+    def _refresh_mapping(self):
+        # Called with the lock held
+        epoch = self._setting("epoch")
+        if epoch == self._epoch and self._matrix is not None:
+            return
+        rows = self._file_rows() if self.dim else 0
+        if rows == 0:
+            self._matrix = self._scales = None
+            self._live = np.zeros(0, dtype=bool)
+        else:
+            dtype = np.int8 if self.dtype == "int8" else np.float32
+            self._matrix = np.memmap(self._vectors_path, dtype=dtype, mode="r", shape=(rows, self.dim))
+            if self.dtype == "int8":
+                self._scales = np.memmap(self._scales_path, dtype=np.float32, mode="r", shape=(rows,))
+            self._live = np.zeros(rows, dtype=bool)
+            live_rows = np.fromiter((row for (row,) in self._conn.execute("SELECT row FROM chunks")), dtype=np.int64)
+            self._live[live_rows[live_rows < rows]] = True
+        self._epoch = epoch
+        self._layout = self._setting("layout")
+
+    def _top_k(self, queries, k):
+        """Best rows for each query vector. Returns (layout, [(rows, scores)]), best first."""
+        with self._lock:
+            self._refresh_mapping()
+            matrix, scales, live, layout = self._matrix, self._scales, self._live, self._layout
+        queries = _normalize(queries)
+        if matrix is None or k <= 0:
+            return layout, [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in queries]
+
+        best_rows = [np.zeros(0, dtype=np.int64) for _ in queries]
+        best_scores = [np.zeros(0, dtype=np.float32) for _ in queries]
+        for start in range(0, len(matrix), self.block_rows):
+            block = matrix[start:start + self.block_rows]
+            # One (queries x rows) product per block
+            if self.dtype == "int8":
+                scores = (queries @ block.astype(np.float32).T) * scales[start:start + len(block)]
+            else:
+                scores = queries @ block.T
+            scores[:, ~live[start:start + len(block)]] = -np.inf
+            take = min(k, len(block))
+            # Top candidates of this block per query, then merged with the best so far
+            candidates = np.argpartition(-scores, take - 1, axis=1)[:, :take]
+            for number in range(len(queries)):
+                rows = candidates[number]
+                best_rows[number] = np.concatenate([best_rows[number], rows + start])
+                best_scores[number] = np.concatenate([best_scores[number], scores[number, rows]])
+
+        results = []
+        for rows, scores in zip(best_rows, best_scores):
+            keep = np.isfinite(scores)
+            rows, scores = rows[keep], scores[keep]
+            order = np.argsort(-scores)[:k]
+            results.append((rows[order], scores[order]))
+        return layout, results
+
+    def _documents(self, rows, layout):
+        """Documents for rows scored under layout, or None if a compaction has renumbered rows since (or is)."""
+        rows = sorted({int(row) for row in rows})
+        with self._lock:
+            if self._setting("layout") != layout or self._setting("swapping") == "1":
+                return None
+            found = self._conn.execute(
+                f"SELECT row, text, metadata FROM chunks WHERE row IN ({','.join('?' * len(rows))})", rows,
+            ).fetchall() if rows else []
+        return {row: Document(page_content=text, metadata=json.loads(meta)) for row, text, meta in found}
+
+    def vectors_for(self, chunk_ids):
+        """The stored (normalized) vectors of chunk_ids, as {chunk_id: vector}. Unknown ids are left out."""
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids:
+            return {}
+        with self._lock:
+            self._refresh_mapping()
+            found = self._conn.execute(
+                f"SELECT chunk_id, row FROM chunks WHERE chunk_id IN ({','.join('?' * len(chunk_ids))})", chunk_ids,
+            ).fetchall()
+            found = [(chunk_id, row) for chunk_id, row in found if self._matrix is not None and row < len(self._matrix)]
+            if not found:
+                return {}
+            rows = [row for _, row in found]
+            vectors = np.asarray(self._matrix[rows], dtype=np.float32)
+            if self.dtype == "int8":
+                vectors = vectors * self._scales[rows][:, None]
+        return {chunk_id: vector for (chunk_id, _), vector in zip(found, vectors)}
+
+    def similarity_search_with_score_by_vectors(self, vectors, k=4):
+        """Score many query vectors in one pass. Returns one [(Document, cosine similarity)] list per vector."""
+        for attempt in range(SEARCH_ATTEMPTS):
+            if attempt:
+                time.sleep(SEARCH_RETRY_SECONDS * attempt)
+            layout, hits = self._top_k(vectors, k)
+            documents = self._documents(np.concatenate([rows for rows, _ in hits]) if hits else [], layout)
+            if documents is not None:
+                break
+        else:
+            raise RuntimeError(f"Flat index at {self.path} kept being compacted during a search")
+        # A row deleted between scoring and lookup is simply skipped; compaction is the only thing that renumbers rows
+        return [
+            [(documents[row], float(score)) for row, score in zip(rows.tolist(), scores) if row in documents]
+            for rows, scores in hits
+        ]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vectors([self._embedding.embed_query(query)], k)[0]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vectors([embedding], k)[0]]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def batch_similarity_search(self, queries, k=4):
+        """Score many queries together. Returns one Document list per query."""
+        # embed_query, not embed_documents: some models embed queries and passages differently
+        vectors = [self._embedding.embed_query(query) for query in queries]
+        return [[doc for doc, _ in hits] for hits in self.similarity_search_with_score_by_vectors(vectors, k)]
+
+    def _select_relevance_score_fn(self):
+        # Cosine similarity in [-1, 1] mapped to a [0, 1] relevance score
+        return lambda score: (score + 1.0) / 2.0
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, path=None, quantize=False, **kwargs):
+        if path is None:
+            raise ValueError("FlatVectorStore.from_texts needs a path")
+        store = cls(path, embedding, quantize=quantize)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
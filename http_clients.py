@@ -0,0 +1,219 @@
+# http_clients.py
+#
+# Shared, pooled HTTP clients. Each upstream gets one keep-alive connection pool
+# with timeouts and retries: Slack Web API calls go through PooledWebClient,
+# which also rate limits itself per Slack method tier, and plain downloads go
+# through a requests Session. Retries back off exponentially with jitter and
+# wait out Retry-After when the server sends one.
+
+import io
+import time
+import logging
+import threading
+from email.message import Message
+from http.client import RemoteDisconnected
+from urllib.error import HTTPError, URLError
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from slack_sdk import WebClient
+from slack_sdk.http_retry import ConnectionErrorRetryHandler, RateLimitErrorRetryHandler, RetryHandler
+from slack_sdk.http_retry.builtin_interval_calculators import BackoffRetryIntervalCalculator
+from slack_sdk.http_retry.jitter import RandomJitter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30  # Seconds
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5  # Seconds; doubles on every retry
+DEFAULT_POOL_SIZE = 16
+
+# Slack's documented rate limit tiers, in calls per minute per method per workspace
+SLACK_TIER_LIMITS = {1: 1, 2: 20, 3: 50, 4: 100}
+SLACK_METHOD_TIERS = {
+    "auth.test": 4,
+    "chat.postMessage": 4,  # Really "special": ~1/second per channel, which ChannelRateLimiter enforces
+    "chat.postEphemeral": 4,
+    "chat.update": 3,
+    "files.info": 4,
+    "views.open": 4,
+}
+DEFAULT_SLACK_TIER = 3
+
+
+class TokenBucket:
+    """Allows rate_per_minute calls on average with bursts of up to burst calls."""
+
+    def __init__(self, rate_per_minute, burst=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(burst or max(1, rate_per_minute // 6))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, sleeping until one is available. Returns the seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def try_acquire(self):
+        """Take one token if one is available right now. Never sleeps."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class ServerErrorRetryHandler(RetryHandler):
+    """Retries Slack calls that failed with a 5xx response."""
+
+    def _can_retry(self, *, state, request, response=None, error=None):
+        return response is not None and 500 <= response.status_code < 600
+
+
+class _SSLContextAdapter(HTTPAdapter):
+    """An HTTPAdapter whose connections use a given ssl.SSLContext (WebClient's ssl option)."""
+
+    def __init__(self, ssl_context=None, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.ssl_context is not None:
+            kwargs["ssl_context"] = self.ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, *args, **kwargs):
+        if self.ssl_context is not None:
+            kwargs["ssl_context"] = self.ssl_context
+        return super().proxy_manager_for(*args, **kwargs)
+
+
+# The hook PooledWebClient overrides is private to slack_sdk; without it calls go through urllib unpooled
+_CAN_POOL = hasattr(WebClient, "_perform_urllib_http_request_internal")
+
+
+class PooledWebClient(WebClient):
+    """
+    A WebClient that reuses connections and paces each Slack method at its tier's rate.
+
+    api_call() waits for the method's slot. Best-effort callers, such as streaming edits,
+    can call try_acquire() first and skip the call when it returns False; the slot it
+    takes is then used by the calling thread's next call of that method.
+    """
+
+    def __init__(self, *args, pool_size=DEFAULT_POOL_SIZE, **kwargs):
+        super().__init__(*args, **kwargs)
+        # slack_sdk opens a new connection (and TLS handshake) per call; a Session keeps them alive
+        self.session = requests.Session()
+        adapter = _SSLContextAdapter(self.ssl, pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if not _CAN_POOL:
+            logger.warning("This slack_sdk version has no request hook to override; Slack calls won't be pooled")
+        # Slack limits each method separately, so each gets its own bucket at its tier's rate
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+        self._reserved = threading.local()
+
+    def _bucket(self, api_method):
+        with self._buckets_lock:
+            bucket = self._buckets.get(api_method)
+            if bucket is None:
+                tier = SLACK_METHOD_TIERS.get(api_method, DEFAULT_SLACK_TIER)
+                bucket = self._buckets[api_method] = TokenBucket(SLACK_TIER_LIMITS[tier])
+            return bucket
+
+    def try_acquire(self, api_method):
+        """Reserve a slot for this thread's next api_method call if one is free now. Never sleeps."""
+        if not self._bucket(api_method).try_acquire():
+            return False
+        reserved = getattr(self._reserved, "methods", None)
+        if reserved is None:
+            reserved = self._reserved.methods = set()
+        reserved.add(api_method)
+        return True
+
+    def api_call(self, api_method, *args, **kwargs):
+        reserved = getattr(self._reserved, "methods", None)
+        if reserved and api_method in reserved:
+            reserved.discard(api_method)
+        else:
+            waited = self._bucket(api_method).acquire()
+            if waited > 1:
+                logger.info(f"Waited {waited:.1f}s for a Slack rate limit slot for {api_method}")
+        return super().api_call(api_method, *args, **kwargs)
+
+    def _perform_urllib_http_request_internal(self, url, req):
+        # slack_sdk sets an int Content-Length on multipart uploads, which requests rejects; it computes
+        # its own from the body. The multipart Content-Type is kept: its boundary matches the prebuilt body.
+        headers = {name: str(value) for name, value in req.header_items() if name.lower() != "content-length"}
+        response = self.session.request(
+            req.get_method(), url, data=req.data, headers=headers,
+            timeout=self.timeout, proxies={"http": self.proxy, "https": self.proxy} if self.proxy else None,
+        )
+        headers = Message()
+        for name, value in response.headers.items():
+            headers[name] = value
+        if response.status_code >= 400:
+            # slack_sdk's retry handlers (429 Retry-After, 5xx) work off urllib's HTTPError
+            raise HTTPError(url, response.status_code, response.reason, headers, io.BytesIO(response.content))
+        return {"status": response.status_code, "headers": headers, "body": response.text}
+
+
+def build_slack_client(token, base_url=WebClient.BASE_URL, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                       pool_size=DEFAULT_POOL_SIZE):
+    """One shared Slack client: keep-alive pool, tier pacing, and retries for 429s, 5xx and connection errors."""
+    backoff = BackoffRetryIntervalCalculator(backoff_factor=DEFAULT_BACKOFF, jitter=RandomJitter())
+    return PooledWebClient(
+        token=token,
+        base_url=base_url,
+        timeout=timeout,
+        pool_size=pool_size,
+        retry_handlers=[
+            RateLimitErrorRetryHandler(max_retry_count=retries),
+            ServerErrorRetryHandler(max_retry_count=retries, interval_calculator=backoff),
+            ConnectionErrorRetryHandler(
+                max_retry_count=retries, interval_calculator=backoff,
+                # Connection failures surface as requests errors once calls go through the Session
+                error_types=[URLError, ConnectionResetError, RemoteDisconnected, requests.ConnectionError],
+            ),
+        ],
+    )
+
+
+def build_http_session(retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, pool_size=DEFAULT_POOL_SIZE):
+    """A requests Session that retries idempotent requests with jittered backoff, honoring Retry-After."""
+    options = dict(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    try:
+        retry = Retry(backoff_jitter=backoff, **options)
+    except TypeError:
+        # urllib3 < 2 has no jitter option
+        retry = Retry(**options)
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
@@ -0,0 +1,98 @@
+# hybrid_retriever.py
+#
+# Hybrid retrieval: dense vector search and BM25 keyword search are run side by
+# side and their rankings fused with reciprocal rank fusion (RRF). An optional
+# maximal-marginal-relevance (MMR) pass then trades a little relevance for
+# diversity, so the k chunks that reach the prompt don't repeat each other.
+
+from typing import Any, List
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+RRF_K = 60  # Damping constant from the original RRF paper
+DEFAULT_K = 8
+DEFAULT_FETCH_K = 30
+DEFAULT_MMR_LAMBDA = 0.7
+
+
+def reciprocal_rank_fusion(rankings, rrf_k=RRF_K):
+    """Fuse several ranked lists of (id, document) pairs. Returns [(id, document, score)], best first."""
+    scores = {}
+    documents = {}
+    for ranking in rankings:
+        for rank, (chunk_id, doc) in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+            documents.setdefault(chunk_id, doc)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [(chunk_id, documents[chunk_id], scores[chunk_id]) for chunk_id in ordered]
+
+
+def mmr_select(relevance, embeddings, k, lambda_mult=DEFAULT_MMR_LAMBDA):
+    """Pick k indices balancing relevance against similarity to what was already picked."""
+    if len(relevance) == 0:
+        return []
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True).clip(min=1e-12)
+    relevance = np.asarray(relevance, dtype=np.float32)
+    relevance = relevance / (relevance.max() or 1.0)
+    similarity = matrix @ matrix.T
+
+    selected = [int(np.argmax(relevance))]
+    while len(selected) < min(k, len(relevance)):
+        redundancy = similarity[:, selected].max(axis=1)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        selected.append(int(np.argmax(scores)))
+    return selected
+
+
+def stored_vectors(vectorstore, chunk_ids):
+    """The embeddings already stored for chunk_ids, as {chunk_id: vector}. Ids without one are left out."""
+    if hasattr(vectorstore, "vectors_for"):
+        return vectorstore.vectors_for(chunk_ids)
+    # Chroma keeps the vectors next to the chunks; get() returns them in its own order
+    found = vectorstore._collection.get(ids=list(chunk_ids), include=["embeddings"])
+    embeddings = found.get("embeddings")
+    if embeddings is None:
+        return {}
+    return {chunk_id: vector for chunk_id, vector in zip(found["ids"], embeddings) if vector is not None}
+
+
+class HybridRetriever(BaseRetriever):
+    """Fuse vector and BM25 results with RRF, optionally diversified with MMR."""
+
+    vectorstore: Any
+    lexical: Any
+    k: int = DEFAULT_K
+    fetch_k: int = DEFAULT_FETCH_K
+    use_mmr: bool = True
+    mmr_lambda: float = DEFAULT_MMR_LAMBDA
+    packer: Any = None  # Optional ContextPacker applied to the final chunks
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query, *, run_manager=None) -> List[Document]:
+        documents = self._select(query)
+        return self.packer.pack(documents) if self.packer is not None else documents
+
+    def _select(self, query):
+        dense = [
+            (doc.metadata.get("chunk_id", doc.page_content), doc)
+            for doc in self.vectorstore.similarity_search(query, k=self.fetch_k)
+        ]
+        sparse = self.lexical.search(query, self.fetch_k)
+        fused = reciprocal_rank_fusion([dense, sparse])
+        if not self.use_mmr or len(fused) <= self.k:
+            return [doc for _, doc, _ in fused[:self.k]]
+
+        # MMR compares the candidates with the vectors stored at indexing time; nothing is embedded again
+        vectors = stored_vectors(self.vectorstore, [chunk_id for chunk_id, _, _ in fused])
+        if len(vectors) < len(fused):
+            # Chunks from before chunk ids were stored can't be looked up; keep the fused order
+            return [doc for _, doc, _ in fused[:self.k]]
+        embeddings = [vectors[chunk_id] for chunk_id, _, _ in fused]
+        picked = mmr_select([score for _, _, score in fused], embeddings, self.k, self.mmr_lambda)
+        return [fused[i][1] for i in picked]
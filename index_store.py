@@ -0,0 +1,510 @@
+# index_store.py
+#
+# Persistent on-disk vector index shared by the desktop app and the Slack bot.
+# Chunks live in a Chroma collection under the index directory, and a manifest
+# records the content hash, mtime and chunk ids of every indexed file so a
+# refresh only parses and embeds files that were added or changed.
+#
+# The index directory holds one or more generations (gen-0, gen-1, ...) and a
+# CURRENT file naming the live one. A background re-index forks the live
+# generation, refreshes the copy and publishes it, so readers never see a
+# half-built index.
+#
+# Next to the vector store each generation keeps a BM25 keyword index over the
+# same chunks (lexical.sqlite), used by the hybrid retriever.
+#
+# The vector store is Chroma by default. The "flat" backend keeps embeddings in
+# a memory-mapped float32 matrix ("flat-int8": int8-quantized) instead, which
+# opens instantly and is shared through the page cache by every process that
+# loads the same index (see flat_vectorstore.py).
+#
+# Files and chunks are fingerprinted with MinHash as they are indexed
+# (dedupe.sqlite). A near-copy of a file that is already indexed is recorded in
+# the manifest as a pointer to it and is not embedded, and neither are chunks
+# that repeat an indexed chunk; see dedupe.py.
+
+import os
+import json
+import hashlib
+import shutil
+import logging
+import threading
+from collections import Counter
+from contextlib import closing
+
+from langchain_community.vectorstores import Chroma
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.indexes.vectorstore import VectorStoreIndexWrapper
+from langchain_core.documents import Document
+
+from ingest import DEFAULT_MAX_BYTES, DEFAULT_TIMEOUT, IngestReport, iter_parsed
+from lexical_index import LexicalIndex
+from flat_vectorstore import FlatVectorStore
+from dedupe import DEFAULT_THRESHOLD as DEFAULT_DEDUPE_THRESHOLD, DedupeIndex
+from hybrid_retriever import DEFAULT_FETCH_K, DEFAULT_K, HybridRetriever
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+CURRENT_NAME = "CURRENT"
+COLLECTION_NAME = "localai"
+# Save the manifest every N processed files so an interrupted build keeps its progress
+MANIFEST_SAVE_EVERY = 200
+# Chunks are buffered across files and embedded in batches of this size
+ADD_BATCH_SIZE = 1024
+LEXICAL_NAME = "lexical.sqlite"
+DEDUPE_NAME = "dedupe.sqlite"
+BACKENDS = ("chroma", "flat", "flat-int8")
+
+# Generation directories held open in this process; prune() leaves them alone
+_open_generations = Counter()
+_open_lock = threading.Lock()
+
+
+def index_dir_for(folder_path, index_root):
+    """Return the index directory used for a given corpus folder."""
+    folder_key = hashlib.sha1(os.path.abspath(folder_path).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(index_root, folder_key)
+
+
+def file_sha256(path, block_size=1 << 20):
+    """Hash a file's content without reading it into memory at once."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan_folder(folder_path, exclude_dirs=()):
+    """Yield (relative_path, absolute_path) for every non-hidden file under folder_path."""
+    excluded = {os.path.abspath(d) for d in exclude_dirs}
+    for root, dirs, files in os.walk(folder_path):
+        dirs[:] = sorted(
+            d for d in dirs
+            if not d.startswith(".") and os.path.abspath(os.path.join(root, d)) not in excluded
+        )
+        for name in sorted(files):
+            if name.startswith("."):
+                continue
+            abs_path = os.path.join(root, name)
+            yield os.path.relpath(abs_path, folder_path).replace(os.sep, "/"), abs_path
+
+
+def read_current_generation(index_dir):
+    """Return the name of the live generation in index_dir, or None if nothing was published yet."""
+    try:
+        with open(os.path.join(index_dir, CURRENT_NAME), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+class PersistentIndex:
+    """A vector index for one folder that persists across restarts and refreshes incrementally."""
+
+    def __init__(self, folder_path, index_dir, embedding, chunk_size=1000, chunk_overlap=0, generation=None,
+                 workers=None, parse_timeout=DEFAULT_TIMEOUT, max_file_bytes=DEFAULT_MAX_BYTES, backend="chroma",
+                 dedupe_threshold=DEFAULT_DEDUPE_THRESHOLD):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown vector backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+        self.backend = backend
+        self.folder_path = os.path.abspath(folder_path)
+        self.index_dir = os.path.abspath(index_dir)
+        self.embedding = embedding
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.workers = workers
+        self.parse_timeout = parse_timeout
+        self.max_file_bytes = max_file_bytes
+        self.dedupe_threshold = dedupe_threshold
+        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self.generation = generation or read_current_generation(self.index_dir) or "gen-0"
+        self.data_dir = os.path.join(self.index_dir, self.generation)
+        os.makedirs(self.data_dir, exist_ok=True)
+        with _open_lock:
+            _open_generations[self.data_dir] += 1
+        self._closed = False
+        chroma_dir = os.path.join(self.data_dir, "chroma")
+        flat_dir = os.path.join(self.data_dir, "flat")
+        lexical_path = os.path.join(self.data_dir, LEXICAL_NAME)
+        dedupe_path = os.path.join(self.data_dir, DEDUPE_NAME)
+        self.manifest = self._load_manifest()
+        if not self.manifest["files"]:
+            # Without a manifest we can't tell which vectors are stale, so start clean
+            shutil.rmtree(chroma_dir, ignore_errors=True)
+            shutil.rmtree(flat_dir, ignore_errors=True)
+            for path in (lexical_path, dedupe_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.manifest["lexical"] = True
+        if backend == "chroma":
+            self.vectorstore = Chroma(
+                collection_name=COLLECTION_NAME,
+                embedding_function=embedding,
+                persist_directory=chroma_dir,
+            )
+        else:
+            self.vectorstore = FlatVectorStore(flat_dir, embedding, quantize=backend == "flat-int8")
+        self.index = VectorStoreIndexWrapper(vectorstore=self.vectorstore)
+        self.lexical = LexicalIndex(lexical_path)
+        # A threshold of 0 or None turns near-duplicate detection off
+        self.dedupe = DedupeIndex(dedupe_path, dedupe_threshold) if dedupe_threshold else None
+        self._pending_chunks = []
+        self._pending_ids = []
+        if not self.manifest.get("lexical"):
+            self._backfill_lexical()
+
+    def as_retriever(self, k=DEFAULT_K, fetch_k=DEFAULT_FETCH_K, use_mmr=True, packer=None):
+        """Hybrid BM25 + vector retriever over this index, optionally packing results into a token budget."""
+        return HybridRetriever(
+            vectorstore=self.vectorstore, lexical=self.lexical,
+            k=k, fetch_k=fetch_k, use_mmr=use_mmr, packer=packer,
+        )
+
+    def _backfill_lexical(self, batch_size=1000):
+        # Indexes built before the keyword index existed get it filled from the vector store once
+        logger.info("Building keyword index from the existing vector store...")
+        offset = 0
+        while True:
+            batch = self.vectorstore.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+            if not batch["ids"]:
+                break
+            metadatas = [dict(meta or {}, chunk_id=chunk_id) for chunk_id, meta in zip(batch["ids"], batch["metadatas"])]
+            # Older chunks don't carry their id, which the retriever needs to fuse results
+            self.vectorstore._collection.update(ids=batch["ids"], metadatas=metadatas)
+            self.lexical.add(batch["ids"], [
+                Document(page_content=text, metadata=meta)
+                for text, meta in zip(batch["documents"], metadatas)
+            ])
+            offset += len(batch["ids"])
+        self.manifest["lexical"] = True
+        self._save_manifest()
+
+    @property
+    def version(self):
+        """Monotonic counter bumped whenever the indexed content changes."""
+        return self.manifest["version"]
+
+    @property
+    def file_count(self):
+        return len(self.manifest["files"])
+
+    def close(self):
+        """Release the vector store and keyword index, e.g. when a corpus is unloaded."""
+        if self._closed:
+            return
+        self._closed = True
+        with _open_lock:
+            _open_generations[self.data_dir] -= 1
+            if not _open_generations[self.data_dir]:
+                del _open_generations[self.data_dir]
+        if isinstance(self.vectorstore, FlatVectorStore):
+            self.vectorstore.close()
+        else:
+            client = getattr(self.vectorstore, "_client", None)
+            if hasattr(client, "close"):
+                client.close()
+        self.lexical.close()
+        if self.dedupe is not None:
+            self.dedupe.close()
+
+    def duplicates_of(self, rel_path):
+        """Files that were skipped as near-copies of rel_path."""
+        return self.dedupe.duplicates_of("file", rel_path) if self.dedupe is not None else []
+
+    def dedupe_summary(self):
+        return self.dedupe.stats_summary() if self.dedupe is not None else "off"
+
+    # --------------------------
+    # Generations
+    # --------------------------
+    def fork(self):
+        """Copy this index into a new generation that can be refreshed without disturbing readers."""
+        number = int(self.generation.rsplit("-", 1)[-1]) + 1
+        while os.path.exists(os.path.join(self.index_dir, f"gen-{number}")):
+            number += 1
+        generation = f"gen-{number}"
+        shutil.copytree(self.data_dir, os.path.join(self.index_dir, generation))
+        return PersistentIndex(
+            self.folder_path, self.index_dir, self.embedding,
+            chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap, generation=generation,
+            workers=self.workers, parse_timeout=self.parse_timeout, max_file_bytes=self.max_file_bytes,
+            backend=self.backend, dedupe_threshold=self.dedupe_threshold,
+        )
+
+    def publish(self):
+        """Make this generation the one loaded on the next start."""
+        path = os.path.join(self.index_dir, CURRENT_NAME)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.generation)
+        os.replace(tmp_path, path)
+
+    def prune(self):
+        """
+        Delete every generation except this one and those still open in this process,
+        e.g. a retired index a query is still reading. Other processes aren't tracked.
+        """
+        for name in os.listdir(self.index_dir):
+            path = os.path.join(self.index_dir, name)
+            with _open_lock:
+                in_use = path in _open_generations
+            if name.startswith("gen-") and name != self.generation and not in_use and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def compact(self):
+        """Rewrite the flat matrix without the rows changed files left behind, once enough are dead."""
+        if isinstance(self.vectorstore, FlatVectorStore):
+            return self.vectorstore.compact_if_needed()
+        return 0
+
+    def discard(self):
+        """Close this generation and delete it, e.g. a fork whose refresh failed or changed nothing."""
+        self.close()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    # --------------------------
+    # Manifest
+    # --------------------------
+    def _manifest_path(self):
+        return os.path.join(self.data_dir, MANIFEST_NAME)
+
+    def _load_manifest(self):
+        path = self._manifest_path()
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+                if manifest.get("folder") != self.folder_path:
+                    logger.warning(f"Index at {self.index_dir} belongs to another folder; rebuilding.")
+                elif manifest.get("backend", "chroma") != self.backend:
+                    # Chunk embeddings come from the embedding cache, so switching backends re-embeds nothing
+                    logger.warning(f"Index at {self.index_dir} uses the {manifest.get('backend', 'chroma')} backend; rebuilding.")
+                else:
+                    return manifest
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read index manifest, rebuilding: {e}")
+        return {"folder": self.folder_path, "version": 0, "files": {}, "backend": self.backend}
+
+    def _save_manifest(self):
+        # The manifest may only list chunk ids that are actually in the vector store
+        self._flush_pending()
+        if self.dedupe is not None:
+            self.dedupe.commit()
+        path = self._manifest_path()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, path)
+
+    # --------------------------
+    # Refresh
+    # --------------------------
+    def _chunk_ids(self, rel_path, count):
+        path_key = hashlib.sha1(rel_path.encode("utf-8")).hexdigest()
+        return [f"{path_key}-{i}" for i in range(count)]
+
+    def _delete_file_vectors(self, entry):
+        if entry and entry.get("ids"):
+            self.vectorstore.delete(ids=entry["ids"])
+            self.lexical.delete(entry["ids"])
+
+    def _replace_file_vectors(self, rel_path, entry, chunks, stats):
+        # Old vectors are only dropped once the new chunks are ready, so a parse
+        # failure leaves the previous version of the file searchable
+        self._delete_file_vectors(entry)
+        ids = self._chunk_ids(rel_path, len(chunks))
+        if self.dedupe is not None:
+            chunks, ids = self._skip_duplicate_chunks(rel_path, chunks, ids, stats)
+        for chunk, chunk_id in zip(chunks, ids):
+            # Lets retrievers fuse vector and keyword hits for the same chunk
+            chunk.metadata["chunk_id"] = chunk_id
+        self._pending_chunks.extend(chunks)
+        self._pending_ids.extend(ids)
+        if len(self._pending_ids) >= ADD_BATCH_SIZE:
+            self._flush_pending()
+        return ids
+
+    def _find_duplicate_file(self, rel_path, chunks):
+        """The indexed file rel_path is a near-copy of, or None. Fingerprints rel_path when it is not a copy."""
+        signature = self.dedupe.signature(" ".join(chunk.page_content for chunk in chunks))
+        found = self.dedupe.find("file", signature, exclude_owner=rel_path)
+        if found:
+            self.dedupe.add_duplicate("file", rel_path, rel_path, found[0], found[1], sum(len(c.page_content) for c in chunks))
+            return found[0]
+        self.dedupe.add("file", rel_path, rel_path, signature)
+        return None
+
+    def _skip_duplicate_chunks(self, rel_path, chunks, ids, stats):
+        # Chunk ids stay positional, so skipping a chunk doesn't renumber the rest of the file
+        kept_chunks, kept_ids = [], []
+        for chunk, chunk_id in zip(chunks, ids):
+            signature = self.dedupe.signature(chunk.page_content)
+            found = self.dedupe.find("chunk", signature)
+            if found:
+                self.dedupe.add_duplicate("chunk", chunk_id, rel_path, found[0], found[1], len(chunk.page_content))
+                stats["duplicate_chunks"] += 1
+                continue
+            self.dedupe.add("chunk", chunk_id, rel_path, signature)
+            kept_chunks.append(chunk)
+            kept_ids.append(chunk_id)
+        return kept_chunks, kept_ids
+
+    def _flush_pending(self):
+        # One add per batch lets the embedding model see many chunks at once
+        if self._pending_ids:
+            self.vectorstore.add_documents(self._pending_chunks, ids=self._pending_ids)
+            self.lexical.add(self._pending_ids, self._pending_chunks)
+            self._pending_chunks, self._pending_ids = [], []
+
+    def refresh(self, exclude_dirs=(), on_progress=None, should_stop=None):
+        """
+        Bring the index in line with the folder, touching only added, changed and removed files.
+
+        on_progress(stage, done, total) is called as files are parsed ("parse") and
+        chunks are embedded ("embed"; the total grows as files are split). When
+        should_stop() returns true the refresh stops after the current file, keeps
+        what was indexed so far and returns stats with "cancelled" set.
+        """
+        files = self.manifest["files"]
+        stats = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0, "failed": 0, "chunks": 0, "cancelled": False,
+                 "duplicate_files": 0, "duplicate_chunks": 0}
+        seen = set()
+        to_parse = {}  # abs_path -> (rel_path, stat, sha256)
+
+        for rel_path, abs_path in scan_folder(self.folder_path, exclude_dirs=tuple(exclude_dirs) + (self.index_dir,)):
+            if should_stop and should_stop():
+                stats["cancelled"] = True
+                break
+            seen.add(rel_path)
+            try:
+                st = os.stat(abs_path)
+            except OSError as e:
+                logger.warning(f"Skipping unreadable file {rel_path}: {e}")
+                continue
+
+            entry = files.get(rel_path)
+            # Files indexed before fingerprinting was turned on are parsed once more; their embeddings are cached
+            current = entry and (self.dedupe is None or entry.get("fingerprinted"))
+            if current and entry["mtime"] == st.st_mtime and entry["size"] == st.st_size:
+                stats["unchanged"] += 1
+                continue
+
+            try:
+                sha = file_sha256(abs_path)
+                if current and entry["sha256"] == sha:
+                    # Touched but not modified; just remember the new mtime
+                    entry["mtime"], entry["size"] = st.st_mtime, st.st_size
+                    stats["unchanged"] += 1
+                    continue
+            except OSError as e:
+                stats["failed"] += 1
+                logger.error(f"Failed to read {rel_path}: {e}")
+                continue
+            to_parse[abs_path] = (rel_path, st, sha)
+
+        if self.dedupe is not None:
+            # A cancelled scan didn't see every file, so nothing can be judged removed
+            self._recheck_duplicates(to_parse, [] if stats["cancelled"] else [p for p in files if p not in seen])
+
+        def report_progress(done):
+            if on_progress:
+                on_progress("parse", done, len(to_parse))
+                on_progress("embed", stats["chunks"] - len(self._pending_ids), stats["chunks"])
+
+        # Parsing runs across the worker pool; chunks are embedded here as each file comes back
+        report = IngestReport()
+        processed = returned = 0
+        parsed = iter_parsed(
+            list(to_parse) if not stats["cancelled"] else [], workers=self.workers, timeout=self.parse_timeout,
+            max_bytes=self.max_file_bytes, report=report,
+        )
+        # Closing the generator tears down the worker pool when a refresh is cancelled part way
+        with closing(parsed):
+            for abs_path, documents, error in parsed:
+                returned += 1
+                rel_path, st, sha = to_parse[abs_path]
+                entry = files.get(rel_path)
+                if error:
+                    stats["failed"] += 1
+                    logger.error(f"Failed to parse {rel_path}: {error}")
+                else:
+                    try:
+                        chunks = self.text_splitter.split_documents(documents)
+                        duplicate_of = self._find_duplicate_file(rel_path, chunks) if self.dedupe is not None else None
+                        if duplicate_of:
+                            # Only a pointer is kept; the canonical copy answers for both
+                            self._delete_file_vectors(entry)
+                            ids = []
+                            stats["duplicate_files"] += 1
+                        else:
+                            ids = self._replace_file_vectors(rel_path, entry, chunks, stats)
+                        files[rel_path] = {"sha256": sha, "mtime": st.st_mtime, "size": st.st_size, "ids": ids}
+                        if self.dedupe is not None:
+                            files[rel_path]["fingerprinted"] = True
+                            if duplicate_of:
+                                files[rel_path]["duplicate_of"] = duplicate_of
+                        stats["changed" if entry else "added"] += 1
+                        stats["chunks"] += len(ids)
+                        processed += 1
+                        if processed % MANIFEST_SAVE_EVERY == 0:
+                            self._save_manifest()
+                    except Exception as e:
+                        stats["failed"] += 1
+                        logger.error(f"Failed to index {rel_path}: {e}")
+                report_progress(returned)
+                if should_stop and should_stop():
+                    stats["cancelled"] = True
+                    break
+
+        # A cancelled scan didn't see every file, so nothing can be judged removed
+        if not stats["cancelled"]:
+            for rel_path in [p for p in files if p not in seen]:
+                self._delete_file_vectors(files.pop(rel_path))
+                stats["removed"] += 1
+
+        if stats["added"] or stats["changed"] or stats["removed"]:
+            self.manifest["version"] += 1
+        self._save_manifest()
+        # Cheap unless enough rows are dead; keeps the desktop app's and batch_query's indexes from growing forever
+        self.compact()
+        report_progress(returned)
+        if to_parse:
+            logger.info(report.summary())
+        logger.info(
+            f"Index {'refresh cancelled' if stats['cancelled'] else 'refreshed'} (version {self.version}): "
+            f"{stats['added']} added, {stats['changed']} changed, "
+            f"{stats['removed']} removed, {stats['unchanged']} unchanged, {stats['failed']} failed, "
+            f"{stats['chunks']} chunks embedded."
+        )
+        if stats["duplicate_files"] or stats["duplicate_chunks"]:
+            logger.info(
+                f"Skipped {stats['duplicate_files']} near-duplicate files and {stats['duplicate_chunks']} "
+                f"near-duplicate chunks; index totals: {self.dedupe_summary()}."
+            )
+        return stats
+
+    def _recheck_duplicates(self, to_parse, removed):
+        """
+        Drop the fingerprints of changed and removed files, and queue the files that
+        were skipped as copies of them, so one of those copies can become canonical.
+        """
+        affected = {rel_path for rel_path, _, _ in to_parse.values()} | set(removed)
+        dependents = self.dedupe.dependents(affected)
+        files = self.manifest["files"]
+        for rel_path in dependents - set(removed):
+            entry = files.get(rel_path)
+            abs_path = os.path.join(self.folder_path, rel_path)
+            try:
+                if entry:
+                    to_parse[abs_path] = (rel_path, os.stat(abs_path), entry["sha256"])
+                    # Until it is parsed again, a later refresh must not take it for unchanged
+                    entry.pop("fingerprinted", None)
+            except OSError:
+                pass
+        if dependents:
+            # Saved before the duplicate pointers go, so a cancelled or crashed refresh can't lose the dependents
+            self._save_manifest()
+        for rel_path in affected | dependents:
+            self.dedupe.remove_owner(rel_path)
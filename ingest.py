@@ -0,0 +1,192 @@
+# ingest.py
+#
+# Parallel document parsing for index builds. Files are parsed across a process
+# pool, routed by extension to a fast dedicated parser where one exists and to
+# unstructured otherwise. Each file gets a size cap and a wall-clock timeout so a
+# single pathological document can't stall the whole build.
+
+import os
+import time
+import heapq
+import logging
+import multiprocessing
+from collections import deque
+
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 120  # Seconds allowed to parse a single file
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024  # Larger files are skipped
+TEXT_EXTENSIONS = {".txt", ".md", ".csv", ".log"}
+POLL_INTERVAL = 0.02
+
+
+# --------------------------
+# Parsers (run inside worker processes)
+# --------------------------
+def _parse_text(path):
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return [(f.read(), {"source": path})]
+
+
+def _parse_pdf(path):
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(path)
+    return [
+        (page.extract_text() or "", {"source": path, "page": number})
+        for number, page in enumerate(reader.pages)
+    ]
+
+
+def _parse_docx(path):
+    import docx
+
+    document = docx.Document(path)
+    parts = [paragraph.text for paragraph in document.paragraphs if paragraph.text]
+    for table in document.tables:
+        for row in table.rows:
+            parts.append(" | ".join(cell.text for cell in row.cells))
+    return [("\n".join(parts), {"source": path})]
+
+
+def _parse_unstructured(path):
+    from langchain_community.document_loaders import UnstructuredFileLoader
+
+    return [(doc.page_content, doc.metadata) for doc in UnstructuredFileLoader(path).load()]
+
+
+PARSERS = {".pdf": _parse_pdf, ".docx": _parse_docx}
+PARSERS.update({ext: _parse_text for ext in TEXT_EXTENSIONS})
+
+
+def parse_file(path):
+    """Parse one file into (text, metadata) pairs, falling back to unstructured when the fast parser can't."""
+    parser = PARSERS.get(os.path.splitext(path)[1].lower())
+    if parser is not None:
+        try:
+            return [(text, meta) for text, meta in parser(path) if text.strip()]
+        except ImportError:
+            pass
+        except Exception as e:
+            logger.warning(f"Fast parser failed for {path}, falling back to unstructured: {e}")
+    return _parse_unstructured(path)
+
+
+# --------------------------
+# Report
+# --------------------------
+class IngestReport:
+    """Throughput and failure statistics for one ingestion run."""
+
+    def __init__(self, slowest_count=5):
+        self.started = time.monotonic()
+        self.parsed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.skipped = 0
+        self.slowest_count = slowest_count
+        self._slowest = []  # Min-heap of (seconds, path)
+
+    def record(self, path, seconds):
+        item = (seconds, path)
+        if len(self._slowest) < self.slowest_count:
+            heapq.heappush(self._slowest, item)
+        else:
+            heapq.heappushpop(self._slowest, item)
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def files_per_second(self):
+        return self.parsed / self.elapsed if self.elapsed > 0 else 0.0
+
+    def slowest(self):
+        return sorted(self._slowest, reverse=True)
+
+    def summary(self):
+        lines = [
+            f"Parsed {self.parsed} files in {self.elapsed:.1f}s ({self.files_per_second:.1f} files/sec); "
+            f"{self.failed} failed, {self.timed_out} timed out, {self.skipped} skipped as too large."
+        ]
+        for seconds, path in self.slowest():
+            lines.append(f"  {seconds:7.2f}s  {path}")
+        return "\n".join(lines)
+
+
+# --------------------------
+# Pool
+# --------------------------
+def iter_parsed(paths, workers=None, timeout=DEFAULT_TIMEOUT, max_bytes=DEFAULT_MAX_BYTES, report=None):
+    """
+    Parse files in parallel, yielding (path, documents, error) as each one finishes.
+
+    At most `workers` files are in flight, so a file's clock starts when it is
+    submitted. When a file runs past `timeout` the pool is torn down and
+    recreated, and the other in-flight files are resubmitted.
+    """
+    report = report if report is not None else IngestReport()
+    pending = deque()
+    for path in paths:
+        try:
+            size = os.path.getsize(path)
+        except OSError as e:
+            report.failed += 1
+            yield path, None, str(e)
+            continue
+        if size > max_bytes:
+            report.skipped += 1
+            yield path, None, f"File is larger than the {max_bytes // (1024 * 1024)} MB cap."
+            continue
+        pending.append(path)
+    if not pending:
+        return
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(pending)))
+    pool = multiprocessing.Pool(workers)
+    in_flight = {}
+    try:
+        while pending or in_flight:
+            while pending and len(in_flight) < workers:
+                path = pending.popleft()
+                in_flight[path] = (pool.apply_async(parse_file, (path,)), time.monotonic())
+
+            now = time.monotonic()
+            finished = [path for path, (result, _) in in_flight.items() if result.ready()]
+            expired = [
+                path for path, (result, started) in in_flight.items()
+                if path not in finished and now - started > timeout
+            ]
+
+            for path in finished:
+                result, started = in_flight.pop(path)
+                seconds = now - started
+                report.record(path, seconds)
+                try:
+                    pairs = result.get()
+                except Exception as e:
+                    report.failed += 1
+                    yield path, None, str(e)
+                    continue
+                report.parsed += 1
+                yield path, [Document(page_content=text, metadata=meta) for text, meta in pairs], None
+
+            if expired:
+                for path in expired:
+                    _, started = in_flight.pop(path)
+                    report.timed_out += 1
+                    report.record(path, now - started)
+                    yield path, None, f"Parsing took longer than {timeout}s."
+                # A stuck worker can only be reclaimed by killing the pool
+                pool.terminate()
+                pool = multiprocessing.Pool(workers)
+                pending.extendleft(reversed(list(in_flight)))
+                in_flight.clear()
+            elif not finished:
+                time.sleep(POLL_INTERVAL)
+    finally:
+        pool.terminate()
+        pool.join()
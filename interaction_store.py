@@ -0,0 +1,182 @@
+# interaction_store.py
+#
+# Structured history of questions and answers, shared by the desktop app and the
+# Slack bot. Interactions go into a SQLite database in WAL mode: callers hand a
+# record to record(), which only queues it, and a background thread writes the
+# queue in batches. Rows carry user, latency, token and cache-hit fields and are
+# indexed by day and user, with an FTS5 table for keyword search.
+
+import os
+import time
+import queue
+import sqlite3
+import logging
+import datetime
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 1.0  # Seconds a record may wait in the queue before it is written
+FIELDS = (
+    "ts", "day", "source", "kind", "user_id", "channel", "query", "response",
+    "latency_ms", "prompt_tokens", "completion_tokens", "cache_hit", "error",
+)
+
+
+class InteractionStore:
+    """Append-mostly interaction log backed by SQLite, written by a background thread."""
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._queue = queue.Queue()
+        self._read_lock = threading.Lock()
+        self._reader = self._connect()
+        self._reader.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS interactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts REAL NOT NULL,
+                day TEXT NOT NULL,
+                source TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                user_id TEXT,
+                channel TEXT,
+                query TEXT,
+                response TEXT,
+                latency_ms INTEGER,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                cache_hit INTEGER NOT NULL DEFAULT 0,
+                error INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS interactions_day ON interactions (day, id);
+            CREATE INDEX IF NOT EXISTS interactions_user ON interactions (user_id, ts);
+            CREATE VIRTUAL TABLE IF NOT EXISTS interactions_fts USING fts5(
+                query, response, content='interactions', content_rowid='id'
+            );
+            """
+        )
+        columns = {row[1] for row in self._reader.execute("PRAGMA table_info(interactions)")}
+        if "completion_tokens" not in columns:
+            # Logs created before completion tokens were recorded
+            self._reader.execute("ALTER TABLE interactions ADD COLUMN completion_tokens INTEGER")
+        self._reader.commit()
+        self._writer = threading.Thread(target=self._run, name="interaction-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        # WAL lets readers query while the writer thread commits
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # --------------------------
+    # Writing
+    # --------------------------
+    def record(self, source, query, response, kind="query", user_id=None, channel=None,
+               latency_ms=None, prompt_tokens=None, completion_tokens=None, cache_hit=False, error=False):
+        """Queue one interaction for writing. Never blocks on the database."""
+        now = time.time()
+        self._queue.put((
+            now, datetime.datetime.fromtimestamp(now).strftime("%Y%m%d"), source, kind, user_id, channel,
+            query, response, latency_ms, prompt_tokens, completion_tokens, int(bool(cache_hit)), int(bool(error)),
+        ))
+
+    def _write(self, conn, rows):
+        with conn:
+            for row in rows:
+                row_id = conn.execute(
+                    f"INSERT INTO interactions ({', '.join(FIELDS)}) VALUES ({', '.join('?' * len(FIELDS))})", row
+                ).lastrowid
+                conn.execute(
+                    "INSERT INTO interactions_fts (rowid, query, response) VALUES (?, ?, ?)", (row_id, row[6], row[7])
+                )
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            rows, waiters = [], []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                # flush() sends an Event; it is set once everything queued before it is written
+                (waiters if isinstance(item, threading.Event) else rows).append(item)
+                if len(rows) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0) if not waiters else 0)
+                except queue.Empty:
+                    break
+            try:
+                if rows:
+                    self._write(conn, rows)
+            except Exception as e:
+                logger.error(f"Error writing {len(rows)} interaction(s): {e}")
+            for waiter in waiters:
+                waiter.set()
+
+    def flush(self, timeout=10):
+        """Wait until every interaction recorded so far has been written."""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    # --------------------------
+    # Reading
+    # --------------------------
+    def _select(self, sql, params):
+        with self._read_lock:
+            cursor = self._reader.execute(sql, params)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def search(self, day_from=None, day_to=None, user_id=None, keyword=None, source=None, limit=100):
+        """Most recent interactions matching every given filter. Days are YYYYMMDD strings."""
+        clauses, params = [], []
+        if day_from:
+            clauses.append("i.day >= ?")
+            params.append(day_from)
+        if day_to:
+            clauses.append("i.day <= ?")
+            params.append(day_to)
+        if user_id:
+            clauses.append("i.user_id = ?")
+            params.append(user_id)
+        if source:
+            clauses.append("i.source = ?")
+            params.append(source)
+        if keyword:
+            clauses.append("i.id IN (SELECT rowid FROM interactions_fts WHERE interactions_fts MATCH ?)")
+            params.append('"' + keyword.replace('"', '""') + '"')
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._select(f"SELECT i.* FROM interactions i {where} ORDER BY i.id DESC LIMIT ?", params + [limit])
+
+    def read_day_since(self, day, after_id=0):
+        """Return the day's interactions after row id after_id as log text, plus the last id read."""
+        rows = self._select(
+            "SELECT id, ts, user_id, query, response FROM interactions WHERE day = ? AND id > ? ORDER BY id",
+            (day, after_id),
+        )
+        text = "".join(
+            f"Timestamp: {datetime.datetime.fromtimestamp(row['ts']).isoformat()}\nUser: {row['user_id']}\n"
+            f"Query: {row['query']}\nResponse: {row['response']}\n{'-' * 40}\n"
+            for row in rows
+        )
+        return text, rows[-1]["id"] if rows else after_id
+
+    def stats(self, day=None):
+        """Counts, cache hits and average latency and token counts, for one day or overall."""
+        where, params = ("WHERE day = ?", (day,)) if day else ("", ())
+        return self._select(
+            "SELECT COUNT(*) AS interactions, COALESCE(SUM(cache_hit), 0) AS cache_hits, "
+            "COALESCE(SUM(error), 0) AS errors, AVG(latency_ms) AS avg_latency_ms, "
+            "AVG(prompt_tokens) AS avg_prompt_tokens, AVG(completion_tokens) AS avg_completion_tokens, "
+            f"COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens, COALESCE(SUM(completion_tokens), 0) AS completion_tokens "
+            f"FROM interactions {where}",
+            params,
+        )[0]
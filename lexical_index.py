@@ -0,0 +1,96 @@
+# lexical_index.py
+#
+# A persisted BM25 keyword index over the same chunks as the vector store,
+# backed by SQLite FTS5. Dense retrieval misses exact product codes and SKUs;
+# this index catches them. Hyphens and underscores are kept inside tokens so
+# codes like "AB-1234" match as a whole.
+
+import re
+import json
+import sqlite3
+import threading
+
+from langchain_core.documents import Document
+
+TOKEN_PATTERN = re.compile(r"[\w\-]+")
+# Words too common to help ranking; dropping them keeps OR queries cheap on large corpora
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "can", "do", "does", "for", "from", "how",
+    "i", "if", "in", "is", "it", "me", "my", "of", "on", "or", "our", "so", "that", "the", "their",
+    "this", "to", "us", "was", "we", "what", "when", "where", "which", "who", "why", "will", "with",
+    "you", "your",
+}
+MAX_QUERY_TERMS = 32
+
+
+def query_terms(text):
+    """Extract the distinct, non-stopword search terms of a question, in order."""
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        token = token.strip("-")
+        # "ab-1234" also searches "ab" and "1234" in case the document spells it differently
+        parts = [token] + (re.split(r"[-_]", token) if "-" in token or "_" in token else [])
+        for term in parts:
+            if term and term not in STOPWORDS and term not in terms:
+                terms.append(term)
+    return terms[:MAX_QUERY_TERMS]
+
+
+class LexicalIndex:
+    """BM25 search over chunk text, stored in an FTS5 table keyed by chunk id."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+            "chunk_id UNINDEXED, body, metadata UNINDEXED, tokenize=\"unicode61 tokenchars '-_'\")"
+        )
+        # FTS5 can't index chunk_id, so deletes look up the row through this table
+        self._conn.execute("CREATE TABLE IF NOT EXISTS chunk_rows (chunk_id TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        self._conn.commit()
+
+    def _delete_row(self, chunk_id):
+        found = self._conn.execute("SELECT row FROM chunk_rows WHERE chunk_id = ?", (chunk_id,)).fetchone()
+        if found:
+            self._conn.execute("DELETE FROM chunks WHERE rowid = ?", found)
+            self._conn.execute("DELETE FROM chunk_rows WHERE chunk_id = ?", (chunk_id,))
+
+    def add(self, ids, documents):
+        with self._lock:
+            for chunk_id, doc in zip(ids, documents):
+                # Re-adding an id replaces it, matching the vector store's upsert
+                self._delete_row(chunk_id)
+                row = self._conn.execute(
+                    "INSERT INTO chunks (chunk_id, body, metadata) VALUES (?, ?, ?)",
+                    (chunk_id, doc.page_content, json.dumps(doc.metadata)),
+                ).lastrowid
+                self._conn.execute("INSERT INTO chunk_rows (chunk_id, row) VALUES (?, ?)", (chunk_id, row))
+            self._conn.commit()
+
+    def delete(self, ids):
+        with self._lock:
+            for chunk_id in ids:
+                self._delete_row(chunk_id)
+            self._conn.commit()
+
+    def search(self, query, k):
+        """Return up to k (chunk_id, Document) pairs, best BM25 match first."""
+        terms = query_terms(query)
+        if not terms:
+            return []
+        match = " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_id, body, metadata FROM chunks WHERE chunks MATCH ? ORDER BY bm25(chunks) LIMIT ?",
+                (match, k),
+            ).fetchall()
+        return [
+            (chunk_id, Document(page_content=body, metadata=json.loads(metadata)))
+            for chunk_id, body, metadata in rows
+        ]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
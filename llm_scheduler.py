@@ -0,0 +1,313 @@
+# llm_scheduler.py
+#
+# One gate in front of every LLM call. A call waits for a slot under a global
+# and a per-user concurrency limit and, optionally, global and per-user
+# tokens-per-minute budgets. Waiting calls are started by priority:
+# interactive questions before bulk work such as file analysis and summaries,
+# first come first served within a priority. A few extra slots are reserved
+# for admins: once the shared slots are full, an admin's call can still start
+# in one of those. Being an admin doesn't move a call ahead in the queue.
+#
+# Token budgets are enforced on an estimate taken before the call and
+# corrected with the actual usage afterwards, over a sliding one-minute window.
+
+import time
+import logging
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_USER_CONCURRENCY = 2
+DEFAULT_ADMIN_SLOTS = 1
+WINDOW_SECONDS = 60
+# Waiters re-check token budgets this often, since those free up with time rather than on release
+BUDGET_POLL_SECONDS = 0.5
+# Completion tokens assumed for a call until its actual usage is known
+DEFAULT_COMPLETION_TOKENS = 800
+
+
+class SchedulerTimeout(Exception):
+    """A call waited longer than the scheduler's timeout for a slot."""
+
+
+def estimate_tokens(text):
+    # ~4 characters per token; corrected with the model's reported usage after the call
+    return len(text) // 4 + 1
+
+
+class _TokenWindow:
+    """Tokens used over the last minute. Reservations are corrected once actual usage is known."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._entries = deque()  # [timestamp, tokens, live]
+        self.used = 0
+
+    def _expire(self, now):
+        while self._entries and now - self._entries[0][0] >= WINDOW_SECONDS:
+            entry = self._entries.popleft()
+            self.used -= entry[1]
+            entry[2] = False
+
+    def fits(self, tokens, now):
+        if not self.limit:
+            return True
+        self._expire(now)
+        # A call bigger than the whole budget still runs, alone, once the window is empty
+        return self.used + tokens <= self.limit or self.used == 0
+
+    def reserve(self, tokens, now):
+        entry = [now, tokens, True]
+        if self.limit:
+            self._entries.append(entry)
+            self.used += tokens
+        return entry
+
+    def correct(self, entry, tokens):
+        if entry[2] and self.limit:
+            self.used += tokens - entry[1]
+        entry[1] = tokens
+
+
+class _Ticket:
+    """A granted slot. record() replaces the token estimate with the call's actual usage."""
+
+    def __init__(self, scheduler, user, priority, admin, tokens):
+        self._scheduler = scheduler
+        self.user = user
+        self.priority = priority
+        self.admin = admin
+        self.tokens = tokens
+        self.seq = 0
+        self.lane = None
+        self.waited = 0.0
+        self._entries = []
+
+    def record(self, tokens):
+        self._scheduler._record(self, tokens)
+
+
+class LLMScheduler:
+    """Admit LLM calls under concurrency and token-per-minute limits, most urgent first."""
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY, user_concurrency=DEFAULT_USER_CONCURRENCY,
+                 tokens_per_minute=0, user_tokens_per_minute=0, admin_slots=DEFAULT_ADMIN_SLOTS, timeout=None,
+                 registry=None):
+        self.max_concurrency = max_concurrency
+        self.user_concurrency = user_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.user_tokens_per_minute = user_tokens_per_minute
+        self.admin_slots = admin_slots
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._seq = 0
+        self._active = 0
+        self._admin_active = 0
+        self._user_active = defaultdict(int)
+        self._tokens = _TokenWindow(tokens_per_minute)
+        self._user_tokens = {}
+        self.started = 0
+        self.timeouts = 0
+
+        self._depth = self._waits = None
+        if registry is not None:
+            self._depth = {
+                priority: registry.gauge(f"llm_queue_depth_{name}", f"{name.capitalize()} LLM calls waiting for a slot")
+                for priority, name in PRIORITY_NAMES.items()
+            }
+            self._waits = {
+                priority: registry.histogram(f"llm_queue_wait_{name}_seconds", f"Time {name} LLM calls waited for a slot")
+                for priority, name in PRIORITY_NAMES.items()
+            }
+            self._running = registry.gauge("llm_calls_running", "LLM calls holding a scheduler slot")
+            self._timeouts = registry.counter("llm_queue_timeouts_total", "LLM calls that gave up waiting for a slot")
+
+    # --------------------------
+    # Admission
+    # --------------------------
+    def _user_window(self, user):
+        window = self._user_tokens.get(user)
+        if window is None:
+            window = self._user_tokens[user] = _TokenWindow(self.user_tokens_per_minute)
+        return window
+
+    def _lane(self, ticket):
+        if ticket.user is not None and self.user_concurrency and self._user_active[ticket.user] >= self.user_concurrency:
+            return None
+        if self._active < self.max_concurrency:
+            return "shared"
+        if ticket.admin and self._admin_active < self.admin_slots:
+            return "admin"
+        return None
+
+    def _next(self, now):
+        """The waiting ticket that may start now and its lane, or (None, None)."""
+        # Most urgent first; admin only decides whether the reserved lane is open to a ticket
+        for ticket in sorted(self._waiting, key=lambda t: (t.priority, t.seq)):
+            lane = self._lane(ticket)
+            if lane is None:
+                continue
+            if ticket.user is not None and not self._user_window(ticket.user).fits(ticket.tokens, now):
+                continue
+            if not self._tokens.fits(ticket.tokens, now):
+                # Nothing overtakes the call held back by the global budget, or large calls would starve
+                return None, None
+            return ticket, lane
+        return None, None
+
+    def _update_depth(self):
+        if self._depth is not None:
+            for priority, gauge in self._depth.items():
+                gauge.set(sum(1 for ticket in self._waiting if ticket.priority == priority))
+
+    def _acquire(self, ticket, timeout):
+        started = time.monotonic()
+        deadline = started + timeout if timeout else None
+        with self._cond:
+            self._seq += 1
+            ticket.seq = self._seq
+            self._waiting.append(ticket)
+            self._update_depth()
+            try:
+                while True:
+                    now = time.monotonic()
+                    chosen, lane = self._next(now)
+                    if chosen is ticket:
+                        break
+                    if deadline is not None and now >= deadline:
+                        self.timeouts += 1
+                        if self._depth is not None:
+                            self._timeouts.inc()
+                        raise SchedulerTimeout(f"No LLM slot free after {timeout:.0f}s")
+                    wait = deadline - now if deadline is not None else None
+                    if self.tokens_per_minute or self.user_tokens_per_minute:
+                        wait = min(wait, BUDGET_POLL_SECONDS) if wait is not None else BUDGET_POLL_SECONDS
+                    self._cond.wait(wait)
+            finally:
+                self._waiting.remove(ticket)
+                self._update_depth()
+                # Whoever is next in line may be able to start now
+                self._cond.notify_all()
+
+            ticket.lane = lane
+            if lane == "admin":
+                self._admin_active += 1
+            else:
+                self._active += 1
+            if ticket.user is not None:
+                self._user_active[ticket.user] += 1
+                window = self._user_window(ticket.user)
+                ticket._entries.append((window, window.reserve(ticket.tokens, now)))
+            ticket._entries.append((self._tokens, self._tokens.reserve(ticket.tokens, now)))
+            self.started += 1
+            ticket.waited = now - started
+        if self._waits is not None:
+            self._waits[ticket.priority].observe(ticket.waited)
+            self._running.inc()
+        if ticket.waited > 1:
+            logger.info(
+                f"{PRIORITY_NAMES[ticket.priority].capitalize()} LLM call for {ticket.user or 'the bot'} "
+                f"waited {ticket.waited:.1f}s for a slot"
+            )
+
+    def _release(self, ticket):
+        with self._cond:
+            if ticket.lane == "admin":
+                self._admin_active -= 1
+            else:
+                self._active -= 1
+            if ticket.user is not None:
+                self._user_active[ticket.user] -= 1
+                if not self._user_active[ticket.user]:
+                    del self._user_active[ticket.user]
+            self._cond.notify_all()
+        if self._depth is not None:
+            self._running.dec()
+
+    def _record(self, ticket, tokens):
+        with self._cond:
+            for window, entry in ticket._entries:
+                window.correct(entry, tokens)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, user=None, priority=INTERACTIVE, tokens=0, admin=False, timeout=None):
+        """
+        Hold an LLM slot for the duration of the block. tokens is the estimated
+        prompt + completion size; call record() on the yielded ticket with the
+        actual usage once it is known. Raises SchedulerTimeout if no slot frees
+        up within timeout (default: the scheduler's).
+        """
+        ticket = _Ticket(self, user, priority, admin, tokens)
+        self._acquire(ticket, timeout if timeout is not None else self.timeout)
+        try:
+            yield ticket
+        finally:
+            self._release(ticket)
+
+    # --------------------------
+    # Stats
+    # --------------------------
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            self._tokens.fits(0, now)  # Drops expired usage
+            waiting = {name: 0 for name in PRIORITY_NAMES.values()}
+            for ticket in self._waiting:
+                waiting[PRIORITY_NAMES[ticket.priority]] += 1
+            return {
+                "running": self._active + self._admin_active,
+                "admin_running": self._admin_active,
+                "max_concurrency": self.max_concurrency,
+                "waiting": waiting,
+                "tokens_last_minute": self._tokens.used if self.tokens_per_minute else None,
+                "tokens_per_minute": self.tokens_per_minute,
+                "started": self.started,
+                "timeouts": self.timeouts,
+            }
+
+    def stats_summary(self):
+        stats = self.stats()
+        waiting = ", ".join(f"{count} {name}" for name, count in stats["waiting"].items())
+        budget = (
+            f", {stats['tokens_last_minute']:,}/{stats['tokens_per_minute']:,} tokens in the last minute"
+            if stats["tokens_per_minute"] else ""
+        )
+        return (
+            f"{stats['running']}/{stats['max_concurrency']} running ({stats['admin_running']} in the admin lane), "
+            f"waiting: {waiting}{budget}, {stats['started']} started, {stats['timeouts']} timed out"
+        )
+
+
+class ScheduledLLM:
+    """A chat model whose invoke() calls each take a scheduler slot, for code that calls the LLM directly."""
+
+    def __init__(self, llm, scheduler, priority=BULK, user=None, admin=False,
+                 completion_tokens=DEFAULT_COMPLETION_TOKENS):
+        self.llm = llm
+        self.scheduler = scheduler
+        self.priority = priority
+        self.user = user
+        self.admin = admin
+        self.completion_tokens = completion_tokens
+
+    def for_user(self, user, admin=False):
+        """The same model, scheduled on behalf of user."""
+        return ScheduledLLM(self.llm, self.scheduler, self.priority, user, admin, self.completion_tokens)
+
+    def invoke(self, prompt, **kwargs):
+        estimate = estimate_tokens(prompt if isinstance(prompt, str) else str(prompt)) + self.completion_tokens
+        with self.scheduler.slot(self.user, self.priority, estimate, self.admin) as ticket:
+            result = self.llm.invoke(prompt, **kwargs)
+            usage = getattr(result, "usage_metadata", None)
+            if usage and usage.get("total_tokens"):
+                ticket.record(usage["total_tokens"])
+            return result
@@ -1,18 +1,133 @@
 import sys
 import os
-from datetime import datetime
-from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QTextEdit, QPushButton, QFileDialog, QMessageBox, QDockWidget, QListWidget, QListWidgetItem
-from PyQt5.QtCore import QTimer
-from langchain_community.document_loaders import DirectoryLoader
-from langchain.indexes import VectorstoreIndexCreator
-from langchain.chains import ConversationalRetrievalChain
+import time
+import getpass
+from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QTextEdit, QPushButton, QFileDialog, QMessageBox, QDockWidget, QListWidget, QListWidgetItem, QProgressBar
+from PyQt5.QtCore import QObject, QThread, QTimer, pyqtSignal
+from PyQt5.QtGui import QTextCursor
+from langchain_core.callbacks import BaseCallbackHandler
 import openai
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from constants import SYSTEM_MESSAGE, OPENAI_API_KEY, DEFAULT_HISTORY_FOLDER, DEFAULT_MODEL, PROGRAM_NAME
+from constants import OPENAI_API_KEY, DEFAULT_HISTORY_FOLDER, DEFAULT_INDEX_FOLDER, DEFAULT_MODEL, PROGRAM_NAME
+from constants import MAX_LOADED_CORPORA, SESSION_COMPACT_TOKENS, SESSION_KEEP_TURNS
+from context_packer import PromptTokenCounter, count_tokens
+from interaction_store import InteractionStore
+from corpus_registry import CorpusRegistry
+from sessions import SessionStore, summarize_turns
+from qa_chain import with_system_message
 
 # Explicitly set the API key (This is for some reason the only way we can get the script to pull the API)
 openai.api_key = "copy your API key here..."
 
+class QueryCancelled(Exception):
+    """Raised from the streaming callback to abort a query the user cancelled."""
+
+class _TokenForwarder(BaseCallbackHandler):
+    """Forward streamed LLM tokens to the worker, aborting the run once it is cancelled."""
+    # LangChain only logs exceptions raised by handlers unless they ask for them to propagate
+    raise_error = True
+
+    def __init__(self, worker):
+        self.worker = worker
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self.worker.is_cancelled:
+            raise QueryCancelled()
+        self.worker.token_received.emit(token)
+
+class QueryWorker(QObject):
+    """Runs one chain call off the GUI thread and streams its tokens back through signals."""
+    token_received = pyqtSignal(str)
+    answered = pyqtSignal(str)
+    prompt_tokens = pyqtSignal(int)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, chain, question, sessions=None, session_key=None, asked=None):
+        super().__init__()
+        self.chain = chain
+        self.question = question
+        # The conversation this question continues, and the question as typed, which is what it remembers
+        self.sessions = sessions
+        self.session_key = session_key
+        self.asked = asked or question
+        self.is_cancelled = False
+
+    def cancel(self):
+        self.is_cancelled = True
+
+    def run(self):
+        try:
+            counter = PromptTokenCounter(DEFAULT_MODEL)
+            history = self.sessions.history(self.session_key) if self.sessions is not None else []
+            result = self.chain(
+                {"question": self.question, "chat_history": history},
+                callbacks=[_TokenForwarder(self), counter],
+            )
+            if self.is_cancelled:
+                self.cancelled.emit()
+            else:
+                self.prompt_tokens.emit(counter.total)
+                self.answered.emit(result['answer'])
+                if self.sessions is not None:
+                    # May summarize older turns; done here so the window never waits on it
+                    self.sessions.add_turn(self.session_key, self.asked, result['answer'])
+        except QueryCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            if self.is_cancelled:
+                self.cancelled.emit()
+            else:
+                self.failed.emit(str(e))
+
+_session_llm = None
+
+def summarize_session(summary, turns):
+    """Fold older turns of the conversation into its running summary."""
+    global _session_llm
+    if _session_llm is None:
+        from langchain_openai import ChatOpenAI
+        _session_llm = ChatOpenAI(model=DEFAULT_MODEL, openai_api_key=OPENAI_API_KEY)
+    return summarize_turns(_session_llm, summary, turns)
+
+def load_corpus(name, folder_path):
+    """Open the persisted index for a folder and build a chain over it. Returns (store, chain)."""
+    # LangChain's OpenAI and Chroma integrations are slow to import, so the window doesn't wait for them
+    from qa_chain import open_index, build_chain
+
+    store = open_index(folder_path)
+    return store, build_chain(store)
+
+class IndexWorker(QObject):
+    """Loads the persisted index for a folder and then refreshes it, off the GUI thread."""
+    loaded = pyqtSignal(object, object)  # The index and a chain over it; queries can start
+    progress = pyqtSignal(str, int, int)  # Stage ("parse" or "embed"), done, total
+    finished = pyqtSignal(dict)  # Refresh stats; "cancelled" is set if the user stopped it
+    failed = pyqtSignal(str)
+
+    def __init__(self, corpora, folder_path):
+        super().__init__()
+        self.corpora = corpora
+        self.folder_path = folder_path
+        self.is_cancelled = False
+
+    def cancel(self):
+        self.is_cancelled = True
+
+    def run(self):
+        try:
+            # A folder selected before is still loaded unless it was one of the least recently used
+            name = self.corpora.register_folder(self.folder_path)
+            with self.corpora.use(name) as (store, chain):
+                self.loaded.emit(store, chain)
+                # Re-embed only files that changed since the last run
+                stats = store.refresh(
+                    exclude_dirs=(DEFAULT_INDEX_FOLDER, DEFAULT_HISTORY_FOLDER),
+                    on_progress=self.progress.emit, should_stop=lambda: self.is_cancelled,
+                )
+            self.finished.emit(stats)
+        except Exception as e:
+            self.failed.emit(str(e))
+
 class ConversationalRetrievalApp(QWidget):
     def __init__(self):
         super().__init__()
@@ -21,8 +136,16 @@ class ConversationalRetrievalApp(QWidget):
         self._instructions = QLabel(f'Welcome to {PROGRAM_NAME}. You can interact with your data by prompting a question below. This AI is trained on all your internal files within the directory selected.')
         self._query_input = QLineEdit()
         self._search_button = QPushButton('Generate')
+        self._cancel_button = QPushButton('Cancel')
+        self._cancel_button.setEnabled(False)
         self._response_display = QTextEdit()
         self._loading_label = QLabel('')  # For loading feedback
+        self._index_progress = QProgressBar()
+        self._index_label = QLabel('')
+        self._cancel_index_button = QPushButton('Stop Indexing')
+        self._cancel_index_button.setEnabled(False)
+        self._change_folder_button = QPushButton('Change Folder')
+        self._change_folder_button.setEnabled(False)
 
         # Chat history components
         self.chat_history_widget = QListWidget()
@@ -33,8 +156,12 @@ class ConversationalRetrievalApp(QWidget):
         self._instructions.setStyleSheet("color: #d1d1d1; font-size: 16px;")
         self._query_input.setStyleSheet("background-color: #333; color: #fff; border: 1px solid #555; border-radius: 6px; padding: 5px; font-size: 14px;")
         self._search_button.setStyleSheet("background-color: #0078d4; color: #fff; border: none; border-radius: 6px; padding: 8px 16px; font-size: 14px;")
+        self._cancel_button.setStyleSheet("background-color: #555; color: #fff; border: none; border-radius: 6px; padding: 8px 16px; font-size: 14px;")
         self._response_display.setStyleSheet("background-color: #333;   color: #fff; border: 1px solid #555; border-radius: 6px; padding: 8px; font-size: 14px; min-height: 100px;")
         self._loading_label.setStyleSheet("color: #d1d1d1; font-size: 14px;")
+        self._index_label.setStyleSheet("color: #d1d1d1; font-size: 12px;")
+        self._cancel_index_button.setStyleSheet("background-color: #555; color: #fff; border: none; border-radius: 6px; padding: 4px 12px; font-size: 12px;")
+        self._change_folder_button.setStyleSheet("background-color: #555; color: #fff; border: none; border-radius: 6px; padding: 4px 12px; font-size: 12px;")
         self.chat_history_widget.setStyleSheet("background-color: #444; color: #fff; font-size: 10px; border: none;")
         self.toggle_history_button.setStyleSheet("background-color: #0078d4; color: #fff; border: none; border-radius: 6px; padding: 8px 16px; font-size: 14px;")
 
@@ -47,8 +174,15 @@ class ConversationalRetrievalApp(QWidget):
         input_layout.addWidget(self._instructions)
         input_layout.addWidget(self._query_input)
         input_layout.addWidget(self._search_button)
+        input_layout.addWidget(self._cancel_button)
         input_layout.addWidget(self._loading_label)
         input_layout.addWidget(self._response_display)
+        index_layout = QHBoxLayout()
+        index_layout.addWidget(self._index_progress)
+        index_layout.addWidget(self._cancel_index_button)
+        index_layout.addWidget(self._change_folder_button)
+        input_layout.addLayout(index_layout)
+        input_layout.addWidget(self._index_label)
 
         # Create a horizontal layout to combine input area and history area
         split_layout = QHBoxLayout()
@@ -62,40 +196,146 @@ class ConversationalRetrievalApp(QWidget):
         # Set event handlers
         self._search_button.clicked.connect(self._on_search_button_click)
         self._query_input.returnPressed.connect(self._on_query_input_key_release)
+        self._cancel_button.clicked.connect(self._cancel_query)
+        self._cancel_index_button.clicked.connect(self._cancel_indexing)
+        self._change_folder_button.clicked.connect(self._change_folder)
         self.toggle_history_button.clicked.connect(self.toggle_history)
 
-        # Initialize the loader with the chosen directory
-        self.initialize_loader()
-
-        # To simulate streaming, we need a timer and a chunk counter
-        self.stream_timer = QTimer(self)
-        self.stream_timer.timeout.connect(self.update_response_display)
-        self.chunk_counter = 0
-        self.response_chunks = []
+        # The query currently running on a worker thread, if any
+        self._query_thread = None
+        self._query_worker = None
+        self._last_prompt_tokens = 0
+
+        # Set once the index has loaded; until then queries are disabled
+        self.store = None
+        self.chain = None
+        self._index_thread = None
+        self._index_worker = None
+        self._files_parsed = (0, 0)
+        self._chunks_embedded = (0, 0)
+        self._search_button.setEnabled(False)
+        self._index_progress.hide()
+        self._cancel_index_button.hide()
+        # Each selected folder is a corpus with its own index; recently used ones stay loaded for quick switching
+        self.corpora = CorpusRegistry(
+            load_corpus, unload=lambda corpus: corpus[0].close(), max_loaded=MAX_LOADED_CORPORA
+        )
+
+        # Follow-up questions see the conversation so far, with older turns compacted into a summary
+        self.sessions = SessionStore(
+            summarize=summarize_session, max_sessions=1, ttl_seconds=0,
+            compact_tokens=SESSION_COMPACT_TOKENS, keep_turns=SESSION_KEEP_TURNS, model=DEFAULT_MODEL,
+        )
+        self._session_key = "window"
+
+        # Interactions are kept outside the selected folder so they never get indexed
+        self.interactions = InteractionStore(os.path.join(DEFAULT_HISTORY_FOLDER, "interactions.sqlite"))
+
+        # Ask for the directory once the window is on screen
+        QTimer.singleShot(0, self.initialize_loader)
 
     def initialize_loader(self):
-        try:
-            # Prompt the user to select a directory
-            folder_path = QFileDialog.getExistingDirectory(self, "Select Folder")
-
-            if folder_path:
-                # Initialize the loader and chain
-                self.loader = DirectoryLoader(folder_path)
-                embeddings_model = OpenAIEmbeddings(api_key=OPENAI_API_KEY)
-                self.index = VectorstoreIndexCreator(embedding=embeddings_model).from_loaders([self.loader])
-                self.chain = ConversationalRetrievalChain.from_llm(
-                    llm=ChatOpenAI(model=DEFAULT_MODEL, openai_api_key=OPENAI_API_KEY),
-                    retriever=self.index.vectorstore.as_retriever(search_kwargs={"k": 15}),
-                )
-                self.history_folder = os.path.join(folder_path, DEFAULT_HISTORY_FOLDER)
-                os.makedirs(self.history_folder, exist_ok=True)
-            else:
-                QMessageBox.critical(self, "Error", "No folder selected. The application will now exit.")
-                sys.exit()
+        # Prompt the user to select a directory
+        folder_path = QFileDialog.getExistingDirectory(self, "Select Folder")
+        if not folder_path:
+            if self.store is not None:
+                # Switching folders was cancelled; keep the current one
+                self._change_folder_button.setEnabled(True)
+                return
+            QMessageBox.critical(self, "Error", "No folder selected. The application will now exit.")
+            self.close()
+            return
 
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to initialize the loader: {str(e)}")
-            sys.exit()
+        self.store = None
+        self.chain = None
+        # A new folder starts a new conversation
+        self.sessions.clear(self._session_key)
+        self._search_button.setEnabled(False)
+        self._change_folder_button.setEnabled(False)
+
+        self._index_label.setText("Loading index...")
+        self._index_progress.setRange(0, 0)  # Busy indicator until file counts are known
+        self._index_progress.show()
+        self._cancel_index_button.show()
+        self._cancel_index_button.setEnabled(True)
+
+        # Load the persisted index and re-embed only files that changed since the last run, off the GUI thread
+        self._index_thread = QThread(self)
+        self._index_worker = IndexWorker(self.corpora, folder_path)
+        self._index_worker.moveToThread(self._index_thread)
+        self._index_thread.started.connect(self._index_worker.run)
+        self._index_worker.loaded.connect(self._on_index_loaded)
+        self._index_worker.progress.connect(self._on_index_progress)
+        self._index_worker.finished.connect(self._on_index_finished)
+        self._index_worker.failed.connect(self._on_index_failed)
+        for signal in (self._index_worker.finished, self._index_worker.failed):
+            signal.connect(self._index_thread.quit)
+        self._index_thread.finished.connect(self._index_worker.deleteLater)
+        self._index_thread.finished.connect(self._index_thread.deleteLater)
+        self._index_thread.start()
+
+    def _on_index_loaded(self, store, chain):
+        self.store = store
+        self.index = store.index
+        self.chain = chain
+        # A persisted index answers right away; a first build has to finish before there's anything to search
+        if store.file_count:
+            self._search_button.setEnabled(self._query_worker is None)
+            self._index_label.setText(f"Loaded {store.file_count} files. Checking for changes...")
+        else:
+            self._index_label.setText("Building the index for the first time...")
+
+    def _on_index_progress(self, stage, done, total):
+        if stage == "parse":
+            self._files_parsed = (done, total)
+            self._index_progress.setRange(0, max(total, 1))
+            self._index_progress.setValue(done)
+        else:
+            self._chunks_embedded = (done, total)
+        self._index_label.setText(
+            f"Indexing: {self._files_parsed[0]}/{self._files_parsed[1]} files parsed, "
+            f"{self._chunks_embedded[0]}/{self._chunks_embedded[1]} chunks embedded"
+        )
+
+    def _on_index_finished(self, stats):
+        self._finish_indexing()
+        if self.store.file_count:
+            self._search_button.setEnabled(self._query_worker is None)
+        if stats["cancelled"]:
+            self._index_label.setText(
+                f"Indexing stopped: {self.store.file_count} files are searchable. "
+                "The rest will be indexed the next time the folder is loaded."
+            )
+        else:
+            self._index_label.setText(
+                f"Index ready: {self.store.file_count} files ({stats['added']} added, {stats['changed']} changed, "
+                f"{stats['removed']} removed, {stats['failed']} failed)."
+            )
+
+    def _on_index_failed(self, error):
+        self._finish_indexing()
+        self._index_label.setText("Indexing failed.")
+        QMessageBox.critical(self, "Error", f"Failed to initialize the loader: {error}")
+
+    def _cancel_indexing(self):
+        if self._index_worker is not None:
+            self._index_worker.cancel()
+            self._cancel_index_button.setEnabled(False)
+            self._index_label.setText("Stopping after the current file...")
+
+    def _finish_indexing(self):
+        self._index_worker = None
+        self._index_thread = None
+        self._index_progress.hide()
+        self._cancel_index_button.hide()
+        self._change_folder_button.setEnabled(self._query_worker is None)
+
+    def _change_folder(self):
+        # The previous folder's index can only be unloaded once nothing is using it
+        if self._index_worker is not None or self._query_worker is not None:
+            return
+        self._change_folder_button.setEnabled(False)
+        self.initialize_loader()
 
     def _on_search_button_click(self):
         self._execute_query()
@@ -108,62 +348,117 @@ class ConversationalRetrievalApp(QWidget):
         if not query:
             QMessageBox.warning(self, "Warning", "Query cannot be empty.")
             return
+        if self._query_worker is not None:
+            QMessageBox.warning(self, "Warning", "A query is already running. Cancel it or wait for it to finish.")
+            return
+        if self.chain is None or not self.store.file_count:
+            QMessageBox.warning(self, "Warning", "The index is still loading. Please wait a moment.")
+            return
 
-        try:
-            # Show loading message
-            self._loading_label.setText("Loading... Please wait.")
-
-            # Prepend system message to query
-            full_query = f"{SYSTEM_MESSAGE} {query}"
-
-            result = self.chain({"question": full_query, "chat_history": []})
-            response = result['answer']
-            self.response_chunks = self.chunk_response(response)  # Chunk the response
-
-            self.chunk_counter = 0
-            self._response_display.clear()  # Clear previous responses
-            self.stream_timer.start(100)  # Update every 100ms
-
-            # Display the query and response in chat history
-            self.add_to_history(f"User: {query}")
-            self.add_to_history(f"AI: {response}")
-
-            # Save query and response to history
-            self.save_to_history(full_query, response)
-
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Error during query execution: {str(e)}")
-
-    def chunk_response(self, response):
-        """Simulate streaming by splitting the response into chunks."""
-        # Split the response into chunks (simulate "streaming" of data)
-        chunk_size = 300  # Characters per chunk
-        return [response[i:i + chunk_size] for i in range(0, len(response), chunk_size)]
-
-    def update_response_display(self):
-        """Update the display with the next chunk of the response."""
-        if self.chunk_counter < len(self.response_chunks):
-            self._response_display.append(self.response_chunks[self.chunk_counter])
-            self.chunk_counter += 1
-        else:
-            self.stream_timer.stop()  # Stop the timer when all chunks are displayed
-            self._loading_label.setText("")  # Hide loading message when done
+        # Show loading message
+        self._loading_label.setText("Loading... Please wait.")
+        self._response_display.clear()  # Clear previous responses
+        self._search_button.setEnabled(False)
+        self._cancel_button.setEnabled(True)
+        self._change_folder_button.setEnabled(False)
+
+        # Prepend system message to query
+        self._pending_query = query
+        self._pending_full_query = with_system_message(query)
+        self._query_started = time.monotonic()
+
+        # Run the chain on a worker thread so the window stays responsive while tokens stream in
+        self._query_thread = QThread(self)
+        self._query_worker = QueryWorker(
+            self.chain, self._pending_full_query, self.sessions, self._session_key, asked=self._pending_query
+        )
+        self._query_worker.moveToThread(self._query_thread)
+        self._query_thread.started.connect(self._query_worker.run)
+        self._query_worker.token_received.connect(self._append_token)
+        self._query_worker.prompt_tokens.connect(self._on_prompt_tokens)
+        self._query_worker.answered.connect(self._on_query_answered)
+        self._query_worker.failed.connect(self._on_query_failed)
+        self._query_worker.cancelled.connect(self._on_query_cancelled)
+        for signal in (self._query_worker.answered, self._query_worker.failed, self._query_worker.cancelled):
+            signal.connect(self._query_thread.quit)
+        # The worker may still be saving the turn after it answers; it stays registered until run() returns
+        self._query_thread.finished.connect(self._on_query_thread_finished)
+        self._query_thread.finished.connect(self._query_worker.deleteLater)
+        self._query_thread.finished.connect(self._query_thread.deleteLater)
+        self._query_thread.start()
+
+    def _append_token(self, token):
+        """Append a streamed token to the end of the response display."""
+        if not self._loading_label.text().startswith("Generating"):
+            self._loading_label.setText("Generating...")
+        cursor = self._response_display.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(token)
+        self._response_display.setTextCursor(cursor)
+        self._response_display.ensureCursorVisible()
+
+    def _on_prompt_tokens(self, tokens):
+        self._last_prompt_tokens = tokens
+
+    def _on_query_answered(self, response):
+        # Models that don't stream still deliver the full answer here
+        if not self._response_display.toPlainText():
+            self._response_display.setPlainText(response)
+
+        # Display the query and response in chat history
+        self.add_to_history(f"User: {self._pending_query}")
+        self.add_to_history(f"AI: {response}")
+
+        # Save query and response to history
+        self.save_to_history(self._pending_query, response)
+        self._finish_query()
+        self._loading_label.setText(f"Prompt tokens: {self._last_prompt_tokens}")
+
+    def _on_query_failed(self, error):
+        self._finish_query()
+        QMessageBox.critical(self, "Error", f"Error during query execution: {error}")
+
+    def _on_query_cancelled(self):
+        self._finish_query()
+        self._loading_label.setText("Query cancelled.")
+
+    def _cancel_query(self):
+        if self._query_worker is not None:
+            self._query_worker.cancel()
+            self._cancel_button.setEnabled(False)
+            self._loading_label.setText("Cancelling...")
+
+    def _finish_query(self):
+        self._cancel_button.setEnabled(False)
+        self._loading_label.setText("")  # Hide loading message when done
+
+    def _on_query_thread_finished(self):
+        self._query_worker = None
+        self._query_thread = None
+        self._search_button.setEnabled(self.store is not None and self.store.file_count > 0)
+        self._change_folder_button.setEnabled(self._index_worker is None)
+
+    def closeEvent(self, event):
+        # Let a running query unwind, or an answered one finish saving its turn (which may
+        # summarize the conversation), before the window (and its thread) is destroyed
+        if self._query_worker is not None:
+            self._query_worker.cancel()
+            self._query_thread.quit()
+            self._query_thread.wait(30000)
+        # A cancelled build saves what it has indexed so far before the thread exits
+        if self._index_worker is not None:
+            self._index_worker.cancel()
+            self._index_thread.quit()
+            self._index_thread.wait(30000)
+        super().closeEvent(event)
 
     def save_to_history(self, query, response):
-        try:
-            # Generate timestamp for filename
-            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            filename = f"{timestamp}.txt"
-            filepath = os.path.join(self.history_folder, filename)
-
-            # Save query and response with metadata
-            with open(filepath, 'w') as file:
-                file.write(f"Query Time: {timestamp}\n")
-                file.write(f"Query: {query}\n\n")
-                file.write(f"Response: {response}\n")
-
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to save history: {str(e)}")
+        # Only queues the record; the store's writer thread does the disk I/O
+        self.interactions.record(
+            "desktop", query, response, user_id=getpass.getuser(),
+            latency_ms=int((time.monotonic() - self._query_started) * 1000),
+            prompt_tokens=self._last_prompt_tokens, completion_tokens=count_tokens(response, DEFAULT_MODEL),
+        )
 
     def add_to_history(self, text):
         """Add a new item to the chat history."""
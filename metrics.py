@@ -0,0 +1,226 @@
+# metrics.py
+#
+# Thread-safe counters, gauges and latency histograms with a Prometheus text exposition.
+# Histograms keep cumulative buckets for Prometheus and a bounded window of
+# recent samples for the p50/p95/p99 shown in status messages. Helpers time the
+# stages of a query: embedding calls, retrieval, and LLM time-to-first-token.
+
+import time
+import bisect
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+
+# Seconds; covers everything from a Slack ack to a long map-reduce analysis
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+DEFAULT_WINDOW = 2048  # Recent samples kept for percentiles
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        with self._lock:
+            return self._value
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter", f"{self.name} {self.value}"]
+
+
+class Gauge:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    @property
+    def value(self):
+        with self._lock:
+            return self._value
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.value}"]
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS, window=DEFAULT_WINDOW):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # The last slot is +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self._sum += seconds
+            self._count += 1
+            self._recent.append(seconds)
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def percentiles(self, points=(50, 95, 99)):
+        """Percentiles over the recent window, or None if nothing was observed yet."""
+        with self._lock:
+            samples = sorted(self._recent)
+        if not samples:
+            return None
+        return {point: samples[min(len(samples) - 1, int(len(samples) * point / 100))] for point in points}
+
+    @property
+    def count(self):
+        with self._lock:
+            return self._count
+
+    def render(self):
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += bucket_count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Creates metrics on first use and renders them all for a /metrics endpoint."""
+
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(self.prefix + name, help_text, **kwargs)
+            return metric
+
+    def counter(self, name, help_text=""):
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name, help_text=""):
+        return self._get(Gauge, name, help_text)
+
+    def histogram(self, name, help_text="", **kwargs):
+        return self._get(Histogram, name, help_text, **kwargs)
+
+    def histograms(self):
+        with self._lock:
+            return {name: metric for name, metric in self._metrics.items() if isinstance(metric, Histogram)}
+
+    def render_prometheus(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+    def latency_summary(self):
+        """One line per histogram with observations: count and p50/p95/p99 in milliseconds."""
+        lines = []
+        for name, histogram in self.histograms().items():
+            percentiles = histogram.percentiles()
+            if percentiles:
+                lines.append(
+                    f"{name}: n={histogram.count} p50={percentiles[50] * 1000:.0f}ms "
+                    f"p95={percentiles[95] * 1000:.0f}ms p99={percentiles[99] * 1000:.0f}ms"
+                )
+        return "\n".join(lines)
+
+
+class TimedEmbeddings(Embeddings):
+    """Records the latency of every call to the wrapped embedding model."""
+
+    def __init__(self, underlying, histogram):
+        self.underlying = underlying
+        self.histogram = histogram
+
+    @property
+    def model(self):
+        # CachedEmbeddings keys vectors by this, so it must name the wrapped model, not the wrapper
+        return getattr(self.underlying, "model", None) or type(self.underlying).__name__
+
+    def embed_documents(self, texts):
+        with self.histogram.time():
+            return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text):
+        with self.histogram.time():
+            return self.underlying.embed_query(text)
+
+
+class StageTimer(BaseCallbackHandler):
+    """LangChain callback timing retrieval and the answering LLM of one chain call."""
+
+    def __init__(self, retrieval, llm_first_token, llm_total):
+        self.retrieval = retrieval
+        self.llm_first_token = llm_first_token
+        self.llm_total = llm_total
+        self._started = {}
+        self._first_token_seen = set()
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        if run_id in self._started:
+            self.retrieval.observe(time.perf_counter() - self._started.pop(run_id))
+
+    def _llm_start(self, run_id):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._llm_start(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._llm_start(run_id)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if run_id in self._started and run_id not in self._first_token_seen:
+            self._first_token_seen.add(run_id)
+            self.llm_first_token.observe(time.perf_counter() - self._started[run_id])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        if run_id in self._started:
+            self.llm_total.observe(time.perf_counter() - self._started.pop(run_id))
+        self._first_token_seen.discard(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+        self._first_token_seen.discard(run_id)
@@ -0,0 +1,57 @@
+# qa_chain.py
+#
+# The desktop app's question answering setup: the persisted index for a folder
+# with its embedding cache, vector backend and dedupe settings, and the
+# retrieval chain over it. Shared by the desktop window and batch_query.py so
+# both answer the same question the same way.
+
+import os
+
+from constants import SYSTEM_MESSAGE, OPENAI_API_KEY, DEFAULT_INDEX_FOLDER, DEFAULT_MODEL
+from constants import RETRIEVAL_K, RETRIEVAL_FETCH_K, RETRIEVAL_USE_MMR, CONTEXT_TOKEN_BUDGET, VECTOR_BACKEND
+from constants import DEDUPE_THRESHOLD
+from context_packer import ContextPacker
+from sessions import answer_prompt
+
+
+def open_index(folder_path):
+    """Open the persisted index for a folder with the embedding cache, vector backend and dedupe settings."""
+    from langchain_openai import OpenAIEmbeddings
+    from index_store import PersistentIndex, index_dir_for
+    from embedding_cache import CachedEmbeddings
+
+    embeddings_model = CachedEmbeddings(
+        OpenAIEmbeddings(api_key=OPENAI_API_KEY), os.path.join(DEFAULT_INDEX_FOLDER, "embeddings.sqlite")
+    )
+    return PersistentIndex(
+        folder_path, index_dir_for(folder_path, DEFAULT_INDEX_FOLDER), embeddings_model,
+        backend=VECTOR_BACKEND, dedupe_threshold=DEDUPE_THRESHOLD,
+    )
+
+
+def build_chain(store, return_source_documents=False, wrap_retriever=None):
+    """The retrieval chain over an open index. wrap_retriever(retriever) can decorate its retriever."""
+    from langchain.chains import ConversationalRetrievalChain
+    from langchain_openai import ChatOpenAI
+
+    retriever = store.as_retriever(
+        k=RETRIEVAL_K, fetch_k=RETRIEVAL_FETCH_K, use_mmr=RETRIEVAL_USE_MMR,
+        packer=ContextPacker(DEFAULT_MODEL, budget=CONTEXT_TOKEN_BUDGET),
+    )
+    if wrap_retriever is not None:
+        retriever = wrap_retriever(retriever)
+    # The answer is streamed token by token; question condensing doesn't need to be. A follow-up's
+    # condensed question is only used for retrieval; the answer is for the question as asked.
+    return ConversationalRetrievalChain.from_llm(
+        llm=ChatOpenAI(model=DEFAULT_MODEL, openai_api_key=OPENAI_API_KEY, streaming=True),
+        condense_question_llm=ChatOpenAI(model=DEFAULT_MODEL, openai_api_key=OPENAI_API_KEY),
+        retriever=retriever,
+        return_source_documents=return_source_documents,
+        combine_docs_chain_kwargs={"prompt": answer_prompt()},
+        rephrase_question=False,
+    )
+
+
+def with_system_message(question):
+    """The question as sent to the chain, prefixed with the assistant's instructions."""
+    return f"{SYSTEM_MESSAGE} {question}"
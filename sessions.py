@@ -0,0 +1,203 @@
+# sessions.py
+#
+# Conversation memory for follow-up questions. Each Slack thread or desktop
+# window has a session holding its recent turns and a running summary of the
+# older ones. Once the recent turns grow past a token threshold, all but the
+# last few are folded into the summary, so the history sent to the chain's
+# question-condensing step stays small however long the conversation gets.
+# Sessions live in memory and are dropped after a period of inactivity, and the
+# least recently used ones go first once the store is full.
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SESSIONS = 1000
+DEFAULT_TTL = 24 * 3600  # Seconds of inactivity before a session is forgotten
+DEFAULT_COMPACT_TOKENS = 1500  # Recent-turn tokens that trigger folding older turns into the summary
+DEFAULT_KEEP_TURNS = 2  # Turns kept verbatim after a compaction
+SUMMARY_WORDS = 200
+
+COMPACT_PROMPT = (
+    "Update the running summary of a conversation between a user and an assistant with the new turns below. "
+    "Keep the names, figures, products, decisions and open questions the user may refer back to, and drop "
+    "pleasantries. Reply with the updated summary only, in at most {words} words.\n\n"
+    "Current summary:\n{summary}\n\nNew turns:\n{turns}"
+)
+
+# Answer prompt for chains that get a chat history. The question goes to the answering model as asked,
+# with its instructions; the condensed standalone question is only used for retrieval.
+ANSWER_SYSTEM_PROMPT = (
+    "Use the following pieces of context to answer the user's question. "
+    "If you don't know the answer, just say that you don't know, don't try to make up an answer.\n"
+    "----------------\n{context}\n----------------\n"
+    "Conversation so far (empty for a first question):{chat_history}"
+)
+
+
+def answer_prompt():
+    """The prompt passed as combine_docs_chain_kwargs={"prompt": ...} with rephrase_question=False."""
+    from langchain_core.prompts import ChatPromptTemplate
+
+    return ChatPromptTemplate.from_messages([("system", ANSWER_SYSTEM_PROMPT), ("human", "{question}")])
+
+
+def format_turns(turns):
+    return "\n".join(f"User: {question}\nAssistant: {answer}" for question, answer in turns)
+
+
+def summarize_turns(llm, summary, turns):
+    """Fold turns into summary with llm (anything with invoke(prompt).content)."""
+    prompt = COMPACT_PROMPT.format(words=SUMMARY_WORDS, summary=summary or "(none)", turns=format_turns(turns))
+    return llm.invoke(prompt).content.strip()
+
+
+def _count_tokens(text, model):
+    from context_packer import count_tokens
+
+    return count_tokens(text, model)
+
+
+class _Session:
+    def __init__(self, key):
+        self.key = key
+        self.summary = ""
+        self.turns = []  # (question, answer)
+        self.tokens = 0  # Tokens in turns
+        self.last_used = time.monotonic()
+        self.aliases = set()
+        self.compacting = False  # A summarizer call is folding older turns; they stay in turns until it returns
+        # Guards the fields above; never held across a summarizer call, so a follow-up isn't kept waiting on one
+        self.lock = threading.Lock()
+
+
+class SessionStore:
+    """
+    Bounded, expiring conversation sessions keyed by thread or window.
+
+    summarize(summary, turns) returns a new running summary covering both; without
+    it, turns beyond the threshold are simply dropped.
+    """
+
+    def __init__(self, summarize=None, max_sessions=DEFAULT_MAX_SESSIONS, ttl_seconds=DEFAULT_TTL,
+                 compact_tokens=DEFAULT_COMPACT_TOKENS, keep_turns=DEFAULT_KEEP_TURNS, model=""):
+        self.summarize = summarize
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.compact_tokens = compact_tokens
+        self.keep_turns = keep_turns
+        self.model = model
+        self._sessions = OrderedDict()
+        self._aliases = {}
+        self._lock = threading.Lock()
+        self.compactions = 0
+        self.evictions = 0
+
+    def _drop(self, session):
+        self._sessions.pop(session.key, None)
+        for alias in session.aliases:
+            self._aliases.pop(alias, None)
+
+    def _evict(self, now):
+        # Called with the lock held. Least recently used sessions come first in the OrderedDict.
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            expired = self.ttl_seconds and now - session.last_used > self.ttl_seconds
+            if not expired and len(self._sessions) <= self.max_sessions:
+                break
+            self._drop(session)
+            self.evictions += 1
+
+    def _get(self, key, create=False):
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            key = self._aliases.get(key, key)
+            session = self._sessions.get(key)
+            if session is None and create:
+                session = self._sessions[key] = _Session(key)
+                self._evict(now)
+            if session is not None:
+                session.last_used = now
+                self._sessions.move_to_end(key)
+            return session
+
+    def history(self, key):
+        """Chat history for the chain: the running summary, then the recent turns as messages."""
+        from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+        session = self._get(key)
+        if session is None:
+            return []
+        with session.lock:
+            messages = [SystemMessage(content=f"Summary of the earlier conversation: {session.summary}")] \
+                if session.summary else []
+            for question, answer in session.turns:
+                messages.extend([HumanMessage(content=question), AIMessage(content=answer)])
+        return messages
+
+    def add_turn(self, key, question, answer):
+        """Remember a turn. May compact the session, which calls the summarizer; run it off latency-critical paths."""
+        session = self._get(key, create=True)
+        with session.lock:
+            session.turns.append((question, answer))
+            session.tokens += _count_tokens(f"{question}\n{answer}", self.model)
+            if session.compacting or session.tokens <= self.compact_tokens or len(session.turns) <= self.keep_turns:
+                return
+            session.compacting = True
+            summary, older = session.summary, session.turns[:len(session.turns) - self.keep_turns]
+        self._compact(session, summary, older)
+
+    def _compact(self, session, summary, older):
+        # Runs without the session's lock: follow-ups meanwhile see the older turns verbatim
+        try:
+            if self.summarize is not None:
+                try:
+                    summary = self.summarize(summary, older)
+                except Exception as e:
+                    # Memory stays bounded either way; the summary just misses these turns
+                    logger.warning(f"Could not summarize conversation {session.key}; dropping {len(older)} turn(s): {e}")
+            with session.lock:
+                # Turns added while summarizing come after the older ones, so they are kept
+                session.summary = summary
+                session.turns = session.turns[len(older):]
+                session.tokens = sum(_count_tokens(f"{question}\n{answer}", self.model) for question, answer in session.turns)
+        finally:
+            with session.lock:
+                session.compacting = False
+        with self._lock:
+            self.compactions += 1
+
+    def alias(self, alias, key):
+        """Make alias refer to the session for key, e.g. a reply's message id to its thread."""
+        with self._lock:
+            session = self._sessions.get(self._aliases.get(key, key))
+            if session is not None and alias != session.key:
+                self._aliases[alias] = session.key
+                session.aliases.add(alias)
+
+    def clear(self, key):
+        with self._lock:
+            session = self._sessions.get(self._aliases.get(key, key))
+            if session is not None:
+                self._drop(session)
+
+    def stats(self):
+        with self._lock:
+            self._evict(time.monotonic())
+            return {
+                "sessions": len(self._sessions),
+                "summarized": sum(1 for session in self._sessions.values() if session.summary),
+                "compactions": self.compactions,
+                "evictions": self.evictions,
+            }
+
+    def stats_summary(self):
+        stats = self.stats()
+        return (
+            f"{stats['sessions']} active ({stats['summarized']} with a running summary), "
+            f"{stats['compactions']} compactions, {stats['evictions']} expired or evicted"
+        )
@@ -0,0 +1,93 @@
+# singleflight.py
+#
+# Request coalescing: concurrent calls with the same key share one execution.
+# The first caller (the leader) runs the function; callers that arrive while it
+# is in flight wait for its result instead of starting their own. Items the
+# leader publishes while running (for example streamed tokens) are relayed to
+# every caller's listener, with a replay of anything a late joiner missed.
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.published = []
+        self.listeners = []
+        # Held while delivering items so a late joiner's replay can't interleave with live items
+        self.lock = threading.Lock()
+
+
+class SingleFlight:
+    """Collapse concurrent calls that share a key into one upstream call."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.collapsed = 0
+
+    def _deliver(self, listener, item):
+        try:
+            listener(item)
+        except Exception as e:
+            logger.warning(f"Single-flight listener failed: {e}")
+
+    def _publish(self, call, item):
+        with call.lock:
+            call.published.append(item)
+            for listener in call.listeners:
+                self._deliver(listener, item)
+
+    def do(self, key, fn, listener=None):
+        """
+        Run fn(publish) once for all concurrent callers with this key and return its result.
+
+        fn may call publish(item) to hand intermediate items to every caller's
+        listener. Exceptions raised by fn are re-raised in every caller.
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self.collapsed += 1
+
+        if listener is not None:
+            with call.lock:
+                for item in call.published:
+                    self._deliver(listener, item)
+                call.listeners.append(listener)
+
+        if leader:
+            try:
+                call.result = fn(lambda item: self._publish(call, item))
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "collapsed": self.collapsed,
+                "upstream": self.calls - self.collapsed,
+                "in_flight": len(self._calls),
+            }
@@ -0,0 +1,112 @@
+# work_queue.py
+#
+# A bounded work queue served by a fixed pool of worker threads, plus a small
+# TTL set used to drop duplicate deliveries. The Slack bot acks events
+# immediately and hands the slow retrieval + LLM work to the queue; when the
+# queue is full, submit() refuses the job so the caller can push back instead
+# of piling up threads.
+
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class WorkQueue:
+    """Run submitted callables on a fixed number of threads, refusing work beyond max_size queued jobs."""
+
+    def __init__(self, workers, max_size, name="worker"):
+        self.workers = workers
+        self.max_size = max_size
+        self._queue = queue.Queue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.busy = 0
+        for number in range(workers):
+            threading.Thread(target=self._run, name=f"{name}-{number}", daemon=True).start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs). Returns False without queuing if the queue is full."""
+        try:
+            self._queue.put_nowait((fn, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def _run(self):
+        while True:
+            fn, args, kwargs = self._queue.get()
+            with self._lock:
+                self.busy += 1
+            try:
+                fn(*args, **kwargs)
+                with self._lock:
+                    self.completed += 1
+            except Exception as e:
+                logger.error(f"Error in queued job {getattr(fn, '__name__', fn)}: {e}")
+                with self._lock:
+                    self.failed += 1
+            finally:
+                with self._lock:
+                    self.busy -= 1
+                self._queue.task_done()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "depth": self._queue.qsize(),
+                "max_size": self.max_size,
+                "workers": self.workers,
+                "busy": self.busy,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+
+
+class RecentIds:
+    """A bounded set of ids that forgets entries after ttl_seconds."""
+
+    def __init__(self, ttl_seconds=600, max_size=10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._ids:
+            oldest, added = next(iter(self._ids.items()))
+            if now - added < self.ttl_seconds and len(self._ids) <= self.max_size:
+                break
+            self._ids.popitem(last=False)
+
+    def add(self, item_id):
+        """Remember item_id. Returns False if it was already seen (a duplicate)."""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if item_id in self._ids:
+                return False
+            self._ids[item_id] = now
+            return True
+
+    def discard(self, item_id):
+        """Forget item_id, so a later delivery of it is handled rather than dropped."""
+        with self._lock:
+            self._ids.pop(item_id, None)
+
+    def __contains__(self, item_id):
+        with self._lock:
+            self._expire(time.monotonic())
+            return item_id in self._ids